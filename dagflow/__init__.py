@@ -1,5 +1,6 @@
 from .dag import DAG, Task, ParallelTask, set_tasks_order
 from .do_dag import do_dag
+from .backend import get_backend
 
 __version__ = "0.2.2"
 __author__ = ("Junpeng Fan", )
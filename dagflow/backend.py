@@ -0,0 +1,706 @@
+import os
+import errno
+import signal
+import socket
+import getpass
+import logging
+import threading
+import subprocess
+import time
+import xml.etree.ElementTree as ET
+
+from .dag import dict2str, parse_size
+
+
+LOG = logging.getLogger(__name__)
+
+# the states of a job returned by Backend.poll
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+LOST = "lost"
+
+
+class Backend(object):
+    """
+    interface of the backends to run tasks
+    submit  submit a task and return its run id
+    poll    return the states of running tasks, the status of the scheduler
+            is fetched once for all tasks
+    kill    kill a running task
+    sample  sample the resource usage of running tasks
+    profile return the resource usage of a finished task
+    job_id  the run id of a task saved in journal
+    refresh fetch the status of the scheduler, attach reads the fetched status
+    attach  get the run id of a job submitted by a dead driver if it is alive
+    """
+
+    name = ""
+    # the backend has no scheduler to query, a job exit can be waited by SIGCHLD
+    wait_exit = False
+
+    def submit(self, task):
+        raise NotImplementedError
+
+    def poll(self, tasks):
+        raise NotImplementedError
+
+    def kill(self, task):
+        raise NotImplementedError
+
+    def sample(self, tasks):
+        return 0
+
+    def profile(self, task):
+        return {}
+
+    def job_id(self, task):
+        return task.run_id
+
+    def refresh(self, force=False):
+        return 0
+
+    def attach(self, task, record):
+        return None
+
+
+def session_processes(sid):
+    """
+    the pids of the processes in a session, a local task runs in its own session
+    :param sid:
+    :return: a list of pids
+    """
+    r = []
+
+    try:
+        names = os.listdir("/proc")
+    except OSError:
+        return r
+
+    for name in names:
+
+        if not name.isdigit():
+            continue
+
+        try:
+            with open("/proc/%s/stat" % name) as fh:
+                # the fields after the command: state ppid pgrp session ...
+                fields = fh.read().rsplit(")", 1)[1].split()
+        except (IOError, OSError, IndexError):
+            continue
+
+        if int(fields[3]) == sid:
+            r.append(int(name))
+
+    return r
+
+
+def process_rss(pid):
+    """
+    the resident memory of a process in bytes
+    :param pid:
+    :return:
+    """
+    try:
+        with open("/proc/%s/statm" % pid) as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, IndexError, ValueError):
+        return 0
+
+
+def process_io(pid):
+    """
+    the bytes read from and written to storage by a process
+    :param pid:
+    :return: read_bytes, write_bytes
+    """
+    r = {}
+
+    try:
+        with open("/proc/%s/io" % pid) as fh:
+            for line in fh:
+                key, value = line.split(":", 1)
+                r[key] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+
+    return r.get("read_bytes", 0), r.get("write_bytes", 0)
+
+
+def process_alive(pid, script):
+    """
+    check a process is alive and still runs the script, the pid may be reused
+    :param pid:
+    :param script:
+    :return:
+    """
+    try:
+        with open("/proc/%s/cmdline" % pid) as fh:
+            return script in fh.read().split("\0")
+    except (IOError, OSError):
+        return False
+
+
+class AttachedProcess(object):
+    """
+    a local task started by a dead driver, which is not a child of this
+    process and so can not be waited
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+
+class LocalBackend(Backend):
+    """
+    run tasks as child processes on this machine
+    """
+
+    name = "local"
+    wait_exit = True
+
+    def __init__(self):
+        # {task id: {"rss": peak rss of the process tree, "io": {pid: (read, write)}}}
+        self.samples = {}
+        self.rusages = {}
+
+    def submit(self, task):
+
+        child = subprocess.Popen(
+            ["sh", task.script_path],
+            stdout=open(task.option["o"], "w"),
+            stderr=open(task.option["e"], "w"),
+            # run in a new process group to kill the whole task
+            preexec_fn=os.setsid
+        )
+        LOG.info("running task %r on local, pid: %r" % (task.id, child.pid))
+        self.samples[task.id] = {"rss": 0, "io": {}}
+        task.profile["host"] = socket.gethostname()
+
+        return child
+
+    def reap(self, task, options=0):
+        """
+        reap the child of task by wait4, which also returns the resource
+        usage of the child and all descendants it waited for
+        :param task:
+        :param options: os.WNOHANG to return at once
+        :return: 1 if the child exited, else 0
+        """
+        child = task.run_id
+
+        if child.returncode is not None:
+            return 1
+
+        if isinstance(child, AttachedProcess):
+
+            if process_alive(child.pid, task.script_path):
+                return 0
+
+            # the exit code is lost, the done file tells the result
+            child.returncode = 0
+            return 1
+
+        try:
+            pid, status, rusage = os.wait4(child.pid, options)
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+            # reaped by others
+            child.returncode = 0
+            return 1
+
+        if pid == 0:
+            return 0
+
+        if os.WIFSIGNALED(status):
+            child.returncode = -os.WTERMSIG(status)
+        else:
+            child.returncode = os.WEXITSTATUS(status)
+
+        self.rusages[task.id] = rusage
+
+        return 1
+
+    def poll(self, tasks):
+        r = {}
+
+        for task in tasks:
+
+            if self.reap(task, os.WNOHANG):
+                r[task.id] = DONE
+            else:
+                r[task.id] = RUNNING
+
+        return r
+
+    def kill(self, task, grace=5):
+        """
+        send SIGTERM to the process group of task, and SIGKILL if it is
+        still alive after grace seconds
+        :param task:
+        :param grace:
+        :return:
+        """
+        pid = task.run_id.pid
+        LOG.info("kill task %r on local, pid: %r" % (task.id, pid))
+
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+        end = time.time() + grace
+
+        while not self.reap(task, os.WNOHANG):
+
+            if time.time() < end:
+                time.sleep(0.1)
+                continue
+
+            LOG.warning("task %r is alive %ss after SIGTERM, send SIGKILL" % (task.id, grace))
+
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+            # a process not started by us is reaped by its parent
+            if not isinstance(task.run_id, AttachedProcess):
+                self.reap(task)
+            break
+
+        return 1
+
+    def sample(self, tasks):
+        """
+        sample the memory and io of the process trees of running tasks
+        :param tasks:
+        :return:
+        """
+        for task in tasks:
+
+            if task.id not in self.samples or task.run_id.returncode is not None:
+                continue
+
+            sample = self.samples[task.id]
+            rss = 0
+
+            for pid in session_processes(task.run_id.pid):
+                rss += process_rss(pid)
+                sample["io"][pid] = process_io(pid)
+
+            sample["rss"] = max(sample["rss"], rss)
+
+        return 1
+
+    def profile(self, task):
+        """
+        the resource usage of a finished task, the sampled process tree and
+        the rusage of wait4 are merged since either may miss short processes
+        :param task:
+        :return:
+        """
+        sample = self.samples.pop(task.id, {"rss": 0, "io": {}})
+        rusage = self.rusages.pop(task.id, None)
+        r = {
+            "host": socket.gethostname(),
+            "exit_code": task.run_id.returncode,
+            "peak_rss": sample["rss"],
+            "read_bytes": sum([i[0] for i in sample["io"].values()]),
+            "write_bytes": sum([i[1] for i in sample["io"].values()]),
+        }
+
+        if rusage is None:
+            return r
+
+        r["user_time"] = rusage.ru_utime
+        r["sys_time"] = rusage.ru_stime
+        # ru_maxrss is in kilobytes, the blocks are 512 bytes
+        r["peak_rss"] = max(r["peak_rss"], rusage.ru_maxrss * 1024)
+        r["read_bytes"] = max(r["read_bytes"], rusage.ru_inblock * 512)
+        r["write_bytes"] = max(r["write_bytes"], rusage.ru_oublock * 512)
+
+        return r
+
+    def job_id(self, task):
+        return task.run_id.pid
+
+    def attach(self, task, record):
+
+        # the pid is only meaningful on the host which started the task
+        if record.get("host") and record["host"] != socket.gethostname():
+            return None
+
+        if not process_alive(record["run_id"], task.script_path):
+            return None
+
+        self.samples[task.id] = {"rss": 0, "io": {}}
+
+        return AttachedProcess(record["run_id"])
+
+
+class SGEBackend(Backend):
+    """
+    submit tasks by qsub, the status of all jobs is fetched by one
+    "qstat -xml" and cached, the interval of fetching doubles (up to
+    max_interval) while nothing changed and is reset when jobs changed
+    """
+
+    name = "sge"
+
+    def __init__(self, min_interval=10, max_interval=120):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        # the time of the last successful fetch, jobs is None before it
+        self.last = 0
+        self.jobs = None
+        # the last fetch failed, the cached status may be stale
+        self.failed = False
+        self.died_hosts = []
+        self.submitted = {}
+
+    def submit(self, task):
+
+        cmd = ["qsub", "-terse"] + dict2str(task.option).split() + ["-N", task.id, task.script_path]
+        output = subprocess.check_output(cmd).decode("utf-8").strip()
+        run_id = output.split(".")[0]
+
+        try:
+            int(run_id)
+        except ValueError:
+            LOG.error(output)
+            raise Exception(output)
+
+        self.submitted[run_id] = time.time()
+        LOG.info("qsub task %r on sge, qid: %r" % (task.id, run_id))
+
+        return run_id
+
+    def qstat(self):
+        """
+        get the jobs of the user
+        :return: {job_id: {"status": "r", "node": "node01"}}
+        """
+        r = {}
+        output = subprocess.check_output(["qstat", "-xml", "-u", getpass.getuser()])
+
+        for job in ET.fromstring(output).iter("job_list"):
+            _id = job.findtext("JB_job_number", "").strip()
+            _status = job.findtext("state", "").strip()
+            _queue = job.findtext("queue_name", "") or ""
+
+            # running jobs
+            if "@" in _queue:
+                _node = _queue.split("@")[1].strip()
+            else:
+                _node = ""
+
+            r[_id] = {"status": _status,
+                      "node": _node}
+
+        return r
+
+    def qhost(self):
+        """
+        get the hosts which are down
+        :return: a list of host names
+        """
+        r = []
+        output = subprocess.check_output(["qhost", "-xml"])
+
+        for host in ET.fromstring(output).iter("host"):
+            _name = host.get("name")
+
+            if _name == "global":
+                continue
+
+            for value in host.iter("hostvalue"):
+                if value.get("name") == "load_avg" and (value.text or "").strip() == "-":
+                    r.append(_name)
+
+        return r
+
+    def refresh(self, force=False):
+        """
+        fetch the status of jobs and hosts if the cache is expired
+        :param force: fetch even if the cache is not expired
+        :return: 1 if the status is fetched
+        """
+        now = time.time()
+
+        if not force and self.jobs is not None and not self.failed and now - self.last < self.interval:
+            return 0
+
+        try:
+            jobs = self.qstat()
+            died_hosts = self.qhost()
+        except (OSError, subprocess.CalledProcessError, ET.ParseError) as e:
+            # the fetch is tried again at the next poll, no job is decided until then
+            LOG.warning("failed to get status from sge: %s" % e)
+            self.failed = True
+            return 0
+
+        if jobs == self.jobs:
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.interval = self.min_interval
+
+        self.jobs = jobs
+        self.died_hosts = died_hosts
+        self.last = now
+        self.failed = False
+        LOG.debug("sge status refreshed, next refresh after %ss" % self.interval)
+
+        return 1
+
+    def poll(self, tasks):
+        r = {}
+        self.refresh()
+        jobs = self.jobs
+
+        for task in tasks:
+
+            # a job is done only if a fetch after its submission missed it
+            if jobs is None or self.failed:
+                r[task.id] = RUNNING
+            elif task.run_id in jobs:
+                job = jobs[task.run_id]
+
+                if "E" in job["status"]:
+                    r[task.id] = ERROR
+                elif job["node"] in self.died_hosts:
+                    r[task.id] = LOST
+                else:
+                    r[task.id] = RUNNING
+            # submitted after the status was fetched
+            elif self.submitted.get(task.run_id, 0) >= self.last:
+                r[task.id] = RUNNING
+            else:
+                r[task.id] = DONE
+
+        return r
+
+    def kill(self, task):
+
+        LOG.info("qdel task %r on sge, qid: %r" % (task.id, task.run_id))
+        subprocess.call(["qdel", str(task.run_id)])
+        # the job list changed
+        self.jobs = None
+
+        return 1
+
+    def qacct(self, run_id):
+        """
+        get the accounting record of a finished job
+        :param run_id:
+        :return: {"ru_wallclock": "12s", "maxvmem": "1.2G", ...}
+        """
+        r = {}
+        output = subprocess.check_output(["qacct", "-j", str(run_id)], stderr=subprocess.STDOUT)
+
+        for line in output.decode("utf-8").split("\n"):
+            line = line.strip().split(None, 1)
+
+            if len(line) == 2:
+                r[line[0]] = line[1]
+
+        return r
+
+    def profile(self, task):
+        """
+        the resource usage of a finished task from qacct
+        :param task:
+        :return:
+        """
+        r = {}
+
+        try:
+            record = self.qacct(task.run_id)
+        except (OSError, subprocess.CalledProcessError) as e:
+            # the accounting file may not be written yet
+            LOG.debug("failed to get accounting of task %r from sge: %s" % (task.id, e))
+            return r
+
+        def number(key, scale=1):
+            try:
+                return float(record[key].rstrip("s")) * scale
+            except (KeyError, ValueError):
+                return 0
+
+        r["host"] = record.get("hostname", "")
+        r["user_time"] = number("ru_utime")
+        r["sys_time"] = number("ru_stime")
+        r["peak_rss"] = int(number("ru_maxrss", 1024))
+        r["read_bytes"] = int(number("ru_inblock", 512))
+        r["write_bytes"] = int(number("ru_oublock", 512))
+
+        try:
+            r["peak_vmem"] = parse_size(record.get("maxvmem", "0"))
+        except ValueError:
+            pass
+
+        try:
+            # "137   (killed)" on some versions
+            r["exit_code"] = int(record["exit_status"].split()[0])
+        except (KeyError, IndexError, ValueError):
+            pass
+
+        return r
+
+    def attach(self, task, record):
+        """
+        the job is alive if it is still in qstat and not in error
+        :param task:
+        :param record:
+        :return:
+        """
+        run_id = str(record["run_id"])
+
+        # the status is fetched once by refresh(force=True) before all tasks are attached
+        if self.jobs is None or self.failed or run_id not in self.jobs:
+            return None
+
+        if "E" in self.jobs[run_id]["status"]:
+            return None
+
+        # the job is done only if a fetch after this one misses it
+        self.submitted[run_id] = self.last
+
+        return run_id
+
+
+class FakeBackend(Backend):
+    """
+    an in-process scheduler with the behaviour of sge, jobs are queued and
+    run by threads on fake nodes, used to test dagflow without a cluster.
+    error(run_id) and down(node) simulate "Eqw" jobs and died hosts
+    """
+
+    name = "fake"
+    wait_exit = True
+
+    def __init__(self, slots=4, nodes=("node01", "node02")):
+        self.slots = slots
+        self.nodes = list(nodes)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.queue = []
+        self.died_hosts = []
+        self.job_num = 0
+
+    def submit(self, task):
+
+        with self.lock:
+            self.job_num += 1
+            run_id = str(self.job_num)
+            self.jobs[run_id] = {"task": task, "status": "qw", "node": "", "child": None}
+            self.queue.append(run_id)
+            self._schedule()
+
+        LOG.info("submit task %r on fake scheduler, qid: %r" % (task.id, run_id))
+
+        return run_id
+
+    def _schedule(self):
+        """
+        start the queued jobs while there are free slots, must hold the lock
+        :return:
+        """
+        running = len([i for i in self.jobs.values() if i["status"] == "r"])
+        nodes = [i for i in self.nodes if i not in self.died_hosts] or self.nodes
+
+        while self.queue and running < self.slots:
+            run_id = self.queue.pop(0)
+            job = self.jobs[run_id]
+            job["status"] = "r"
+            job["node"] = nodes[running % len(nodes)]
+            running += 1
+
+            thread = threading.Thread(target=self._run, args=(run_id, job["task"]))
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, run_id, task):
+
+        child = subprocess.Popen(
+            ["sh", task.script_path],
+            stdout=open(task.option["o"], "w"),
+            stderr=open(task.option["e"], "w"),
+            preexec_fn=os.setsid
+        )
+
+        with self.lock:
+            if run_id in self.jobs:
+                self.jobs[run_id]["child"] = child
+
+        child.wait()
+
+        with self.lock:
+            if run_id in self.jobs and "E" not in self.jobs[run_id]["status"]:
+                del self.jobs[run_id]
+            self._schedule()
+
+    def error(self, run_id):
+        with self.lock:
+            self.jobs[run_id]["status"] = "Eqw"
+
+    def down(self, node):
+        with self.lock:
+            self.died_hosts.append(node)
+
+    def poll(self, tasks):
+        r = {}
+
+        with self.lock:
+            for task in tasks:
+
+                if task.run_id not in self.jobs:
+                    r[task.id] = DONE
+                elif "E" in self.jobs[task.run_id]["status"]:
+                    r[task.id] = ERROR
+                elif self.jobs[task.run_id]["node"] in self.died_hosts:
+                    r[task.id] = LOST
+                else:
+                    r[task.id] = RUNNING
+
+        return r
+
+    def kill(self, task):
+
+        LOG.info("kill task %r on fake scheduler, qid: %r" % (task.id, task.run_id))
+
+        with self.lock:
+            job = self.jobs.pop(task.run_id, None)
+
+            if job and job["status"] == "qw":
+                self.queue.remove(task.run_id)
+
+        if job and job["child"]:
+            try:
+                os.killpg(job["child"].pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+        return 1
+
+
+BACKENDS = {
+    "local": LocalBackend(),
+    "sge": SGEBackend(),
+    "fake": FakeBackend(),
+}
+
+
+def get_backend(name):
+    """
+    get the backend object of a task type
+    :param name: local, sge or fake
+    :return:
+    """
+    if name not in BACKENDS:
+        raise Exception("backend %r is not in %s" % (name, sorted(BACKENDS)))
+
+    return BACKENDS[name]
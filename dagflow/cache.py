@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+# the md5 of files checked by this process: {path: (size, mtime, inode, md5)}
+CHECKSUMS = {}
+
+
+def read_md5(path, stat):
+    """
+    the md5 written to path.md5 (by md5sum or grandte prepare), it is only
+    trusted if it is not older than path
+    :param path:
+    :param stat: os.stat of path
+    :return: the md5 or ""
+    """
+    md5 = "%s.md5" % path
+
+    try:
+        if os.stat(md5).st_mtime < stat.st_mtime:
+            return ""
+
+        with open(md5) as fh:
+            value = (fh.read().split() or [""])[0]
+    except (IOError, OSError):
+        return ""
+
+    return value if re.match(r"^[0-9a-f]{32}$", value) else ""
+
+
+def file_checksum(path):
+    """
+    the md5 of the content of a file, a file is read once per process
+    while its size and mtime are not changed
+    :param path:
+    :return:
+    """
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime, stat.st_ino)
+
+    if path in CHECKSUMS and CHECKSUMS[path][:3] == key:
+        return CHECKSUMS[path][3]
+
+    value = read_md5(path, stat)
+
+    if not value:
+        md5 = hashlib.md5()
+
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                md5.update(block)
+
+        value = md5.hexdigest()
+
+    CHECKSUMS[path] = key + (value,)
+
+    return value
+
+
+def file_signature(path):
+    """
+    the signature of a file: size and md5 of its content, so a file written
+    again with the same content (eg. in a new work dir) has the same signature
+    :param path:
+    :return:
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "missing"
+
+    if not os.path.isfile(path):
+        return "%s:%s" % (stat.st_size, int(stat.st_mtime))
+
+    try:
+        return "%s:%s" % (stat.st_size, file_checksum(path))
+    except (IOError, OSError):
+        return "missing"
+
+
+def normalize_script(task):
+    """
+    replace the paths of work_dir, inputs and outputs in the script by
+    placeholders, so the same work in another directory has the same fingerprint
+    :param task:
+    :return:
+    """
+    paths = []
+
+    for i, path in enumerate(task.outputs):
+        paths.append((path, "{output%s}" % i))
+        paths.append((os.path.dirname(path), "{output%s_dir}" % i))
+
+    for i, path in enumerate(task.inputs):
+        paths.append((path, "{input%s}" % i))
+        paths.append((os.path.dirname(path), "{input%s_dir}" % i))
+
+    paths.append((task.work_dir, "{work_dir}"))
+    script = task.script
+
+    # replace the longer paths first, a path only matches a whole path
+    for path, token in sorted(paths, key=lambda x: len(x[0]), reverse=True):
+
+        if len(path) <= 1:
+            continue
+
+        script = re.sub(re.escape(path) + r"(?![\w.-])", token, script)
+
+    return script
+
+
+def fingerprint(task):
+    """
+    the fingerprint of a task: the hash of its script, the signatures of
+    its input files and the versions of its tools
+    :param task:
+    :return:
+    """
+    h = hashlib.sha1()
+    h.update(normalize_script(task).encode("utf-8"))
+
+    for path in task.inputs:
+        h.update(("\ninput\t%s" % file_signature(path)).encode("utf-8"))
+
+    for path in task.outputs:
+        h.update(("\noutput\t%s" % os.path.basename(path)).encode("utf-8"))
+
+    h.update(("\nversions\t%s" % json.dumps(task.versions, sort_keys=True)).encode("utf-8"))
+
+    return h.hexdigest()
+
+
+def link_or_copy(source, target, copy=True):
+    """
+    hard link source to target, copy it if they are on different devices
+    :param source:
+    :param target:
+    :param copy: copy if the hard link fails, else raise OSError
+    :return:
+    """
+    if os.path.lexists(target):
+        os.remove(target)
+
+    try:
+        os.link(source, target)
+    except OSError:
+        if not copy:
+            raise
+        shutil.copy2(source, target)
+
+    return target
+
+
+class TaskCache(object):
+    """
+    a local store of task outputs keyed by the fingerprint of tasks,
+    <cache_dir>/<fp[:2]>/<fp>/ holds the outputs and a manifest
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+
+    def path(self, fp):
+        return os.path.join(self.cache_dir, fp[:2], fp)
+
+    def restore(self, task):
+        """
+        restore the outputs of task from cache
+        :param task:
+        :return: 1 if restored, else 0
+        """
+        if not task.outputs:
+            return 0
+
+        fp = task.get_fingerprint()
+        path = self.path(fp)
+        manifest = os.path.join(path, "manifest.json")
+
+        if not os.path.isfile(manifest):
+            return 0
+
+        with open(manifest) as fh:
+            names = json.load(fh)["outputs"]
+
+        if len(names) != len(task.outputs):
+            return 0
+
+        try:
+            for name, output in zip(names, task.outputs):
+                if not os.path.isdir(os.path.dirname(output)):
+                    os.makedirs(os.path.dirname(output))
+                link_or_copy(os.path.join(path, name), output)
+        except (IOError, OSError) as e:
+            LOG.warning("failed to restore task %r from cache: %s" % (task.id, e))
+            return 0
+
+        task.write_done(fp)
+        LOG.info("task %r restored from cache %r" % (task.id, path))
+
+        return 1
+
+    def store(self, task):
+        """
+        store the outputs of a success task into cache
+        :param task:
+        :return: 1 if stored, else 0
+        """
+        fp = task.done_fingerprint()
+
+        if not task.outputs or not fp:
+            return 0
+
+        path = self.path(fp)
+
+        if os.path.isdir(path):
+            return 1
+
+        tmp = "%s.tmp%s" % (path, os.getpid())
+        names = []
+
+        try:
+            if not os.path.isdir(tmp):
+                os.makedirs(tmp)
+
+            # the outputs are only linked, copying them may fill the file system of the cache
+            for i, output in enumerate(task.outputs):
+                name = "%s_%s" % (i, os.path.basename(output))
+                link_or_copy(output, os.path.join(tmp, name), copy=False)
+                names.append(name)
+
+            with open(os.path.join(tmp, "manifest.json"), "w") as fh:
+                json.dump({"task": task.id, "outputs": names}, fh, indent=2)
+
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            LOG.warning("failed to store task %r into cache: %s" % (task.id, e))
+            shutil.rmtree(tmp, ignore_errors=True)
+            return 0
+
+        LOG.debug("store task %r into cache %r" % (task.id, path))
+
+        return 1
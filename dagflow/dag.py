@@ -2,32 +2,48 @@ import os.path
 from collections import OrderedDict
 import json
 import logging
-import subprocess
+import re
 import time
 
 
 LOG = logging.getLogger(__name__)
+# sge resources which declare the memory of a job, "-l vf=4G"
+MEMORY_RESOURCES = ["vf", "virtual_free", "h_vmem", "s_vmem", "mem_free", "m_mem_free"]
+SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
 
 
 class DAG(object):
 
-    def __init__(self, dag_id):
+    def __init__(self, dag_id, work_dir="."):
+        """
+        :param dag_id:
+        :param work_dir: the json and journal of the DAG are written here, so
+                         runs started from the same directory do not share them
+        """
         self.id = dag_id
+        self.work_dir = os.path.abspath(work_dir)
         self.tasks = OrderedDict()
         LOG.info("create DAG %r" % self.id)
 
+    def path(self, suffix):
+        """
+        the path of a file of the DAG in its work_dir, eg. path("json")
+        :param suffix:
+        :return:
+        """
+        return os.path.join(self.work_dir, "%s.%s" % (self.id, suffix))
+
     def add_task(self, *tasks):
         for task in tasks:
-            assert id not in self.tasks, "task id %r has been exist in DAG" % id
+            assert task.id not in self.tasks, "task id %r has been exist in DAG" % task.id
             self.tasks[task.id] = task
 
         return 1
 
-    def add_dag(self, *dags):
+    def end_tasks(self):
         """
-        add DAG object to DAG
-        :param dags:
-        :return:
+        get the tasks on the end of DAG, which no task depends on
+        :return: a list of tasks
         """
         depends = []
 
@@ -36,19 +52,39 @@ class DAG(object):
             depends += task.depends
 
         depends = set(depends)
-        last_task = []
 
-        # get tasks which is on the end of DAG
+        return [task for id, task in self.tasks.items() if task.id not in depends]
+
+    def set_namespace(self, namespace):
+        """
+        prefix the ids of all tasks (and so their done files) with namespace,
+        used to combine DAGs whose task ids may collide
+        :param namespace:
+        :return:
+        """
+        tasks = OrderedDict()
+
         for id, task in self.tasks.items():
+            task.set_namespace(namespace)
+            tasks[task.id] = task
 
-            if task.id in depends:
-                continue
-            last_task.append(task)
+        self.tasks = tasks
+
+        return 1
+
+    def add_dag(self, *dags):
+        """
+        add DAG object to DAG
+        :param dags:
+        :return:
+        """
+        # get tasks which is on the end of DAG
+        last_task = self.end_tasks()
 
         for dag in dags:
             assert isinstance(dag, DAG)
 
-            for task in dag.tasks:
+            for task in dag.tasks.values():
 
                 if not task.depends:
                     task.set_upstream(*last_task)
@@ -65,7 +101,7 @@ class DAG(object):
 
             jsn.update(task.to_json())
 
-        fn = os.path.abspath("%s.json" % self.id)
+        fn = self.path("json")
 
         with open(fn, "w") as fh:
             json.dump(jsn, fh, indent=2)
@@ -84,7 +120,7 @@ class DAG(object):
     def from_json(cls, filename):
         assert filename.endswith(".json")
 
-        dag = DAG(os.path.basename(filename.rstrip(".json")))
+        dag = DAG(os.path.basename(filename.rstrip(".json")), os.path.dirname(os.path.abspath(filename)))
 
         with open(filename) as fh:
             task_dict = json.load(fh, object_pairs_hook=OrderedDict)
@@ -108,9 +144,10 @@ class Task(object):
 
     TASKS = []
 
-    def __init__(self, id, script, work_dir=".", type="sge", option=""):
+    def __init__(self, id, script, work_dir=".", type="sge", option="", inputs=None, outputs=None, versions=None, estimate=0):
 
-        assert type in ["sge", "local"], "type must be sge or local "
+        from .backend import BACKENDS
+        assert type in BACKENDS, "type must be in %s" % sorted(BACKENDS)
 
         self.id = id
         self.TASKS.append(id)
@@ -119,12 +156,25 @@ class Task(object):
         self.type = type
         self._option = option
         self.done = os.path.join(self.work_dir, "%s_done" % id)
+        # declared files and tool versions, used by the fingerprint of the task
+        self.inputs = [os.path.abspath(i) for i in inputs or []]
+        self.outputs = [os.path.abspath(i) for i in outputs or []]
+        self.versions = versions or {}
+        # the expected run time in seconds, replaced by the time of the last success run
+        self.estimate = estimate
+        # the longest run time from the task to the end of DAG, tasks on the critical path run first
+        self.priority = 0
+        # the namespace given by the DAG combining the task, the stage of the task in a pipeline
+        self.stage = ""
 
         self.depends = []
         self.status = None
         self.run_id = -1
         self.start_time = 0
         self.end_time = 0
+        # the resource usage of the last run: wall_time, user_time, sys_time,
+        # peak_rss, read_bytes and write_bytes
+        self.profile = {}
 
     @property
     def option(self):
@@ -144,6 +194,54 @@ class Task(object):
 
         return option
 
+    @property
+    def script_path(self):
+        """
+        the path of the .sh script of the task
+        :return:
+        """
+        return os.path.join(self.work_dir, "%s.sh" % self.id)
+
+    @property
+    def cpu(self):
+        """
+        the slots declared by "-pe smp N", default 1
+        :return:
+        """
+        pe = self.option.get("pe", "")
+
+        if not isinstance(pe, str) or len(pe.split()) < 2:
+            return 1
+
+        try:
+            return max(int(pe.split()[-1]), 1)
+        except ValueError:
+            LOG.warning("task %r declared a bad parallel environment %r" % (self.id, pe))
+            return 1
+
+    @property
+    def mem(self):
+        """
+        the memory in bytes declared by "-l vf=4G" (or h_vmem, mem_free ...), default 0
+        :return:
+        """
+        resources = self.option.get("l", "")
+
+        if not isinstance(resources, str):
+            return 0
+
+        for resource in resources.replace(",", " ").split():
+
+            if "=" not in resource:
+                continue
+
+            key, value = resource.split("=", 1)
+
+            if key in MEMORY_RESOURCES:
+                return parse_size(value)
+
+        return 0
+
     @property
     def run_time(self):
         """
@@ -181,6 +279,49 @@ class Task(object):
 
         return 1
 
+    def set_namespace(self, namespace):
+        """
+        prefix the id and depends of the task with namespace
+        :param namespace:
+        :return:
+        """
+        self.stage = namespace
+        self.id = "%s_%s" % (namespace, self.id)
+        self.done = os.path.join(self.work_dir, "%s_done" % self.id)
+        self.depends = ["%s_%s" % (namespace, i) for i in self.depends]
+
+        return 1
+
+    def get_fingerprint(self):
+        """
+        the hash of the script, the input files and the tool versions of the task
+        :return:
+        """
+        from .cache import fingerprint
+
+        return fingerprint(self)
+
+    def done_fingerprint(self):
+        """
+        the fingerprint recorded in the done file, "" for done files of old versions
+        :return:
+        """
+        with open(self.done) as fh:
+            return fh.read().strip()
+
+    def write_done(self, fp):
+        """
+        write the done file with fingerprint
+        :param fp:
+        :return:
+        """
+        mkdir(self.work_dir)
+
+        with open(self.done, "w") as fh:
+            fh.write("%s\n" % fp)
+
+        return 1
+
     def write_script(self):
         """
         write script to .sh
@@ -193,15 +334,14 @@ date
 cd {}
 echo task start
 {}
-touch {}
+echo {} >{}
 echo task done
 date
-""".format(self.work_dir, self.script, self.done)
+""".format(self.work_dir, self.script, self.get_fingerprint(), self.done)
 
         mkdir(self.work_dir)
 
-        script_path = os.path.join(self.work_dir, "%s.sh" % self.id)
-        with open(script_path, "w") as fh:
+        with open(self.script_path, "w") as fh:
             fh.write(script)
 
         return 1
@@ -223,87 +363,53 @@ date
 
     def run(self):
         """
-        run the job
+        run the job by the backend of its type
         :return:
         """
+        from .backend import get_backend
 
-        self.write_script()
-
-        if self.type == "sge":
-
-            qsub_option = dict2str(self.option)
-            _id = self.id
-            script_path = os.path.join(self.work_dir, "%s.sh" % self.id)
-            run_cmd = "qsub {qsub_option} -N {_id} {script_path}".format(**locals())
-
-            _id = os.popen(run_cmd).read().strip().split()[2]
-
-            try:
-                int(_id)
-            except:
-                LOG.error(_id)
-                raise Exception(_id)
+        # outputs may be hard links of the cache, never write through them
+        for output in self.outputs:
+            if os.path.lexists(output):
+                os.remove(output)
 
-            self.run_id = _id
-            self.start_time = time.time()
-            self.status = "running"
-            LOG.info("qsub task %r on sge, qid: %r" % (self.id, self.run_id))
-
-            return 0
-
-        elif self.type == "local":
-            script_path = os.path.join(self.work_dir, "%s.sh" % self.id)
-            run_cmd = "sh %s" % script_path
-
-            child = subprocess.Popen(
-                run_cmd,
-                stdout=open(self.option["o"], "w"),
-                stderr=open(self.option["e"], "w"),
-                shell=True
-            )
-
-            self.run_id = child
-            self.start_time = time.time()
-            self.status = "running"
-            LOG.info("running task %r on local, pid: %r" % (self.id, self.run_id.pid))
-
-            return 0
-        else:
-            pass
+        self.write_script()
+        self.profile = {}
+        self.run_id = get_backend(self.type).submit(self)
+        self.start_time = time.time()
+        self.end_time = 0
+        self.status = "running"
 
-        return 1
+        return 0
 
     def kill(self):
         """
 
         :return:
         """
+        from .backend import get_backend
+
         if self.status != "running":
             return 1
 
-        kill_cmd = ""
-        if self.type == "sge":
-            kill_cmd = "qdel %s" % self.run_id
-            LOG.info("qdel task %r on sge, qid: %r" % (self.id, self.run_id))
-        elif self.type == "local":
-            kill_cmd = "kill %s" % self.run_id
-            LOG.info("kill task %r on local, pid: %r" % (self.id, self.run_id))
-        else:
-            pass
-
-        os.popen(kill_cmd)
+        get_backend(self.type).kill(self)
         self.check_done()
 
         return 1
 
     def check_done(self):
         """
-        check the status of done task
+        check the status of done task and collect its resource usage
         :return: success 1 or fail 0
         """
+        from .backend import get_backend
+
+        self.end_time = time.time()
+        self.profile = get_backend(self.type).profile(self)
+        self.profile["wall_time"] = self.end_time - self.start_time
+
         if os.path.isfile(self.done):
             self.status = "success"
-            self.end_time = time.time()
             LOG.info("task %r finished by %s seconds" % (self.id, self.run_time))
 
             return 1
@@ -329,10 +435,16 @@ date
             work_dir=task_dict["work_dir"],
             script=task_dict["script"],
             type=task_dict["type"],
+            inputs=task_dict.get("inputs"),
+            outputs=task_dict.get("outputs"),
+            versions=task_dict.get("versions"),
+            estimate=task_dict.get("estimate", 0),
         )
 
         task._option = dict2str(task_dict["option"])
         task.depends = task_dict["depends"]
+        task.profile = task_dict.get("profile", {})
+        task.stage = task_dict.get("stage", "")
 
         return task
 
@@ -350,9 +462,15 @@ date
                 "type": self.type,
                 "option": self.option,
                 "depends": self.depends,
+                "inputs": self.inputs,
+                "outputs": self.outputs,
+                "versions": self.versions,
+                "estimate": self.estimate,
+                "stage": self.stage,
                 "status": self.status,
                 "start": self.start_time,
-                "end": self.end_time
+                "end": self.end_time,
+                "profile": self.profile
             }
         )}
 
@@ -375,7 +493,15 @@ def mkdir(d):
     return d
 
 
-def ParallelTask(id, script="", work_dir="", type="sge", option="", **extra):
+def ParallelTask(id, script="", work_dir="", type="sge", option="", inputs=None, outputs=None, versions=None, estimate=0, **extra):
+    """
+    create tasks from the lists of extra, the n-th task formats script,
+    work_dir, option, inputs and outputs by the n-th items of the lists
+    :param inputs: files read by each task, formatted like script
+    :param outputs: files written by each task, formatted like script
+    :param versions: tool versions shared by the tasks
+    :return: a list of tasks
+    """
     parallel_num = 0
 
     args = {}
@@ -409,7 +535,11 @@ def ParallelTask(id, script="", work_dir="", type="sge", option="", **extra):
             work_dir=work_dir.format(id=_id, **args),
             script=script.format(**args),
             type=type,
-            option=option.format(**args)
+            option=option.format(**args),
+            inputs=[i.format(id=_id, **args) for i in inputs or []],
+            outputs=[i.format(id=_id, **args) for i in outputs or []],
+            versions=versions,
+            estimate=estimate
         )
 
         tasks.append(task)
@@ -461,6 +591,23 @@ def str2dict(string):
     return r
 
 
+def parse_size(size):
+    """
+    transform a memory size "4G", "500M" or "1.5T" to bytes
+    :param size: str or number, a number without unit is bytes
+    :return: int
+    """
+    if not isinstance(size, str):
+        return int(size)
+
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", size.upper())
+
+    if not match:
+        raise ValueError("%r is not a valid memory size" % size)
+
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
 def dict2str(params, header="-"):
     """
     transform **params to real program param
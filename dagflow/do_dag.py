@@ -1,151 +1,422 @@
 import os
 from collections import OrderedDict
 import sys
+import json
+import errno
+import fcntl
 import logging
+import select
 import time
 import signal
+import multiprocessing
+
+from .dag import parse_size
+from .backend import get_backend, DONE, ERROR, LOST
+from .cache import TaskCache
+from .journal import Journal, SUBMITTED, DONE as JOB_DONE, FAILED, KILLED
 
 
 LOG = logging.getLogger(__name__)
+# seconds between two samples of the resource usage of local tasks
+SAMPLE_TIME = 5
+# the expected run time of tasks without estimate or history, in seconds
+DEFAULT_ESTIMATE = 60
 TASKS = OrderedDict()
 TASK_NAME = ""
+CACHE = None
+JOURNAL = None
 
 
-def qhost():
+class ChildWatcher(object):
     """
-    "get the status of nodes"
-    :return:
+    wake the scheduler up when a local child process exits.
+    SIGCHLD is routed to a self-pipe through signal.set_wakeup_fd, so a child
+    that exits between two polls still wakes the next wait immediately.
     """
-    r = {}
-    contents = os.popen("qhost").read().strip().split("\n")
 
-    for line in contents[2:]:
-        line = line.strip()
-        if len(line) == 0:
-            continue
+    def __init__(self):
+        self._rfd = None
+        self._wfd = None
+        self._old_fd = -1
+        self._old_handler = None
+
+        try:
+            self._rfd, self._wfd = os.pipe()
+
+            for fd in (self._rfd, self._wfd):
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+            self._old_fd = signal.set_wakeup_fd(self._wfd)
+            self._old_handler = signal.signal(signal.SIGCHLD, self._handler)
+            # restart interrupted system calls, e.g. the read of os.popen
+            signal.siginterrupt(signal.SIGCHLD, False)
+        except ValueError:
+            # not in the main thread, fall back to sleep and poll
+            LOG.debug("SIGCHLD can not be watched, poll local tasks by time")
+            self.close()
+
+    @property
+    def active(self):
+        return self._rfd is not None
+
+    def _handler(self, signum, frame):
+        pass
+
+    def wait(self, timeout):
+        """
+        wait a child exit or timeout
+        :param timeout: seconds
+        :return: 1 if a child exit, else 0
+        """
+        if not self.active:
+            time.sleep(timeout)
+            return 0
+
+        try:
+            r, _, _ = select.select([self._rfd], [], [], timeout)
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            r = [self._rfd]
+
+        if not r:
+            return 0
+
+        try:
+            while os.read(self._rfd, 1024):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+        return 1
+
+    def close(self):
+
+        if self._old_handler is not None:
+            signal.signal(signal.SIGCHLD, self._old_handler)
+            signal.set_wakeup_fd(self._old_fd)
+            self._old_handler = None
+
+        for fd in (self._rfd, self._wfd):
+            if fd is not None:
+                os.close(fd)
+
+        self._rfd = self._wfd = None
+
+
+def wait_tasks(tasks, watcher, timeout):
+    """
+    wait until a running task of a backend without scheduler (local) exits
+    or timeout, SIGCHLD of other children only cause a re-check. The resource
+    usage of these tasks is sampled per SAMPLE_TIME meanwhile
+    :param tasks:
+    :param watcher: ChildWatcher object
+    :param timeout: seconds
+    :return: 1 if a task exits, else 0
+    """
+    end = time.time() + timeout
+
+    while 1:
+        running = OrderedDict()
 
-        content = line.split()
-        _name = content[0]
-        _status = content[8]
+        for id, task in tasks.items():
 
-        if _status == "-":
-            _status = "N"
-        else:
-            _status = "Y"
+            if task.status == "running" and get_backend(task.type).wait_exit:
+                running.setdefault(task.type, []).append(task)
 
-        r[_name] = _status
+        for type, _tasks in running.items():
+            backend = get_backend(type)
+            backend.sample(_tasks)
 
-    return r
+            if DONE in backend.poll(_tasks).values():
+                return 1
 
+        remain = end - time.time()
 
-def qstat():
+        if remain <= 0:
+            return 0
+
+        watcher.wait(min(remain, SAMPLE_TIME))
+
+
+def journal(task, event):
     """
-    get the running jobs
+    write the state of task to the journal of the running DAG
+    :param task:
+    :param event:
     :return:
     """
+    if JOURNAL:
+        JOURNAL.write(task, event)
 
-    r = {}
-    user = os.popen('whoami').read().strip()
-    contents = os.popen('qstat -u %s ' % user).read().strip().split('\n')
+    return 1
 
-    # reading qstat content, the first 2 lines are passed
-    for line in contents[2:]:
-        content = line.split()
 
-        _id = content[0]
-        _status = content[4]
+def update_task_status(tasks, stop_on_failure):
+    """
+    check the running tasks, then move the preparing tasks whose depends
+    were all done to waiting, so that a finished task releases its
+    downstream tasks in the same pass
+    :param tasks:
+    :return:
+    """
+    running = OrderedDict()
 
-        # running jobs
-        if "@" in content[7]:
-            _node = content[7].split('@')[1]
-        else:
-            _node = ""
+    for id, task in tasks.items():
 
-        r[_id] = {"status": _status,
-                  "node": _node}
+        # only running tasks are checked here
+        if task.status == "running":
+            running.setdefault(task.type, []).append(task)
 
-    return r
+    # the status of a backend is fetched once for all its tasks,
+    # backends without running tasks are not queried
+    for type, _tasks in running.items():
+        backend = get_backend(type)
+        # the last sample before the exited tasks are reaped
+        backend.sample(_tasks)
+        states = backend.poll(_tasks)
 
+        for task in _tasks:
+            state = states[task.id]
 
-def ps():
-    r = []
-    user = os.popen('whoami').read().strip()
-    contents = os.popen('ps -u %s ' % user).read().strip().split('\n')
+            # check recent done tasks
+            if state == DONE:
+                status = task.check_done()
+                journal(task, JOB_DONE if status else FAILED)
 
-    for line in contents:
-        r.append(line.split()[0])
+                if status and CACHE:
+                    CACHE.store(task)
 
-    return r
+                if not status and stop_on_failure:
+                    LOG.info("Task %r failed, stop all tasks" % task.id)
+                    del_online_tasks()
+            # the job is in error state, eg. Eqw on sge
+            elif state == ERROR:
+                task.kill()
+                journal(task, KILLED)
+            # the node of the job died, run it again
+            elif state == LOST:
+                task.kill()
+                journal(task, KILLED)
+                task.status = "preparing"
+            else:
+                pass
+
+    release_tasks(tasks)
 
+    return tasks
 
-def update_task_status(tasks, stop_on_failure):
-    """
 
+def release_tasks(tasks):
+    """
+    move the preparing tasks whose depends were all done to waiting,
+    a waiting task whose fingerprint is in the cache is restored at once
     :param tasks:
     :return:
     """
-    sge_running_task = qstat()
-    #local_running_task = ps()
+    checked = set()
+    changed = 1
+
+    while changed:
+        changed = 0
+
+        for id, task in tasks.items():
+
+            if task.status == "preparing":
+                # check task depends, if a preparing task's depends submit, change stats to waiting
+                dep_status = 1
+
+                for _id in task.depends:
+
+                    if tasks[_id].status != "success":
+                        dep_status = 0
+                        break
 
-    queue_status = qhost()
-    died_queue = [i for i in queue_status if queue_status[i] == "N"]
+                if dep_status:
+                    task.status = "waiting"
 
+            if task.status != "waiting" or not CACHE or task.id in checked:
+                continue
+
+            checked.add(task.id)
+
+            if CACHE.restore(task):
+                task.status = "success"
+                changed = 1
+
+    return tasks
+
+
+def check_fingerprints(tasks):
+    """
+    a done task runs again if its script, inputs or tool versions changed
+    since it was done, or any task it depends on runs again
+    :param tasks:
+    :return:
+    """
     for id, task in tasks.items():
 
-        # pass success or failed task
-        if task.status in ["success", "failed", "waiting"]:
+        if task.status != "success":
             continue
 
-        # preparing tasks and waiting tasks
-        if task.status == "preparing":
-            # check task depends, if a preparing task's depends submit, change stats to waiting
-            dep_status = 1
+        fp = task.done_fingerprint()
+
+        # done files of old versions have no fingerprint
+        if fp and fp != task.get_fingerprint():
+            LOG.info("task %r changed since it was done, run it again" % task.id)
+            task.status = "preparing"
+
+    changed = 1
+
+    while changed:
+        changed = 0
+
+        for id, task in tasks.items():
+
+            if task.status != "success":
+                continue
 
             for _id in task.depends:
 
                 if tasks[_id].status != "success":
-                    dep_status = 0
+                    task.status = "preparing"
+                    changed = 1
                     break
 
-            if dep_status:
-                task.status = "waiting"
-            continue
+    return tasks
 
-        # check recent done tasks on sge
-        if task.type == "sge" and task.run_id not in sge_running_task:
-            status = task.check_done()
 
-            if not status and stop_on_failure:
-                LOG.info("Task %r failed, stop all tasks" % task.id)
-                del_online_tasks()
+def load_profiles(dag):
+    """
+    keep the resource usage of the tasks done in the previous run, which
+    is in the json of the DAG, the run time of a success run replaces the
+    declared estimate of the task
+    :param dag:
+    :return:
+    """
+    fn = dag.path("json")
+
+    if not os.path.isfile(fn):
+        return 0
+
+    try:
+        with open(fn) as fh:
+            jsn = json.load(fh)
+    except ValueError:
+        LOG.warning("the json of DAG %r is broken: %r" % (dag.id, fn))
+        return 0
+
+    for id, task in dag.tasks.items():
+
+        if id not in jsn:
             continue
-        elif task.type == "local":
-            if task.run_id.poll() is not None:
-                status = task.check_done()
 
-                if not status and stop_on_failure:
-                    LOG.info("Task %r failed, stop all tasks" % task.id)
-                    del_online_tasks()
+        profile = jsn[id].get("profile") or {}
+
+        if jsn[id].get("status") == "success" and profile.get("wall_time"):
+            task.estimate = profile["wall_time"]
+
+        if task.status != "success":
             continue
-        else:
-            pass
 
-        # check sge tasks running status
-        _status = sge_running_task[task.run_id]["status"]
+        task.start_time = jsn[id].get("start", 0)
+        task.end_time = jsn[id].get("end", 0)
+        task.profile = profile
 
-        if _status == "Eqw":
-            task.kill()
+    return 1
 
-        _node = sge_running_task[task.run_id]["node"]
 
-        if _node in died_queue:
-            task.kill()
-            task.status = "preparing"
-    
+def set_priorities(tasks):
+    """
+    set the priority of each task to the longest run time of the paths from
+    it to the end of DAG, so the tasks on the critical path are submitted first
+    :param tasks:
+    :return:
+    """
+    downstream = dict((id, []) for id in tasks)
+
+    for id, task in tasks.items():
+        for _id in task.depends:
+            downstream[_id].append(id)
+
+    # from the end of DAG, a task is ranked after all its downstream tasks
+    remain = dict((id, len(ids)) for id, ids in downstream.items())
+    ends = [id for id, num in remain.items() if not num]
+    ranked = 0
+
+    while ends:
+        id = ends.pop()
+        task = tasks[id]
+        task.priority = (task.estimate or DEFAULT_ESTIMATE) + max([tasks[i].priority for i in downstream[id]] or [0])
+        ranked += 1
+
+        for _id in task.depends:
+            remain[_id] -= 1
+
+            if not remain[_id]:
+                ends.append(_id)
+
+    if ranked != len(tasks):
+        raise Exception("the tasks of DAG depend on each other in a cycle")
+
     return tasks
 
 
-def submit_tasks(tasks, concurrent_tasks):
+def machine_cpus():
+    """
+    the number of cpu cores of this machine
+    :return:
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def machine_mem():
+    """
+    the physical memory of this machine in bytes, 0 if unknown
+    :return:
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def task_resource(task, max_cpus, max_mem):
+    """
+    the cpu and memory a local task takes from the budget, a task asks more
+    than the whole budget is clamped so that it can still run alone
+    :param task:
+    :param max_cpus:
+    :param max_mem:
+    :return: cpu, mem
+    """
+    cpu = task.cpu
+    mem = task.mem
+
+    if max_cpus and cpu > max_cpus:
+        cpu = max_cpus
+
+    if max_mem and mem > max_mem:
+        mem = max_mem
+
+    return cpu, mem
+
+
+def submit_tasks(tasks, concurrent_tasks, max_cpus=0, max_mem=0):
+    """
+    submit waiting tasks by priority, the local tasks are packed into the cpu and
+    memory budget of the machine, smaller tasks backfill when a large one can not fit
+    :param tasks:
+    :param concurrent_tasks: the max number of running tasks
+    :param max_cpus: cpu cores for local tasks, 0 is unlimited
+    :param max_mem: memory in bytes for local tasks, 0 is unlimited
+    :return:
+    """
 
     # limit the max concurrent_tasks
     if concurrent_tasks > 800:
@@ -166,15 +437,41 @@ def submit_tasks(tasks, concurrent_tasks):
     if not waiting_tasks:
         return tasks
 
+    # the longest remaining path first, insertion order for the same priority
+    waiting_tasks.sort(key=lambda x: x.priority, reverse=True)
     task_num = len(running_tasks)
+    used_cpus = 0
+    used_mem = 0
+
+    for task in running_tasks:
+
+        if task.type != "local":
+            continue
+
+        cpu, mem = task_resource(task, max_cpus, max_mem)
+        used_cpus += cpu
+        used_mem += mem
 
     for task in waiting_tasks:
-        task_num += 1
 
-        if task_num > concurrent_tasks:
+        if task_num >= concurrent_tasks:
             break
 
+        if task.type == "local":
+            cpu, mem = task_resource(task, max_cpus, max_mem)
+
+            if max_cpus and used_cpus + cpu > max_cpus:
+                continue
+
+            if max_mem and used_mem + mem > max_mem:
+                continue
+
+            used_cpus += cpu
+            used_mem += mem
+
+        task_num += 1
         task.run()
+        journal(task, SUBMITTED)
 
     return tasks
 
@@ -191,6 +488,7 @@ def del_online_tasks():
 
         if task.status == "running":
             task.kill()
+            journal(task, KILLED)
 
     write_tasks(TASKS)
 
@@ -216,9 +514,18 @@ The following tasks were failed:
         return 0
 
 
-def do_dag(dag, concurrent_tasks=10, refresh_time=60, stop_on_failure=False):
-
-    #dag.to_json()
+def do_dag(dag, concurrent_tasks=10, refresh_time=60, stop_on_failure=False, max_cpus=0, max_mem=0, cache_dir=""):
+    """
+    run the tasks of a DAG
+    :param dag: DAG object
+    :param concurrent_tasks: the max number of running tasks
+    :param refresh_time: seconds between status logs and sge polling
+    :param stop_on_failure: kill all tasks when a task failed
+    :param max_cpus: cpu cores for local tasks, 0 for all cores of the machine
+    :param max_mem: memory for local tasks, eg. "64G", 0 for all memory of the machine
+    :param cache_dir: the store of task outputs reused by other runs, "" to disable
+    :return:
+    """
 
     logging.basicConfig(
         stream=sys.stderr,
@@ -231,8 +538,15 @@ def do_dag(dag, concurrent_tasks=10, refresh_time=60, stop_on_failure=False):
     LOG.info("DAG: %s, %s tasks" % (dag.id, len(dag.tasks)))
     LOG.info("Run with %s tasks concurrent and status refreshed per %ss" % (concurrent_tasks, refresh_time))
 
-    global TASKS
+    max_cpus = int(max_cpus) or machine_cpus()
+    max_mem = parse_size(max_mem) or machine_mem()
+    LOG.info("Local tasks are limited to %s cpus and %.2fG memory" % (max_cpus, max_mem / 1024.0**3))
+
+    global TASKS, CACHE, JOURNAL
     TASKS = dag.tasks
+    CACHE = TaskCache(cache_dir) if cache_dir else None
+    # the jobs of tasks are journaled next to the json of DAG
+    JOURNAL = Journal(dag.path("journal"))
 
     signal.signal(signal.SIGINT, del_task_hander)
     signal.signal(signal.SIGTERM, del_task_hander)
@@ -241,11 +555,22 @@ def do_dag(dag, concurrent_tasks=10, refresh_time=60, stop_on_failure=False):
     for id, task in TASKS.items():
         task.init()
 
-    loop = 0
+    check_fingerprints(TASKS)
+    load_profiles(dag)
+    set_priorities(TASKS)
+    # jobs submitted by a dead driver are still running
+    JOURNAL.attach(TASKS)
+
+    # local tasks are checked as soon as they exit, refresh_time only
+    # controls the status log and the polling of sge tasks
+    watcher = ChildWatcher()
+    update_task_status(TASKS, stop_on_failure)
+    last_info = ""
+    last_log = 0
 
     while 1:
         # qsub tasks
-        submit_tasks(TASKS, concurrent_tasks)
+        submit_tasks(TASKS, concurrent_tasks, max_cpus, max_mem)
 
         task_status = {
             "preparing": [],
@@ -263,15 +588,23 @@ def do_dag(dag, concurrent_tasks=10, refresh_time=60, stop_on_failure=False):
             len(task_status["waiting"]), len(task_status["running"]),
             len(task_status["success"]), len(task_status["failed"]),
         )
-        LOG.info(info)
+        now = time.time()
+
+        if info != last_info or now - last_log >= refresh_time:
+            LOG.info(info)
+            last_info = info
+            last_log = now
 
         # all run
-        if loop != 0 and len(task_status["running"]) == 0:
+        if len(task_status["running"]) == 0:
             break
-        else:
-            time.sleep(refresh_time)
-            loop += 1
-            update_task_status(TASKS, stop_on_failure)
+
+        wait_tasks(TASKS, watcher, last_log + refresh_time - now)
+        update_task_status(TASKS, stop_on_failure)
+
+    watcher.close()
+    # the status and resource usage of tasks, read by "grandte profile"
+    dag.to_json()
 
     # write failed
     status = write_tasks(TASKS)
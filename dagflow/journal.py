@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import logging
+
+from .backend import get_backend
+
+
+LOG = logging.getLogger(__name__)
+
+# the events of a task in journal
+SUBMITTED = "submitted"
+ATTACHED = "attached"
+DONE = "done"
+FAILED = "failed"
+KILLED = "killed"
+
+
+class Journal(object):
+    """
+    an append-only journal of the state transitions of tasks, one json per
+    line, so a restarted DAG knows the jobs submitted by the dead driver
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def read(self):
+        """
+        read the last record of each task
+        :return: {task id: record}
+        """
+        r = {}
+
+        if not os.path.isfile(self.path):
+            return r
+
+        with open(self.path) as fh:
+            for line in fh:
+
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line written by a killed driver may be broken
+                    continue
+
+                r[record["id"]] = record
+
+        return r
+
+    def write(self, task, event):
+        """
+        append the state of task to journal
+        :param task:
+        :param event: submitted, attached, done, failed or killed
+        :return:
+        """
+        record = {
+            "time": time.time(),
+            "id": task.id,
+            "event": event,
+            "type": task.type,
+            "run_id": get_backend(task.type).job_id(task),
+            "host": task.profile.get("host", ""),
+            "start": task.start_time,
+            "end": task.end_time,
+            "exit_code": task.profile.get("exit_code"),
+        }
+
+        if event in [SUBMITTED, ATTACHED]:
+            record["fingerprint"] = task.get_fingerprint()
+
+        with open(self.path, "a") as fh:
+            fh.write("%s\n" % json.dumps(record))
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        return record
+
+    def attach(self, tasks):
+        """
+        re-attach the tasks whose jobs were submitted by a dead driver and
+        are still alive, instead of submitting them again
+        :param tasks:
+        :return: the number of tasks attached
+        """
+        records = self.read()
+        n = 0
+
+        # the status of the scheduler is fetched once for all tasks
+        for name in set([task.type for id, task in tasks.items() if id in records]):
+            get_backend(name).refresh(force=True)
+
+        for id, task in tasks.items():
+
+            if task.status in ["success", "running"] or id not in records:
+                continue
+
+            # the upstream tasks run again, so does the task
+            if [i for i in task.depends if tasks[i].status != "success"]:
+                continue
+
+            record = records[id]
+
+            if record["event"] not in [SUBMITTED, ATTACHED] or record["type"] != task.type:
+                continue
+
+            if record.get("fingerprint") != task.get_fingerprint():
+                LOG.warning("task %r changed since job %r was submitted, run it again" % (id, record["run_id"]))
+                continue
+
+            run_id = get_backend(task.type).attach(task, record)
+
+            if run_id is None:
+                continue
+
+            task.run_id = run_id
+            task.start_time = record["start"]
+            task.end_time = 0
+            task.profile = {"host": record.get("host", "")}
+            task.status = "running"
+            self.write(task, ATTACHED)
+            LOG.info("task %r re-attached to job %r" % (id, record["run_id"]))
+            n += 1
+
+        return n
@@ -12,6 +12,7 @@ from grandte.grand_tir import tir
 from grandte.grand_helitron import helitron
 from grandte.grand_repeat import repeat
 from grandte.grand_all import grand_all
+from grandte.grand_profile import profile
 #from grandte.grand_multi import grand_multi, add_grand_multi_args
 
 from grandte import __version__, __email__, __author__
@@ -56,6 +57,10 @@ def add_grandte_parser(parser):
     grand_all_parser = add_all_args(grand_all_parser)
     grand_all_parser.set_defaults(func=grand_all)
 
+    profile_parser = subparsers.add_parser("profile", help="Rank the tasks of a run by resource usage")
+    profile_parser = add_profile_args(profile_parser)
+    profile_parser.set_defaults(func=profile)
+
 #    grand_multi_parser = subparsers.add_parser("multi", help="Multi-sample analysis of genes")
 #    grand_multi_parser = add_grand_multi_args(grand_multi_parser)
 #    grand_multi_parser.set_defaults(func=grand_multi)
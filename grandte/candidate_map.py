@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+from grandte.config import *
+from grandte.common import get_version
+from dagflow import Task
+
+
+LOG = logging.getLogger(__name__)
+__version__ = "1.0.0"
+__author__ = ("Xingguo Zhang",)
+__email__ = "invicoun@foxmail.com"
+__all__ = ["create_candidate_map_task", "candidate_gff"]
+
+
+def candidate_gff(prefix, tag, out_dir):
+    """
+    the gff of the candidates of a library mapped to genome
+    :param prefix:
+    :param tag:
+    :param out_dir:
+    :return:
+    """
+    return os.path.join(out_dir, "%s.%s.gff3" % (prefix, tag))
+
+
+def create_candidate_map_task(prefix, genome, libraries, thread, job_type, work_dir):
+    """
+    map the candidate libraries to genome by one nucmer per set of nucmer
+    parameters, the sequence ids are tagged by the library and the coords
+    are split per library to gff
+    :param prefix:
+    :param genome:
+    :param libraries: a list of (tag, fasta, source, type, out_dir, nucmer option),
+                      the gff of a library is written to out_dir/prefix.tag.gff3
+    :param thread:
+    :param job_type:
+    :param work_dir:
+    :return: task, option, {tag: gff}
+    """
+    # the libraries mapped with the same parameters share a nucmer
+    groups = OrderedDict()
+
+    for library in libraries:
+        groups.setdefault(library[5], []).append(library)
+
+    option = {}
+    option["nucmer"] = {
+        "version": get_version(SOFTWARE_VERSION["nucmer"]),
+        "option": "; ".join(groups.keys())
+    }
+    maps = []
+    gffs = OrderedDict()
+
+    for n, (nucmer_option, group) in enumerate(groups.items()):
+        name = "%s.%s" % (prefix, n + 1)
+        tags = []
+        splits = []
+
+        for tag, fasta, source, type, out_dir, _ in group:
+            gffs[tag] = candidate_gff(prefix, tag, out_dir)
+            tags.append("""\
+if [ -s {fasta} ] ; then
+    sed 's/^>/>{tag}__/' {fasta} >>{name}.candidates.fasta
+fi""".format(fasta=fasta, tag=tag, name=name))
+            splits.append("""\
+{script}/coords2gff.py {name}.coords --tag {tag} --source {source} --type {type} >{prefix}.{tag}.gff3
+cp {prefix}.{tag}.gff3 {out_dir}""".format(
+                script=SCRIPTS, name=name, prefix=prefix, tag=tag, source=source, type=type, out_dir=out_dir))
+
+        maps.append("""\
+rm -f {name}.candidates.fasta {name}.coords
+touch {name}.candidates.fasta
+{tags}
+if [ -s {name}.candidates.fasta ] ; then
+    nucmer {nucmer_option} -t {thread} -p {name} {name}.candidates.fasta {genome}
+    show-coords {name}.delta -rlo -L 45 >{name}.coords
+else
+    touch {name}.coords
+fi
+{splits}""".format(name=name,
+                   nucmer_option=nucmer_option,
+                   tags="\n".join(tags),
+                   splits="\n".join(splits),
+                   genome=genome,
+                   thread=thread))
+
+    task = Task(
+        id="candidate_map",
+        work_dir=work_dir,
+        type=job_type,
+        option="-pe smp %s " % thread,
+        inputs=[i[1] for i in libraries] + [genome],
+        outputs=[os.path.join(work_dir, "%s.%s.gff3" % (prefix, i)) for i in gffs] + list(gffs.values()),
+        versions=option,
+        estimate=3600,
+        script="""
+export PATH={nucmer}:$PATH
+{maps}
+""".format(nucmer=NUCMER_BIN,
+            maps="\n".join(maps)
+        )
+    )
+
+    return task, option, gffs
@@ -11,7 +11,8 @@ try:
 except:
     from configparser import ConfigParser
 
-from seqkit.FastaReader import open_fasta
+from seqkit.FastaReader import fasta_lengths
+from grandte.tools import REGISTRY
 
 
 LOG = logging.getLogger(__name__)
@@ -266,20 +267,26 @@ def get_genome_size(genome):
     :return:
     """
     r = 0
+    fai = "%s.fai" % genome
 
-    for seq in open_fasta(genome):
-        r += len(seq)
+    # the prepared genome has an index, no need to read the sequences
+    if os.path.isfile(fai) and os.path.getmtime(fai) >= os.path.getmtime(genome):
+        for line in open(fai):
+            r += int(line.split("\t")[1])
 
-    return r / 1000000.0
+        return r / 1000000.0
 
+    for id, length in fasta_lengths(genome):
+        r += length
 
-def get_version(tool):
+    return r / 1000000.0
 
-    _version = os.popen(tool["GETVER"]).read().strip()
 
-    g = re.search("(%s)" % tool["REGEXP"], _version)
-    if g:
-        return g.group(1)
-    else:
-        raise Exception(_version)
+def get_version(tool):
+    """
+    the version of a tool, probed once and cached by the tool registry
+    :param tool: the config of the tool in SOFTWARE_VERSION
+    :return:
+    """
+    return REGISTRY.version(tool)
 
@@ -7,6 +7,10 @@ ROOT = "/export/personal1/zhangxg/my_develop/grandTE/v1.0.0/"
 SCRIPTS = os.path.join(ROOT, "scripts")
 TEMPLATES = os.path.join(ROOT, "templates")
 BIN = os.path.join(ROOT, "grandte")
+# the small caches of grandte, task outputs are cached only in the --cache_dir given
+CACHE_HOME = os.path.join(os.path.expanduser("~"), ".cache", "grandte")
+# the versions of tools probed, keyed by the version command and the mtimes of the tools
+TOOL_CACHE = os.path.join(CACHE_HOME, "tool_versions.json")
 
 
 BLAST_BIN = "/export/personal/software/software/blast/v2.2.26/bin/"
@@ -38,7 +42,12 @@ SOFTWARE_VERSION = {
     "mdust": {
         "GETVER": "ls %s/mdust 2>&1 |grep 'mdust'" % MDUST_BIN,
         "REGEXP": "\d+\.\d+\.\d+",
-        "MINVER": "1.0.0"
+        "MINVER": "0.0.1"
+    },
+    "nucmer": {
+        "GETVER": "%s/nucmer --version 2>&1" % NUCMER_BIN,
+        "REGEXP": "\d+\.\d+\.\d+",
+        "MINVER": "4.0.0"
     },
     "mustv2": {
         "GETVER": "cat %s\mustv2 2>&1 |grep 'PRLSPTH2' |grep 'MUST_Pipe'" % REASONATE_BIN,
@@ -85,6 +94,11 @@ SOFTWARE_VERSION = {
         "REGEXP": "\d+\.\d+\.\d+",
         "MINVER": "1.1.1"
     },
+    "suffixerator": {
+        "GETVER": "export PATH=%s:$PATH;gt suffixerator -version 2>&1 |grep 'GenomeTools'" % REASONATE_BIN,
+        "REGEXP": "\d+\.\d+\.\d+",
+        "MINVER": "1.6.1"
+    },
     "tirvish": {
         "GETVER": "export PATH=%s:$PATH;gt tirvish -version 2>&1 |grep 'GenomeTools'" % REASONATE_BIN,
         "REGEXP": "\d+\.\d+\.\d+",
@@ -10,13 +10,18 @@ import argparse
 
 from grandte.config import *
 from grandte.common import check_path, check_paths, mkdir, get_version
-from grandte.grand_mite import run_mite
-from grandte.grand_ltr import run_ltr
-from grandte.grand_sine import run_sine
-from grandte.grand_tir import run_tir
-from grandte.grand_helitron import run_helitron
-from grandte.grand_repeat import run_repeat
+from grandte.grand_mite import create_mite_dag, mite_libraries, TOOLS as MITE_TOOLS
+from grandte.grand_ltr import create_ltr_dag, TOOLS as LTR_TOOLS
+from grandte.grand_sine import create_sine_dag, sine_libraries, TOOLS as SINE_TOOLS
+from grandte.grand_tir import create_tir_dag, TOOLS as TIR_TOOLS
+from grandte.grand_helitron import create_helitron_dag, TOOLS as HELITRON_TOOLS
+from grandte.grand_repeat import create_repeat_dag, TOOLS as REPEAT_TOOLS
 from grandte.parser import add_all_args
+from grandte.prepare import prepare_genome
+from grandte.gt_index import create_gt_index_task, create_gt_clean_task
+from grandte.candidate_map import create_candidate_map_task
+from grandte.tools import check_tools
+from grandte.stage import stage_signature, read_stage, write_stage
 from dagflow import DAG, Task, do_dag
 
 
@@ -26,10 +31,25 @@ __author__ = ("Xingguo Zhang",)
 __email__ = "invicoun@foxmail.com"
 __all__ = []
 
+DETECTORS = ["mite", "ltr", "sine", "tir", "helitron"]
+# the tools of stages, checked before the stages are built
+STAGE_TOOLS = OrderedDict([
+    ("mite", MITE_TOOLS),
+    ("ltr", LTR_TOOLS),
+    ("sine", SINE_TOOLS),
+    ("tir", TIR_TOOLS),
+    ("helitron", HELITRON_TOOLS),
+    ("database", ["cd-hit"]),
+    ("repeat", REPEAT_TOOLS),
+])
+TOOLS = []
+for tools in STAGE_TOOLS.values():
+    TOOLS += [i for i in tools if i not in TOOLS]
 
-def build_database(prefix, fasts, thread, job_type, work_dir, out_dir, concurrent, refresh):
 
-    fasts = check_paths(fasts)
+def create_database_dag(prefix, fasts, thread, job_type, work_dir, out_dir):
+
+    work_dir = mkdir(work_dir)
 
     option = {}
     option["cd-hit"] = {
@@ -37,12 +57,16 @@ def build_database(prefix, fasts, thread, job_type, work_dir, out_dir, concurren
         "option": "default"
     }
 
-    dag = DAG("build_database")
+    dag = DAG("build_database", work_dir)
     cdhit_task = Task(
         id="cdhit",
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s" % thread,
+        inputs=fasts,
+        outputs=[os.path.join(work_dir, "%s_TE.lib" % prefix)],
+        versions=option,
+        estimate=1800,
         script="""
 export PATH={cdhit}:$PATH
 cat {fasts} >TE.fasta
@@ -58,19 +82,63 @@ cd-hit-est -i TE.fasta -c 0.90 -p 1 -o {prefix}_TE_id.fa -d 0 -g 1 -M 500 -T {th
     )
     dag.add_task(cdhit_task)
 
-    do_dag(dag, concurrent, refresh)
+    return dag, option, os.path.join(work_dir, "%s_TE.lib" % prefix)
+
+
+def build_database(prefix, fasts, thread, job_type, work_dir, out_dir, concurrent, refresh, max_cpus=0, max_mem=0, cache_dir=""):
+
+    fasts = check_paths(fasts)
+
+    dag, option, TE_lib = create_database_dag(
+        prefix=prefix,
+        fasts=fasts,
+        thread=thread,
+        job_type=job_type,
+        work_dir=work_dir,
+        out_dir=out_dir
+    )
+    do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
+
+    return option, TE_lib
 
-    return option, os.path.join(work_dir, "%s_TE.lib" % prefix)
 
+def add_stage(dag, stage, namespace, upstream=None):
+    """
+    add the tasks of a stage DAG to the combined DAG, the task ids are
+    prefixed by namespace to avoid collisions between stages
+    :param dag: the combined DAG
+    :param stage: the DAG of a stage
+    :param namespace:
+    :param upstream: tasks the first tasks of the stage depend on
+    :return: the end tasks of the stage
+    """
+    stage.set_namespace(namespace)
 
-def run_grand_all(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh):
+    if upstream:
+        for id, task in stage.tasks.items():
+            if not task.depends:
+                task.set_upstream(*upstream)
+
+    dag.add_task(*stage.tasks.values())
+
+    return stage.end_tasks()
+
+
+def run_grand_all(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh, max_cpus=0, max_mem=0, cache_dir=""):
+    """
+    run all steps in one DAG:
+    MITE | LTR | SINE | TIR | Helitron -> cd-hit -> RepeatMasker
+    stages done by an earlier run are not built again
+    """
 
     genome = check_path(genome)
     work_dir = mkdir(work_dir)
     out_dir = mkdir(out_dir)
+    # one canonical genome for all stages
+    genome = prepare_genome(prefix, genome, work_dir)
 
     work_dict = {
-        "mit": "01_mit",
+        "mite": "01_mit",
         "ltr": "02_ltr",
         "sine": "03_sine",
         "tir": "04_tir",
@@ -83,96 +151,210 @@ def run_grand_all(prefix, genome, thread, job_type, work_dir, out_dir, concurren
         if v == "database":
             continue
         mkdir(os.path.join(out_dir, v))
-    fasts = []
 
-    options, mite = run_mite(
-        prefix=prefix,
-        genome=genome,
-        thread=thread,
-        job_type=job_type,
-        work_dir=os.path.join(work_dir, work_dict["mit"]),
-        out_dir=os.path.join(out_dir, work_dict["mit"]),
-        concurrent=concurrent,
-        refresh=refresh
-    )
-    fasts.append(mite)
+    def stage_dir(name):
+        return os.path.join(work_dir, work_dict[name])
+
+    # a detector is skipped if an earlier run recorded it done with the same genome and tools,
+    # the database and repeat stages only if all stages they depend on are skipped
+    done = OrderedDict()
+    for name in DETECTORS:
+        done[name] = read_stage(stage_dir(name), stage_signature([genome], STAGE_TOOLS[name]))
+    if all(done.values()):
+        fasts = [done[i]["result"] for i in DETECTORS]
+        done["database"] = read_stage(stage_dir("database"), stage_signature(fasts, STAGE_TOOLS["database"]))
+    if done.get("database"):
+        done["repeat"] = read_stage(stage_dir("repeat"), stage_signature([genome, done["database"]["result"]], STAGE_TOOLS["repeat"]))
+
+    tools = []
+    for name in STAGE_TOOLS:
+        if not done.get(name):
+            tools += [i for i in STAGE_TOOLS[name] if i not in tools]
+    if tools:
+        check_tools(tools)
+
+    options = {
+        "software": OrderedDict(),
+        "database": OrderedDict()
+    }
+    # the stages built in this run: name -> [tasks, options, result, inputs, end tasks]
+    stages = OrderedDict()
+    dag = DAG("grand_all", work_dir)
 
-    option_new, ltr = run_ltr(
-        prefix=prefix,
-        genome=genome,
-        thread=thread,
-        job_type=job_type,
-        work_dir=os.path.join(work_dir, work_dict["ltr"]),
-        out_dir=os.path.join(out_dir, work_dict["ltr"]),
-        concurrent=concurrent,
-        refresh=refresh
-    )
-    fasts.append(ltr)
-    options["software"].update(option_new["software"])
+    def add_built(name, stage, option, result, inputs, upstream=None):
+        ends = add_stage(dag, stage, name, upstream)
+        stages[name] = [list(stage.tasks.values()), option, result, inputs, ends]
 
-    option_new, sine = run_sine(
-        prefix=prefix,
-        genome=genome,
-        thread=thread,
-        job_type=job_type,
-        work_dir=os.path.join(work_dir, work_dict["sine"]),
-        out_dir=os.path.join(out_dir, work_dict["sine"]),
-        concurrent=concurrent,
-        refresh=refresh
-    )
-    fasts.append(sine)
-    options["software"].update(option_new["software"])
+        return ends
 
-    option_new, tir = run_tir(
-        prefix=prefix,
-        genome=genome,
-        thread=thread,
-        job_type=job_type,
-        work_dir=os.path.join(work_dir, work_dict["tir"]),
-        out_dir=os.path.join(out_dir, work_dict["tir"]),
-        concurrent=concurrent,
-        refresh=refresh
-    )
-    fasts.append(tir)
-    options["software"].update(option_new["software"])
+    if not done["mite"]:
+        mite_dag, option, mite = create_mite_dag(
+            prefix=prefix,
+            genome=genome,
+            thread=thread,
+            job_type=job_type,
+            work_dir=stage_dir("mite"),
+            out_dir=os.path.join(out_dir, work_dict["mite"]),
+            map_candidates=False
+        )
+        add_built("mite", mite_dag, option, mite, [genome])
 
-    option_new, helitron = run_helitron(
-        prefix=prefix,
-        genome=genome,
-        thread=thread,
-        job_type=job_type,
-        work_dir=os.path.join(work_dir, work_dict["helitron"]),
-        out_dir=os.path.join(out_dir, work_dict["helitron"]),
-        concurrent=concurrent,
-        refresh=refresh
-    )
-    options["software"].update(option_new["software"])
-    fasts.append(helitron)
+    if not done["ltr"] or not done["tir"]:
+        # the suffix index is built once for ltrharvest and tirvish
+        index_task, index_option, index = create_gt_index_task(
+            prefix=prefix,
+            genome=genome,
+            job_type=job_type,
+            work_dir=os.path.join(work_dir, "00_gt_index")
+        )
+        dag.add_task(index_task)
 
-    option, TE_lib = build_database(
-        prefix=prefix,
-        fasts=fasts,
-        thread=thread,
-        job_type=job_type,
-        work_dir=os.path.join(work_dir, work_dict["database"]),
-        out_dir=os.path.join(work_dir, work_dict["database"]),
-        concurrent=concurrent,
-        refresh=refresh
-    )
-    options["software"].update(option)
+    if not done["ltr"]:
+        ltr_dag, option, ltr = create_ltr_dag(
+            prefix=prefix,
+            genome=genome,
+            thread=thread,
+            job_type=job_type,
+            work_dir=stage_dir("ltr"),
+            out_dir=os.path.join(out_dir, work_dict["ltr"]),
+            index=index
+        )
+        option["software"].update(index_option)
+        add_built("ltr", ltr_dag, option, ltr, [genome])
 
-    option_new, masked_tsv = run_repeat(
-        prefix=prefix,
-        genome=genome,
-        thread=thread,
-        job_type=job_type,
-        work_dir=os.path.join(work_dir, work_dict["repeat"]),
-        out_dir=os.path.join(out_dir, work_dict["repeat"]),
-        concurrent=concurrent,
-        refresh=refresh,
-        lib=TE_lib
-    )
-    options["software"].update(option_new["software"])
+    if not done["sine"]:
+        sine_dag, option, sine = create_sine_dag(
+            prefix=prefix,
+            genome=genome,
+            thread=thread,
+            job_type=job_type,
+            work_dir=stage_dir("sine"),
+            out_dir=os.path.join(out_dir, work_dict["sine"]),
+            map_candidates=False
+        )
+        add_built("sine", sine_dag, option, sine, [genome])
+
+    if not done["mite"] or not done["sine"]:
+        # the candidates of the MITE and SINE stages built in this run are mapped to genome together,
+        # the gff of a finished stage is not written again
+        libraries = []
+        if "mite" in stages:
+            libraries += mite_libraries(prefix, os.path.join(out_dir, work_dict["mite"]))
+        if "sine" in stages:
+            libraries += sine_libraries(prefix, os.path.join(out_dir, work_dict["sine"]))
+        map_task, option, gffs = create_candidate_map_task(
+            prefix=prefix,
+            genome=genome,
+            libraries=libraries,
+            thread=thread,
+            job_type=job_type,
+            work_dir=os.path.join(work_dir, "00_candidate_map")
+        )
+        dag.add_task(map_task)
+        if "mite" in stages:
+            stages["mite"][1]["software"].update(option)
+            map_task.set_upstream(dag.tasks["mite_mite_hunter"])
+            dag.tasks["mite_merge_mite"].set_upstream(map_task)
+        if "sine" in stages:
+            stages["sine"][1]["software"].update(option)
+            map_task.set_upstream(dag.tasks["sine_sine_finder"], dag.tasks["sine_sinescan"])
+            dag.tasks["sine_merge_sine"].set_upstream(map_task)
+
+    if not done["tir"]:
+        tir_dag, option, tir = create_tir_dag(
+            prefix=prefix,
+            genome=genome,
+            thread=thread,
+            job_type=job_type,
+            work_dir=stage_dir("tir"),
+            out_dir=os.path.join(out_dir, work_dict["tir"]),
+            index=index
+        )
+        option["software"].update(index_option)
+        add_built("tir", tir_dag, option, tir, [genome])
+
+    if not done["ltr"] or not done["tir"]:
+        # remove the index after both ltrharvest and tirvish finished
+        clean_task = create_gt_clean_task(
+            index=index,
+            job_type=job_type,
+            work_dir=os.path.join(work_dir, "00_gt_index")
+        )
+        dag.add_task(clean_task)
+        for id in ["ltr_ltrharvest", "tir_tirvish"]:
+            if id in dag.tasks:
+                dag.tasks[id].set_upstream(index_task)
+                clean_task.set_upstream(dag.tasks[id])
+
+    if not done["helitron"]:
+        helitron_dag, option, helitron = create_helitron_dag(
+            prefix=prefix,
+            genome=genome,
+            thread=thread,
+            job_type=job_type,
+            work_dir=stage_dir("helitron"),
+            out_dir=os.path.join(out_dir, work_dict["helitron"])
+        )
+        add_built("helitron", helitron_dag, option, helitron, [genome])
+
+    fasts = []
+    detector_tasks = []
+    for name in DETECTORS:
+        if done[name]:
+            fasts.append(done[name]["result"])
+            options["software"].update(done[name]["options"]["software"])
+        else:
+            fasts.append(stages[name][2])
+            options["software"].update(stages[name][1]["software"])
+            detector_tasks += stages[name][4]
+
+    if done.get("database"):
+        TE_lib = done["database"]["result"]
+        options["software"].update(done["database"]["options"]["software"])
+    else:
+        database_dag, option, TE_lib = create_database_dag(
+            prefix=prefix,
+            fasts=fasts,
+            thread=thread,
+            job_type=job_type,
+            work_dir=stage_dir("database"),
+            out_dir=stage_dir("database")
+        )
+        options["software"].update(option)
+        database_tasks = add_built("database", database_dag, {"software": option}, TE_lib, fasts, detector_tasks)
+
+    if done.get("repeat"):
+        options["software"].update(done["repeat"]["options"]["software"])
+    else:
+        repeat_dag, option, masked_tsv = create_repeat_dag(
+            prefix=prefix,
+            genome=genome,
+            thread=thread,
+            job_type=job_type,
+            work_dir=stage_dir("repeat"),
+            out_dir=os.path.join(out_dir, work_dict["repeat"]),
+            lib=TE_lib
+        )
+        options["software"].update(option["software"])
+        add_built("repeat", repeat_dag, option, masked_tsv, [genome, TE_lib])
+        # only the RepeatMasker chunks need the TE library, RepeatModeler starts at once
+        if "database" in stages:
+            for id, task in repeat_dag.tasks.items():
+                if id.startswith("repeat_RepeatMasker_"):
+                    task.set_upstream(*database_tasks)
+
+    if not dag.tasks:
+        LOG.info("all stages were done")
+        return options
+
+    try:
+        do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
+    finally:
+        # mark the stages done, even if other stages failed
+        for name, (tasks, option, result, inputs, ends) in stages.items():
+            if all([i.status == "success" for i in tasks]):
+                write_stage(stage_dir(name), stage_signature(inputs, STAGE_TOOLS[name]), option, result,
+                            sum([i.outputs for i in tasks], []))
 
     return options
 
@@ -187,7 +369,10 @@ def grand_all(args):
         work_dir=args.work_dir,
         out_dir=args.out_dir,
         concurrent=args.concurrent,
-        refresh=args.refresh
+        refresh=args.refresh,
+        max_cpus=args.max_cpus,
+        max_mem=args.max_mem,
+        cache_dir=args.cache_dir
     )
     with open(os.path.join(args.out_dir, "grandte.json"), "w") as fh:
          json.dump(options, fh, indent=2)
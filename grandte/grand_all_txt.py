@@ -37,7 +37,7 @@ def build_database(prefix, fasts, thread, job_type, work_dir, out_dir, concurren
         "option": "default"
     }
 
-    dag = DAG("build_database")
+    dag = DAG("build_database", work_dir)
     cdhit_task = Task(
         id="cdhit",
         work_dir=work_dir,
@@ -67,7 +67,7 @@ def class_te(tes, job_type, work_dir, out_dir, concurrent, refresh):
 
     tes = check_paths(tes)
 
-    dag = DAG("class_te")
+    dag = DAG("class_te", work_dir)
     class_task = Task(
         id="class",
         work_dir=work_dir,
@@ -3,11 +3,15 @@
 
 import sys
 import json
+import math
 import logging
 import argparse
 
 from grandte.config import *
-from grandte.common import check_path, mkdir, get_version
+from grandte.common import check_path, mkdir, get_version, get_genome_size
+from grandte.prepare import prepare_genome
+from grandte.tools import check_tools
+from grandte.scatter import split_genome, create_scatter_tasks
 from dagflow import DAG, Task, ParallelTask, do_dag
 from grandte.parser import add_helitron_args
 
@@ -20,41 +24,132 @@ __author__ = ("Xingguo Zhang",)
 __email__ = "invicoun@foxmail.com"
 __all__ = []
 
-
-def create_helitronscanner_task(prefix, genome, thread, job_type, work_dir, out_dir):
-
+# the tools checked before a run
+TOOLS = ["helitronscanner"]
+
+# the length of a genome shard in M
+SHARD_SIZE = 200
+# the java heap of helitronscanner in bytes per base of a shard and its minimum in M
+HEAP_PER_BASE = 8
+MIN_HEAP = 2048
+
+
+def shard_heap(shard):
+    """
+    the java heap in M to scan a shard, helitronscanner keeps the whole
+    sequences of a shard in memory
+    :param shard:
+    :return:
+    """
+    return max(int(os.path.getsize(shard) * HEAP_PER_BASE / 1024.0 ** 2), MIN_HEAP)
+
+
+def create_helitronscanner_tasks(prefix, genome, shard_size, job_type, work_dir, out_dir, thread=1):
+    """
+    scan the heads and tails of helitrons in parallel on each shard of genome,
+    pair them by shard and merge the pairs of all shards
+    :param prefix:
+    :param genome:
+    :param shard_size: the length of a shard in M, a longer sequence is a shard itself
+    :param job_type:
+    :param work_dir:
+    :param out_dir:
+    :param thread: the processes splitting genome into shards
+    :return: tasks, option, the fasta of helitrons
+    """
     option = {}
     option["helitronscanner"] = {
         "version": get_version(SOFTWARE_VERSION["helitronscanner"]),
         "option": "default"
     }
 
-    helitronscanner_task = Task(
+    shards = max(int(math.ceil(get_genome_size(genome) / shard_size)), 1)
+    files = split_genome(genome, shards, work_dir, thread)
+    heaps = [shard_heap(i) for i in files]
+    # the jvm needs memory out of the heap
+    mems = ["%sM" % (i + 1024) for i in heaps]
+    estimate = int(3 * 3600 * shard_size / 1000)
+
+    scan_tasks = {}
+    for scan in ["scanHead", "scanTail"]:
+        scan_tasks[scan] = create_scatter_tasks(
+            id=scan,
+            shards=files,
+            script="""
+export PATH={reasonaTE}:$PATH
+export _JAVA_OPTIONS=-Xmx{heap}M
+helitronscanner {scan} -g {shard} -bs 0 -o {prefix}.{scan}.txt
+""",
+            job_type=job_type,
+            work_dir=work_dir,
+            option="-pe smp 1 -l vf={mem}",
+            outputs=[os.path.join(work_dir, "{id}", "%s.%s.txt" % (prefix, scan))],
+            versions=option,
+            estimate=estimate,
+            reasonaTE=REASONATE_BIN,
+            scan=scan,
+            prefix=prefix,
+            heap=heaps,
+            mem=mems
+        )
+
+    pair_tasks = create_scatter_tasks(
+        id="pairends",
+        shards=files,
+        script="""
+export PATH={reasonaTE}:$PATH
+export _JAVA_OPTIONS=-Xmx{heap}M
+helitronscanner pairends -hs {head} -ts {tail} -o {prefix}.helitronscanner.tsv
+""",
+        job_type=job_type,
+        work_dir=work_dir,
+        option="-pe smp 1 -l vf={mem}",
+        inputs=["{head}", "{tail}"],
+        outputs=[os.path.join(work_dir, "{id}", "%s.helitronscanner.tsv" % prefix)],
+        versions=option,
+        reasonaTE=REASONATE_BIN,
+        prefix=prefix,
+        heap=MIN_HEAP,
+        mem="%sM" % (MIN_HEAP + 1024),
+        head=[os.path.join(i.work_dir, "%s.scanHead.txt" % prefix) for i in scan_tasks["scanHead"]],
+        tail=[os.path.join(i.work_dir, "%s.scanTail.txt" % prefix) for i in scan_tasks["scanTail"]]
+    )
+    for head_task, tail_task, pair_task in zip(scan_tasks["scanHead"], scan_tasks["scanTail"], pair_tasks):
+        pair_task.set_upstream(head_task, tail_task)
+
+    # the shards keep whole sequences, so the pairs keep the coordinates of genome
+    pairs = [os.path.join(i.work_dir, "%s.helitronscanner.tsv" % prefix) for i in pair_tasks]
+    merge_task = Task(
         id="helitronscanner",
         work_dir=work_dir,
         type=job_type,
-        option="-pe smp %s" % thread,
+        option="-pe smp 1",
+        inputs=pairs + [genome],
+        outputs=[os.path.join(work_dir, "%s.helitron.fasta" % prefix),
+                 os.path.join(out_dir, "%s.helitronscanner.tsv" % prefix),
+                 os.path.join(out_dir, "%s.helitron.gff" % prefix),
+                 os.path.join(out_dir, "%s.helitron.fasta" % prefix)],
+        versions=option,
         script="""
-export PATH={reasonaTE}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
-helitronscanner scanHead -g {prefix}.fasta -bs 0 -o {prefix}.scanHead.txt
-helitronscanner scanTail -g {prefix}.fasta -bs 0 -o {prefix}.scanTail.txt
-helitronscanner pairends -hs {prefix}.scanHead.txt -ts {prefix}.scanTail.txt -o {prefix}.helitronscanner.tsv
+ln -sf {genome} {prefix}.fasta
+{script}/gather_shards.py {pairs} -f tsv >{prefix}.helitronscanner.tsv
 {script}/helitron2gff.py {prefix}.helitronscanner.tsv > {prefix}.helitron.gff
 {script}/get_gff2fa.py {prefix}.helitron.gff -g {prefix}.fasta -tp all >{prefix}.helitron.fasta
 cp {prefix}.helitronscanner.tsv {prefix}.helitron.gff {prefix}.helitron.fasta {out_dir}
-""".format(reasonaTE=REASONATE_BIN,
-            script=SCRIPTS,
+""".format(script=SCRIPTS,
+            pairs=" ".join(pairs),
             prefix=prefix,
             genome=genome,
             out_dir=out_dir
         )
     )
+    merge_task.set_upstream(*pair_tasks)
+    tasks = scan_tasks["scanHead"] + scan_tasks["scanTail"] + pair_tasks + [merge_task]
 
-    return helitronscanner_task, option, os.path.join(work_dir, "%s.helitron.fasta" % prefix)
+    return tasks, option, os.path.join(work_dir, "%s.helitron.fasta" % prefix)
 
 
-def run_helitron(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh):
+def create_helitron_dag(prefix, genome, thread, job_type, work_dir, out_dir, shard_size=SHARD_SIZE):
 
     genome = check_path(genome)
     work_dir = mkdir(work_dir)
@@ -70,20 +165,36 @@ def run_helitron(prefix, genome, thread, job_type, work_dir, out_dir, concurrent
     for k, v in work_dict.items():
         mkdir(os.path.join(work_dir, v))
    
-    dag = DAG("grand_helitron")
+    dag = DAG("grand_helitron", work_dir)
  
-    helitronscanner_task, option, helitron = create_helitronscanner_task(
+    helitronscanner_tasks, option, helitron = create_helitronscanner_tasks(
         prefix=prefix,
         genome=genome,
-        thread=thread,
+        shard_size=shard_size,
         job_type=job_type,
         work_dir=os.path.join(work_dir, work_dict["helitron"]),
-        out_dir=out_dir
+        out_dir=out_dir,
+        thread=thread
     )
     options["software"].update(option)
-    dag.add_task(helitronscanner_task)
+    dag.add_task(*helitronscanner_tasks)
+
+    return dag, options, helitron
 
-    do_dag(dag, concurrent, refresh)
+
+def run_helitron(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh, max_cpus=0, max_mem=0, cache_dir=""):
+
+    check_tools(TOOLS)
+    genome = prepare_genome(prefix, genome, work_dir)
+    dag, options, helitron = create_helitron_dag(
+        prefix=prefix,
+        genome=genome,
+        thread=thread,
+        job_type=job_type,
+        work_dir=work_dir,
+        out_dir=out_dir
+    )
+    do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
 
     return options, helitron
 
@@ -98,7 +209,10 @@ def helitron(args):
         work_dir=args.work_dir,
         out_dir=args.out_dir,
         concurrent=args.concurrent,
-        refresh=args.refresh
+        refresh=args.refresh,
+        max_cpus=args.max_cpus,
+        max_mem=args.max_mem,
+        cache_dir=args.cache_dir
     )
     with open(os.path.join(args.out_dir, "grand_helitron.json"), "w") as fh:
          json.dump(options, fh, indent=2)
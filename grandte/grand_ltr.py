@@ -8,6 +8,9 @@ import argparse
 
 from grandte.config import *
 from grandte.common import check_path, mkdir, get_version
+from grandte.prepare import prepare_genome
+from grandte.tools import check_tools
+from grandte.gt_index import create_gt_index_task, create_gt_clean_task, gt_index_script
 from dagflow import DAG, Task, ParallelTask, do_dag
 from grandte.parser import add_ltr_args
 
@@ -20,6 +23,9 @@ __author__ = ("Xingguo Zhang",)
 __email__ = "invicoun@foxmail.com"
 __all__ = []
 
+# the tools checked before a run
+TOOLS = ["ltr_finder", "LTR_FINDER_parallel", "ltrharvest", "ltr_retriever", "suffixerator"]
+
 
 def create_ltr_finder_task(prefix, genome, thread, job_type, work_dir, out_dir):
 
@@ -33,6 +39,11 @@ def create_ltr_finder_task(prefix, genome, thread, job_type, work_dir, out_dir):
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s" % thread,
+        inputs=[genome],
+        outputs=[os.path.join(out_dir, "%s.ltr_finder.gff" % prefix),
+                 os.path.join(out_dir, "%s.ltr_finder.fasta" % prefix)],
+        versions=option,
+        estimate=4 * 3600,
         script="""
 export PATH={ltr_finder}:$PATH
 #ltr_finder {genome} -C -w 0 >{prefix}.ltr_finder.tsv
@@ -62,9 +73,15 @@ def create_ltr_finder_parallel_task(prefix, genome, thread, job_type, work_dir,
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s" % thread,
+        inputs=[genome],
+        outputs=[os.path.join(work_dir, "%s.ltr_finder.scn" % prefix),
+                 os.path.join(out_dir, "%s.ltr_finder.gff3" % prefix),
+                 os.path.join(out_dir, "%s.ltr_finder.scn" % prefix)],
+        versions=option,
+        estimate=4 * 3600,
         script="""
 export PATH={LTR_FINDER_parallel}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
+ln -sf {genome} {prefix}.fasta
 LTR_FINDER_parallel -seq {prefix}.fasta -threads {thread} -harvest_out
 mv {prefix}.fasta.finder.combine.gff3 {prefix}.ltr_finder.gff3
 mv {prefix}.fasta.finder.combine.scn {prefix}.ltr_finder.scn
@@ -81,7 +98,7 @@ cp {prefix}.ltr_finder.gff3 {prefix}.ltr_finder.scn {out_dir}
     return ltr_finder_task, option, os.path.join(work_dir, "%s.ltr_finder.scn" % prefix)
 
 
-def create_ltrharvest_task(prefix, genome, thread, job_type, work_dir, out_dir):
+def create_ltrharvest_task(prefix, genome, index, thread, job_type, work_dir, out_dir):
 
     option = {}
     option["ltrharvest"] = {
@@ -93,14 +110,20 @@ def create_ltrharvest_task(prefix, genome, thread, job_type, work_dir, out_dir):
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s" % thread,
+        inputs=[genome],
+        outputs=[os.path.join(work_dir, "%s.ltrharvest.tsv" % prefix),
+                 os.path.join(out_dir, "%s.ltrharvest.tsv" % prefix)],
+        versions=option,
+        estimate=3600,
         script="""
 export PATH={reasonaTE}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
-gt suffixerator -db {prefix}.fasta -indexname {prefix}.index -tis -suf -lcp -des -ssp -sds -dna
-gt ltrharvest -index {prefix}.index > {prefix}.ltrharvest.tsv
+ln -sf {genome} {prefix}.fasta
+{index}
+gt ltrharvest -index $index > {prefix}.ltrharvest.tsv
 cp {prefix}.ltrharvest.tsv {out_dir}
-rm {prefix}.index.*
+rm -f {prefix}.index.*
 """.format(reasonaTE=REASONATE_BIN,
+            index=gt_index_script(prefix, index, work_dir),
             prefix=prefix,
             genome=genome,
             out_dir=out_dir
@@ -123,9 +146,16 @@ def create_ltr_retriever_task(prefix, genome, ltr_finder, ltrharvest, thread, jo
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s" % thread,
+        inputs=[genome, ltr_finder, ltrharvest],
+        outputs=[os.path.join(work_dir, "%s.ltr_retriever.fasta" % prefix),
+                 os.path.join(out_dir, "%s.ltr_retriever.scn" % prefix),
+                 os.path.join(out_dir, "%s.ltr_retriever.gff" % prefix),
+                 os.path.join(out_dir, "%s.ltr_retriever.fasta" % prefix)],
+        versions=option,
+        estimate=2 * 3600,
         script="""
 export PATH={ltr_retriever}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
+ln -sf {genome} {prefix}.fasta
 cat {ltr_finder} {ltrharvest} >{prefix}.rawLTR.scn
 LTR_retriever -genome {prefix}.fasta -inharvest {prefix}.rawLTR.scn -threads {thread}
 {script}/scn2gff.py {prefix}.fasta.retriever.all.scn >{prefix}.ltr_retriever.gff
@@ -146,7 +176,11 @@ cp {prefix}.ltr_retriever.scn {prefix}.ltr_retriever.gff {prefix}.ltr_retriever.
     return retriever_task, option, os.path.join(work_dir, "%s.ltr_retriever.fasta" % prefix)
 
 
-def run_ltr(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh):
+def create_ltr_dag(prefix, genome, thread, job_type, work_dir, out_dir, index=""):
+    """
+    :param index: the suffix index shared with tirvish, which is built and
+                  removed by the caller, if not set the DAG builds its own
+    """
 
     genome = check_path(genome)
     work_dir = mkdir(work_dir)
@@ -163,7 +197,7 @@ def run_ltr(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, ref
     for k, v in work_dict.items():
         mkdir(os.path.join(work_dir, v))
 
-    dag = DAG("grand_ltr")
+    dag = DAG("grand_ltr", work_dir)
     ltr_finder_task, option, ltr_finder = create_ltr_finder_parallel_task(
         prefix=prefix,
         genome=genome,
@@ -175,9 +209,22 @@ def run_ltr(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, ref
     options["software"].update(option)
     dag.add_task(ltr_finder_task)
 
+    index_task = None
+
+    if not index:
+        index_task, option, index = create_gt_index_task(
+            prefix=prefix,
+            genome=genome,
+            job_type=job_type,
+            work_dir=os.path.join(work_dir, "00_gt_index")
+        )
+        options["software"].update(option)
+        dag.add_task(index_task)
+
     ltrharvest_task, option, ltrharvest = create_ltrharvest_task(
         prefix=prefix,
         genome=genome,
+        index=index,
         thread=thread,
         job_type=job_type,
         work_dir=os.path.join(work_dir, work_dict["ltrharvest"]),
@@ -186,6 +233,16 @@ def run_ltr(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, ref
     options["software"].update(option)
     dag.add_task(ltrharvest_task)
 
+    if index_task:
+        ltrharvest_task.set_upstream(index_task)
+        clean_task = create_gt_clean_task(
+            index=index,
+            job_type=job_type,
+            work_dir=os.path.join(work_dir, "00_gt_index")
+        )
+        dag.add_task(clean_task)
+        clean_task.set_upstream(ltrharvest_task)
+
     retriever_task, option, retriever = create_ltr_retriever_task(
         prefix=prefix,
         genome=genome,
@@ -201,7 +258,22 @@ def run_ltr(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, ref
     retriever_task.set_upstream(ltr_finder_task)
     retriever_task.set_upstream(ltrharvest_task)
 
-    do_dag(dag, concurrent, refresh)
+    return dag, options, retriever
+
+
+def run_ltr(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh, max_cpus=0, max_mem=0, cache_dir=""):
+
+    check_tools(TOOLS)
+    genome = prepare_genome(prefix, genome, work_dir)
+    dag, options, retriever = create_ltr_dag(
+        prefix=prefix,
+        genome=genome,
+        thread=thread,
+        job_type=job_type,
+        work_dir=work_dir,
+        out_dir=out_dir
+    )
+    do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
 
     return options, retriever
 
@@ -217,7 +289,10 @@ def ltr(args):
         work_dir=args.work_dir,
         out_dir=args.out_dir,
         concurrent=args.concurrent,
-        refresh=args.refresh
+        refresh=args.refresh,
+        max_cpus=args.max_cpus,
+        max_mem=args.max_mem,
+        cache_dir=args.cache_dir
     )
     with open(os.path.join(args.out_dir, "grand_ltr.json"), "w") as fh:
          json.dump(options, fh, indent=2)
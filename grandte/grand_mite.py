@@ -8,6 +8,9 @@ import argparse
 
 from grandte.config import *
 from grandte.common import check_path, mkdir, get_version
+from grandte.prepare import prepare_genome
+from grandte.tools import check_tools
+from grandte.candidate_map import create_candidate_map_task, candidate_gff
 from dagflow import DAG, Task, ParallelTask, do_dag
 from grandte.parser import add_mite_args
 
@@ -20,6 +23,11 @@ __author__ = ("Xingguo Zhang",)
 __email__ = "invicoun@foxmail.com"
 __all__ = []
 
+# the tools checked before a run
+TOOLS = ["blastn", "muscle", "mdust", "mustv2", "mitetracker", "miteFinderII", "nucmer"]
+# the nucmer parameters to map the MITE-Hunter candidates
+NUCMER_OPTION = "--maxmatch --nosimplify -g 200 -c 50 -l 25"
+
 
 def create_mite_hunter_task(prefix, genome, thread, job_type, work_dir, out_dir):
 
@@ -46,10 +54,14 @@ def create_mite_hunter_task(prefix, genome, thread, job_type, work_dir, out_dir)
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s -V " % thread,
+        inputs=[genome],
+        outputs=[os.path.join(out_dir, "%s.mite_hunter.fasta" % prefix)],
+        versions=option,
+        estimate=3 * 3600,
         script="""
 export PATH={blastn}:{muscle}:$PATH
 export PATH={mdust}:{mite_hunter}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
+ln -sf {genome} {prefix}.fasta
 MITE_Hunter_manager.pl -i {prefix}.fasta -g {prefix} \\
 -n 20 -P 1.0 -S 12345678 -c 24
 cat *_singlet.fa > {prefix}.mite_hunter.fasta
@@ -66,34 +78,17 @@ rm -rf {prefix}*
         )
     )
 
-    nucmer_task = Task(
-        id="nucmer",
-        work_dir=work_dir,
-        type=job_type,
-        option="-pe smp %s " % thread,
-        script="""
-export PATH={nucmer}:$PATH
-if [ -s {out_dir}/{prefix}.mite_hunter.fasta ] ; then
-    nucmer --maxmatch --nosimplify -g 200 -c 50 -l 25 -t {thread} -p {prefix} {out_dir}/{prefix}.mite_hunter.fasta {genome}
-    show-coords {prefix}.delta -rlo -L 45 >{prefix}.coords
-    {script}/coords2gff.py {prefix}.coords >{prefix}.mite_hunter.gff3
-else
-    touch {prefix}.mite_hunter.gff3
-fi
-cp {prefix}.mite_hunter.gff3 {out_dir}
-""".format(nucmer=NUCMER_BIN,
-            script=SCRIPTS,
-            prefix=prefix,
-            genome=genome,
-            thread=thread,
-            work_dir=work_dir,
-            out_dir=out_dir
-        )
-    )
+    return mite_hunter_task, option, os.path.join(out_dir, "%s.mite_hunter.fasta" % prefix)
 
-    nucmer_task.set_upstream(mite_hunter_task)
 
-    return mite_hunter_task, nucmer_task, option, os.path.join(out_dir, "%s.mite_hunter.gff3" % prefix)
+def mite_libraries(prefix, out_dir):
+    """
+    the candidate libraries of MITE mapped to genome by nucmer
+    :param prefix:
+    :param out_dir:
+    :return: a list of (tag, fasta, source, type, out_dir, nucmer option)
+    """
+    return [("mite_hunter", os.path.join(out_dir, "%s.mite_hunter.fasta" % prefix), "Mite_Hunter", "MITE", out_dir, NUCMER_OPTION)]
 
 
 def create_mustv2_task(prefix, genome, thread, job_type, work_dir, out_dir):
@@ -108,10 +103,14 @@ def create_mustv2_task(prefix, genome, thread, job_type, work_dir, out_dir):
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s -V " % thread,
+        inputs=[genome],
+        outputs=[os.path.join(work_dir, "%s.mustv2.tsv" % prefix), os.path.join(out_dir, "%s.mustv2.tsv" % prefix)],
+        versions=option,
+        estimate=3600,
         script="""
 export PATH={reasonaTE}:$PATH
 mkdir -p temp
-cut -d " " -f1 {genome} >{prefix}.fasta
+ln -sf {genome} {prefix}.fasta
 
 if [ ! -e {prefix}.mustv2.tsv ]; then
     mustv2 {prefix}.fasta {prefix}.mustv2.tsv temp
@@ -142,10 +141,16 @@ def create_mitetracker_task(prefix, genome, thread, job_type, work_dir, out_dir)
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s" % thread,
+        inputs=[genome],
+        outputs=[os.path.join(work_dir, "%s.mitetracker.gff3" % prefix),
+                 os.path.join(out_dir, "%s.mitetracker.fasta" % prefix),
+                 os.path.join(out_dir, "%s.mitetracker.gff3" % prefix)],
+        versions=option,
+        estimate=3600,
         script="""
 export PATH={reasonaTE}:$PATH
 mkdir results
-cut -d " " -f1 {genome} >{prefix}.fasta
+ln -sf {genome} {prefix}.fasta
 mitetracker -g {prefix}.fasta -j jobName -w {thread}
 cp results/jobName/all.fasta {prefix}.mitetracker.fasta
 cp results/jobName/all.gff3 {prefix}.mitetracker.gff3
@@ -174,9 +179,14 @@ def create_miteFinderII_task(prefix, genome, thread, job_type, work_dir, out_dir
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s" % thread,
+        inputs=[genome],
+        outputs=[os.path.join(work_dir, "%s.miteFinderII.tsv" % prefix),
+                 os.path.join(out_dir, "%s.miteFinderII.tsv" % prefix)],
+        versions=option,
+        estimate=600,
         script="""
 export PATH={reasonaTE}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
+ln -sf {genome} {prefix}.fasta
 miteFinderII -input {prefix}.fasta -output {prefix}.miteFinderII.tsv
 cp {prefix}.miteFinderII.tsv {out_dir}
 """.format(reasonaTE=REASONATE_BIN,
@@ -197,6 +207,9 @@ def create_merge_mite_task(prefix, genome, mite_hunter, mitetracker, mustv2, mit
         work_dir=work_dir,
         type=job_type,
         option="-pe smp 1",
+        inputs=[mite_hunter, mitetracker, mustv2, miteFinderII, genome],
+        outputs=[os.path.join(out_dir, "%s.MITE.gff3" % prefix),
+                 os.path.join(out_dir, "%s.MITE.fasta" % prefix)],
         script="""
 {script}/merge_mite.py --gffs {mite_hunter} {mitetracker} \\
     --tsvs {mustv2} {miteFinderII} >{prefix}.MITE.gff3
@@ -216,7 +229,11 @@ cp {prefix}.MITE.gff3 {prefix}.MITE.fasta {out_dir}
     return task, os.path.join(out_dir, "%s.MITE.fasta" % prefix)
 
 
-def run_mite(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh):
+def create_mite_dag(prefix, genome, thread, job_type, work_dir, out_dir, map_candidates=True):
+    """
+    :param map_candidates: map the MITE-Hunter candidates to genome in this DAG,
+                           else the caller maps them with other libraries
+    """
 
     genome = check_path(genome)
     work_dir = mkdir(work_dir)
@@ -235,8 +252,8 @@ def run_mite(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, re
     for k, v in work_dict.items():
         mkdir(os.path.join(work_dir, v))
 
-    dag = DAG("grand_mite")
-    mite_hunter_task, nucmer_task, option, mite_hunter = create_mite_hunter_task(
+    dag = DAG("grand_mite", work_dir)
+    mite_hunter_task, option, mite_hunter = create_mite_hunter_task(
         prefix=prefix,
         genome=genome,
         thread=thread,
@@ -246,7 +263,20 @@ def run_mite(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, re
     )
     options["software"].update(option)
     dag.add_task(mite_hunter_task)
-    dag.add_task(nucmer_task)
+    map_task = None
+
+    if map_candidates:
+        map_task, option, gffs = create_candidate_map_task(
+            prefix=prefix,
+            genome=genome,
+            libraries=mite_libraries(prefix, out_dir),
+            thread=thread,
+            job_type=job_type,
+            work_dir=os.path.join(work_dir, "candidate_map")
+        )
+        options["software"].update(option)
+        dag.add_task(map_task)
+        map_task.set_upstream(mite_hunter_task)
 
     mustv2_task, option, mustv2 = create_mustv2_task(
         prefix=prefix,
@@ -284,7 +314,7 @@ def run_mite(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, re
     merge_task, mite = create_merge_mite_task(
         prefix=prefix,
         genome=genome,
-        mite_hunter=mite_hunter,
+        mite_hunter=candidate_gff(prefix, "mite_hunter", out_dir),
         mitetracker=mitetracker,
         mustv2=mustv2,
         miteFinderII=miteFinderII,
@@ -293,12 +323,30 @@ def run_mite(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, re
         out_dir=out_dir
     )
     dag.add_task(merge_task)
-    merge_task.set_upstream(nucmer_task)
+
+    if map_task:
+        merge_task.set_upstream(map_task)
+
     merge_task.set_upstream(mustv2_task)
     merge_task.set_upstream(mitetracker_task)
     merge_task.set_upstream(miteFinderII_task)
 
-    do_dag(dag, concurrent, refresh)
+    return dag, options, mite
+
+
+def run_mite(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh, max_cpus=0, max_mem=0, cache_dir=""):
+
+    check_tools(TOOLS)
+    genome = prepare_genome(prefix, genome, work_dir)
+    dag, options, mite = create_mite_dag(
+        prefix=prefix,
+        genome=genome,
+        thread=thread,
+        job_type=job_type,
+        work_dir=work_dir,
+        out_dir=out_dir
+    )
+    do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
 
     return options, mite
 
@@ -313,7 +361,10 @@ def mite(args):
         work_dir=args.work_dir,
         out_dir=args.out_dir,
         concurrent=args.concurrent,
-        refresh=args.refresh
+        refresh=args.refresh,
+        max_cpus=args.max_cpus,
+        max_mem=args.max_mem,
+        cache_dir=args.cache_dir
     )
     with open(os.path.join(args.out_dir, "grand_mite.json"), "w") as fh:
          json.dump(options, fh, indent=2)
@@ -7,6 +7,8 @@ import argparse
 
 from grandte.config import *
 from grandte.common import check_path, mkdir, read_tsv
+from grandte.grand_all import TOOLS
+from grandte.tools import check_tools
 from dagflow import DAG, Task, do_dag
 
 LOG = logging.getLogger(__name__)
@@ -16,7 +18,7 @@ __email__ = "invicoun@foxmail.com"
 __all__ = []
 
 
-def create_grandTE_task(prefix, genome, job_type, work_dir, out_dir):
+def create_grandTE_task(prefix, genome, job_type, work_dir, out_dir, cache_dir=""):
 
     task = Task(
         id="grandTE_%s" % prefix,
@@ -26,12 +28,13 @@ def create_grandTE_task(prefix, genome, job_type, work_dir, out_dir):
         script="""
 {root}/grandte.py all \\
 --prefix {prefix} --genome {genome} \\
---thread 1 --job_type {job_type} \\
+--thread 1 --job_type {job_type} --cache_dir '{cache_dir}' \\
 --work_dir {work}/{prefix}  --out_dir {out}/{prefix}
 """.format(root=ROOT,
             prefix=prefix,
             genome=genome,
             job_type=job_type,
+            cache_dir=cache_dir,
             work=work_dir,
             out=out_dir
         )
@@ -66,13 +69,15 @@ cp *_all_transposon.png *_all_transposon.pdf {out_dir}
     return task
 
 
-def run_grand_multi(genomes, work_dir, out_dir, concurrent, refresh, job_type="local"):
+def run_grand_multi(genomes, work_dir, out_dir, concurrent, refresh, job_type="local", max_cpus=0, max_mem=0, cache_dir=""):
 
+    # the versions are cached for the runs of all genomes
+    check_tools(TOOLS)
     work_dir = mkdir(work_dir)
     out_dir = mkdir(out_dir)
     genomes = check_path(genomes)
 
-    dag = DAG("grand_multi")
+    dag = DAG("grand_multi", work_dir)
     class_task = class_te(
         tes=os.path.join(out_dir, "*/06_repeat/*.stat_transposon.tsv"),
         job_type=job_type,
@@ -88,12 +93,13 @@ def run_grand_multi(genomes, work_dir, out_dir, concurrent, refresh, job_type="l
             genome=genome,
             job_type=job_type,
             work_dir=work_dir,
-            out_dir=out_dir
+            out_dir=out_dir,
+            cache_dir=cache_dir
         )
         dag.add_task(task)
         class_task.set_upstream(task) 
 
-    do_dag(dag, concurrent, refresh)
+    do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
 
     return 0
 
@@ -107,6 +113,9 @@ def grand_multi(args):
         concurrent=args.concurrent,
         refresh=args.refresh,
         job_type=args.job_type,
+        max_cpus=args.max_cpus,
+        max_mem=args.max_mem,
+        cache_dir=args.cache_dir
     )
 
 
@@ -118,6 +127,12 @@ def add_grand_multi_args(parser):
         help="Maximum number of jobs concurrent  (default: 10).")
     parser.add_argument("--refresh", metavar="INT", type=int, default=30,
         help="Refresh time of log in seconds  (default: 30).")
+    parser.add_argument("--max_cpus", metavar="INT", type=int, default=0,
+        help="Maximum number of CPU cores used by local jobs, 0 for all cores of the machine (default: 0).")
+    parser.add_argument("--max_mem", metavar="STR", type=str, default="0",
+        help="Maximum memory used by local jobs, eg. 64G, 0 for all memory of the machine (default: 0).")
+    parser.add_argument("--cache_dir", metavar="DIR", type=str, default="",
+        help="Store of task outputs reused by other runs, outputs are hard linked into it so it should be on the file system of work_dir (default: disabled).")
     parser.add_argument("--job_type", choices=["sge", "local"], default="local",
         help="Jobs run on [sge, local]  (default: local).")
     parser.add_argument("--work_dir", metavar="DIR", type=str, default=".",
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import logging
+import argparse
+from collections import OrderedDict
+
+from grandte.parser import add_profile_args
+
+
+LOG = logging.getLogger(__name__)
+__version__ = "1.0.0"
+__author__ = ("Xingguo Zhang",)
+__email__ = "invicoun@foxmail.com"
+__all__ = []
+
+FIELDS = ["wall_time", "user_time", "sys_time", "peak_rss", "read_bytes", "write_bytes"]
+SORT_KEYS = {
+    "cpu": lambda x: x["user_time"] + x["sys_time"],
+    "wall": lambda x: x["wall_time"],
+    "rss": lambda x: x["peak_rss"],
+    "io": lambda x: x["read_bytes"] + x["write_bytes"],
+}
+
+
+def human_time(seconds):
+
+    seconds = int(seconds)
+
+    return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def human_size(size):
+
+    for unit in ["", "K", "M", "G"]:
+        if size < 1024:
+            return "%.1f%s" % (size, unit)
+        size /= 1024.0
+
+    return "%.1fT" % size
+
+
+def read_profiles(filename, by="task"):
+    """
+    read the resource usage of tasks from the json of DAG
+    :param filename:
+    :param by: task or stage, a stage sums the tasks with the same namespace,
+        a task without namespace is a stage of its own
+    :return: {name: {"tasks": 1, "wall_time": 0, ...}}
+    """
+    r = OrderedDict()
+
+    with open(filename) as fh:
+        tasks = json.load(fh, object_pairs_hook=OrderedDict)
+
+    for id, task in tasks.items():
+        profile = task.get("profile") or {}
+
+        if by == "stage":
+            name = task.get("stage") or id
+        else:
+            name = id
+
+        if name not in r:
+            r[name] = {"tasks": 0, "failed": 0}
+            for i in FIELDS:
+                r[name][i] = 0
+
+        r[name]["tasks"] += 1
+
+        if task.get("status") != "success":
+            r[name]["failed"] += 1
+
+        for i in FIELDS:
+            if i in ["peak_rss"]:
+                r[name][i] = max(r[name][i], profile.get(i, 0))
+            else:
+                r[name][i] += profile.get(i, 0)
+
+    return r
+
+
+def profile_dag(filename, sort="cpu", by="task"):
+
+    profiles = read_profiles(filename, by)
+    key = SORT_KEYS[sort]
+    total = sum([key(i) for i in profiles.values()]) or 1
+
+    print("#%s\tTasks\tFailed\tWall time\tCPU time\tUser time\tSys time\tPeak RSS\tRead\tWritten\t%% %s" % (
+        by.capitalize(), sort))
+
+    for name, profile in sorted(profiles.items(), key=lambda x: key(x[1]), reverse=True):
+        print("{0}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}\t{10:.2f}".format(
+            name, profile["tasks"], profile["failed"],
+            human_time(profile["wall_time"]),
+            human_time(profile["user_time"] + profile["sys_time"]),
+            human_time(profile["user_time"]),
+            human_time(profile["sys_time"]),
+            human_size(profile["peak_rss"]),
+            human_size(profile["read_bytes"]),
+            human_size(profile["write_bytes"]),
+            key(profile) * 100.0 / total)
+        )
+
+    return 0
+
+
+def profile(args):
+
+    profile_dag(args.dag, args.sort, args.by)
+
+
+def main():
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="[%(levelname)s] %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="""
+Rank the tasks of a finished DAG by the resources they used.
+
+version: %s
+contact:  %s <%s>\
+    """ % (__version__, " ".join(__author__), __email__))
+
+    parser = add_profile_args(parser)
+    args = parser.parse_args()
+    profile(args)
+
+
+if __name__ == "__main__":
+    main()
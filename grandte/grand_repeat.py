@@ -8,6 +8,9 @@ import argparse
 
 from grandte.config import *
 from grandte.common import check_path, mkdir, get_version
+from grandte.prepare import prepare_genome
+from grandte.tools import check_tools
+from grandte.scatter import split_chunks
 from dagflow import DAG, Task, ParallelTask, do_dag
 from grandte.parser import add_repeat_args
 
@@ -20,15 +23,41 @@ __author__ = ("Xingguo Zhang",)
 __email__ = "invicoun@foxmail.com"
 __all__ = []
 
-
-def create_RepeatMasker_task(prefix, genome, lib, thread, job_type, work_dir, out_dir, species="human"):
-
+# the tools checked before a run
+TOOLS = ["RepeatMasker", "RepeatModeler"]
+
+# the length of a genome chunk masked by a task in M
+CHUNK_SIZE = 50
+# the bases shared by two chunks not cut at a gap, longer than most LTRs
+CHUNK_OVERLAP = 20000
+
+
+def create_RepeatMasker_tasks(prefix, genome, lib, thread, job_type, work_dir, out_dir, species="human", chunk_size=CHUNK_SIZE):
+    """
+    mask the chunks of genome in parallel and merge the results with the
+    coordinates of genome, then filter and stat the merged annotation
+    :param prefix:
+    :param genome:
+    :param lib:
+    :param thread:
+    :param job_type:
+    :param work_dir:
+    :param out_dir:
+    :param species:
+    :param chunk_size: the length of a chunk in M
+    :return: the chunk tasks, the merge task, option, gff3, stat
+    """
     option = {}
     option["RepeatMasker"] = {
         "version": get_version(SOFTWARE_VERSION["RepeatMasker"]),
         "option": "default"
     }
+    inputs = [genome]
+    chunk_inputs = ["{chunk}"]
+
     if lib:
+        inputs.append(lib)
+        chunk_inputs.append(lib)
         species = ""
         engine = ""
         lib = "-lib %s" % lib
@@ -36,35 +65,70 @@ def create_RepeatMasker_task(prefix, genome, lib, thread, job_type, work_dir, ou
         species = "-species %s" % species
         engine = "-engine nhmmer"
         lib = ""
-    task = Task(
+
+    chunks, bed = split_chunks(genome, int(chunk_size * 1000000), work_dir, overlap=CHUNK_OVERLAP)
+    chunk_tasks = ParallelTask(
         id="RepeatMasker",
-        work_dir=work_dir,
+        work_dir=os.path.join(work_dir, "{id}"),
         type=job_type,
         option="-pe smp %s -V " % thread,
+        inputs=chunk_inputs,
+        outputs=[os.path.join(work_dir, "{id}", "%s.fasta.out" % prefix),
+                 os.path.join(work_dir, "{id}", "%s.fasta.out.gff" % prefix)],
+        versions=option,
+        estimate=int(6 * 3600 * chunk_size / 1000),
         script="""
 export PATH={masker}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
+ln -sf {chunk} {prefix}.fasta
 RepeatMasker -nolow -no_is -gff -norna {species}\\
     -parallel {thread} {engine} {lib} \\
     -dir ./ {prefix}.fasta
-mv {prefix}.fasta.out.gff {prefix}.RepeatMasker.gff
+# no file of gff is written for a chunk without repeats
+if [ ! -f {prefix}.fasta.out.gff ]; then
+  echo "##gff-version 2" >{prefix}.fasta.out.gff
+fi
+""",
+        masker=REPEATMASKER_BIN,
+        species=species,
+        engine=engine,
+        lib=lib,
+        thread=thread,
+        prefix=prefix,
+        chunk=chunks
+    )
+    outs = [os.path.join(i.work_dir, "%s.fasta.out" % prefix) for i in chunk_tasks]
+    gffs = [os.path.join(i.work_dir, "%s.fasta.out.gff" % prefix) for i in chunk_tasks]
+
+    merge_task = Task(
+        id="RepeatMasker",
+        work_dir=work_dir,
+        type=job_type,
+        option="-pe smp 1 -V ",
+        inputs=inputs + outs + gffs,
+        outputs=[os.path.join(out_dir, "%s.RepeatMasker.gff3" % prefix),
+                 os.path.join(out_dir, "%s.stat_transposon.tsv" % prefix),
+                 os.path.join(out_dir, "%s.RepeatMasker.gff" % prefix)],
+        versions=option,
+        script="""
+ln -sf {genome} {prefix}.fasta
+{script}/merge_masker.py {bed} {outs} -f out >{prefix}.fasta.out
+{script}/merge_masker.py {bed} {gffs} -f gff >{prefix}.RepeatMasker.gff
 {script}/filter_masker.py {prefix}.RepeatMasker.gff > {prefix}.RepeatMasker_new.gff
 {script}/stat_transposon.py {prefix}.fasta -g {prefix}.RepeatMasker.gff3 --sample {prefix} >{prefix}.stat_transposon.tsv
 cp {prefix}.RepeatMasker.gff3 {prefix}.stat_transposon.tsv {out_dir}
 cp {prefix}.RepeatMasker_new.gff {out_dir}/{prefix}.RepeatMasker.gff
-""".format(masker=REPEATMASKER_BIN,
-            script=SCRIPTS,
-            species=species,
-            engine=engine,
-            lib=lib,
-            thread=thread,
+""".format(script=SCRIPTS,
+            bed=bed,
+            outs=" ".join(outs),
+            gffs=" ".join(gffs),
             prefix=prefix,
             genome=genome,
             out_dir=out_dir
         )
     )
+    merge_task.set_upstream(*chunk_tasks)
 
-    return task, option, os.path.join(out_dir, "%s.RepeatMasker.gff3" % prefix), os.path.join(out_dir, "%s.stat_transposon.tsv" % prefix)
+    return chunk_tasks, merge_task, option, os.path.join(out_dir, "%s.RepeatMasker.gff3" % prefix), os.path.join(out_dir, "%s.stat_transposon.tsv" % prefix)
 
 
 def create_RepeatModeler_task(prefix, genome, thread, job_type, work_dir, out_dir):
@@ -79,6 +143,11 @@ def create_RepeatModeler_task(prefix, genome, thread, job_type, work_dir, out_di
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s -V " % thread,
+        inputs=[genome],
+        outputs=[os.path.join(work_dir, "%s.RepeatModeler.fasta" % prefix),
+                 os.path.join(out_dir, "%s.RepeatModeler.fasta" % prefix)],
+        versions=option,
+        estimate=24 * 3600,
         script="""
 #export PATH={masker}:$PATH
 export PATH={modeler}:$PATH
@@ -100,7 +169,7 @@ cp {prefix}.RepeatModeler.fasta {out_dir}
     return task, option, os.path.join(work_dir, "%s.RepeatModeler.fasta" % prefix)
 
 
-def run_repeat(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh, species="human", lib=""):
+def create_repeat_dag(prefix, genome, thread, job_type, work_dir, out_dir, species="human", lib="", chunk_size=CHUNK_SIZE):
 
     genome = check_path(genome)
     work_dir = mkdir(work_dir)
@@ -117,8 +186,8 @@ def run_repeat(prefix, genome, thread, job_type, work_dir, out_dir, concurrent,
     for k, v in work_dict.items():
         mkdir(os.path.join(work_dir, v))
 
-    dag = DAG("grand_repeat")
-    masker_task, option, masked_gff, masked_tsv = create_RepeatMasker_task(
+    dag = DAG("grand_repeat", work_dir)
+    chunk_tasks, masker_task, option, masked_gff, masked_tsv = create_RepeatMasker_tasks(
         prefix=prefix,
         genome=genome,
         lib=lib,
@@ -127,8 +196,10 @@ def run_repeat(prefix, genome, thread, job_type, work_dir, out_dir, concurrent,
         work_dir=os.path.join(work_dir, work_dict["masker"]),
         out_dir=out_dir,
         species=species,
+        chunk_size=chunk_size
     )
     options["software"].update(option)
+    dag.add_task(*chunk_tasks)
     dag.add_task(masker_task)
 
     modeler_task, option, modeler = create_RepeatModeler_task(
@@ -141,7 +212,26 @@ def run_repeat(prefix, genome, thread, job_type, work_dir, out_dir, concurrent,
     )
     options["software"].update(option)
     dag.add_task(modeler_task)
-    do_dag(dag, concurrent, refresh)
+
+    return dag, options, masked_tsv
+
+
+def run_repeat(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh, species="human", lib="", chunk_size=CHUNK_SIZE, max_cpus=0, max_mem=0, cache_dir=""):
+
+    check_tools(TOOLS)
+    genome = prepare_genome(prefix, genome, work_dir)
+    dag, options, masked_tsv = create_repeat_dag(
+        prefix=prefix,
+        genome=genome,
+        thread=thread,
+        job_type=job_type,
+        work_dir=work_dir,
+        out_dir=out_dir,
+        species=species,
+        lib=lib,
+        chunk_size=chunk_size
+    )
+    do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
 
     return options, masked_tsv
 
@@ -156,7 +246,10 @@ def repeat(args):
         work_dir=args.work_dir,
         out_dir=args.out_dir,
         concurrent=args.concurrent,
-        refresh=args.refresh
+        refresh=args.refresh,
+        max_cpus=args.max_cpus,
+        max_mem=args.max_mem,
+        cache_dir=args.cache_dir
     )
     with open(os.path.join(args.out_dir, "grand_repeat.json"), "w") as fh:
          json.dump(options, fh, indent=2)
@@ -8,6 +8,9 @@ import argparse
 
 from grandte.config import *
 from grandte.common import check_path, mkdir, get_version
+from grandte.prepare import prepare_genome
+from grandte.tools import check_tools
+from grandte.candidate_map import create_candidate_map_task, candidate_gff
 from dagflow import DAG, Task, ParallelTask, do_dag
 from grandte.parser import add_sine_args
 
@@ -20,6 +23,11 @@ __author__ = ("Xingguo Zhang",)
 __email__ = "invicoun@foxmail.com"
 __all__ = []
 
+# the tools checked before a run
+TOOLS = ["sine_finder", "sinescan", "nucmer"]
+# the nucmer parameters to map the SINE candidates
+NUCMER_OPTION = "--maxmatch --nosimplify -g 100 -c 40 -l 15"
+
 
 def create_sine_finder_task(prefix, genome, thread, job_type, work_dir, out_dir):
 
@@ -33,9 +41,13 @@ def create_sine_finder_task(prefix, genome, thread, job_type, work_dir, out_dir)
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s" % thread,
+        inputs=[genome],
+        outputs=[os.path.join(out_dir, "%s.sine_finder.tsv" % prefix)],
+        versions=option,
+        estimate=3600,
         script="""
 export PATH={reasonaTE}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
+ln -sf {genome} {prefix}.fasta
 sine_finder -V {prefix}.fasta
 cat *-matches.fasta >{prefix}.sine_finder.tsv
 cp {prefix}.sine_finder.tsv {out_dir}
@@ -46,33 +58,7 @@ cp {prefix}.sine_finder.tsv {out_dir}
         )
     )
 
-    nucmer_task = Task(
-        id="nucmer_sf",
-        work_dir=work_dir,
-        type=job_type,
-        option="-pe smp %s " % thread,
-        script="""
-export PATH={nucmer}:$PATH
-if [ -s {out_dir}/{prefix}.sine_finder.tsv ] ; then
-    nucmer --maxmatch --nosimplify -g 100 -c 40 -l 15 -t {thread} -p {prefix} {out_dir}/{prefix}.sine_finder.tsv {genome}
-    show-coords {prefix}.delta -rlo -L 45 >{prefix}.coords
-    {script}/coords2gff.py {prefix}.coords --source sine_finder --type SINE >{prefix}.sine_finder.gff3
-else
-    touch {prefix}.sine_finder.gff3
-fi
-cp {prefix}.sine_finder.gff3 {out_dir}
-""".format(nucmer=NUCMER_BIN,
-            script=SCRIPTS,
-            prefix=prefix,
-            genome=genome,
-            thread=thread,
-            out_dir=out_dir
-        )
-    )
-
-    nucmer_task.set_upstream(sine_finder_task)
-
-    return sine_finder_task, nucmer_task, option, os.path.join(work_dir, "%s.sine_finder.gff3" % prefix)
+    return sine_finder_task, option, os.path.join(out_dir, "%s.sine_finder.tsv" % prefix)
 
 
 def create_sinescan_task(prefix, genome, thread, job_type, work_dir, out_dir):
@@ -87,9 +73,13 @@ def create_sinescan_task(prefix, genome, thread, job_type, work_dir, out_dir):
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s -V " % thread,
+        inputs=[genome],
+        outputs=[os.path.join(out_dir, "%s.sinescan.fasta" % prefix)],
+        versions=option,
+        estimate=2 * 3600,
         script="""
 export PATH={reasonaTE}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
+ln -sf {genome} {prefix}.fasta
 mkdir -p result
 mkdir -p output
 mkdir -p final
@@ -104,33 +94,20 @@ rm -rf result output final
         )
     )
 
-    nucmer_task = Task(
-        id="nucmer_s",
-        work_dir=work_dir,
-        type=job_type,
-        option="-pe smp %s " % thread,
-        script="""
-export PATH={nucmer}:$PATH
-if [ -s {out_dir}/{prefix}.sinescan.fasta ] ; then
-    nucmer --maxmatch --nosimplify -g 100 -c 40 -l 15 -t {thread} -p {prefix} {out_dir}/{prefix}.sinescan.fasta {genome}
-    show-coords {prefix}.delta -rlo -L 45 >{prefix}.coords
-    {script}/coords2gff.py {prefix}.coords --source sinescan --type SINE >{prefix}.sinescan.gff3
-else
-    touch {prefix}.sinescan.gff3
-fi
-cp {prefix}.sinescan.gff3 {out_dir}
-""".format(nucmer=NUCMER_BIN,
-            script=SCRIPTS,
-            prefix=prefix,
-            genome=genome,
-            thread=thread,
-            out_dir=out_dir
-        )
-    )
+    return sinescan_task, option, os.path.join(out_dir, "%s.sinescan.fasta" % prefix)
 
-    nucmer_task.set_upstream(sinescan_task)
 
-    return sinescan_task, nucmer_task, option, os.path.join(work_dir, "%s.sinescan.gff3" % prefix)
+def sine_libraries(prefix, out_dir):
+    """
+    the candidate libraries of SINE mapped to genome by nucmer
+    :param prefix:
+    :param out_dir:
+    :return: a list of (tag, fasta, source, type, out_dir, nucmer option)
+    """
+    return [
+        ("sine_finder", os.path.join(out_dir, "%s.sine_finder.tsv" % prefix), "sine_finder", "SINE", out_dir, NUCMER_OPTION),
+        ("sinescan", os.path.join(out_dir, "%s.sinescan.fasta" % prefix), "sinescan", "SINE", out_dir, NUCMER_OPTION),
+    ]
 
 
 def create_merge_sine_task(prefix, genome, sine_finder, sinescan, job_type, work_dir, out_dir):
@@ -140,6 +117,9 @@ def create_merge_sine_task(prefix, genome, sine_finder, sinescan, job_type, work
         work_dir=work_dir,
         type=job_type,
         option="-pe smp 1",
+        inputs=[sine_finder, sinescan, genome],
+        outputs=[os.path.join(out_dir, "%s.SINE.gff3" % prefix),
+                 os.path.join(out_dir, "%s.SINE.fasta" % prefix)],
         script="""
 {script}/merge_mite.py --gffs {sine_finder} {sinescan} \\
     --locus SINE >{prefix}.SINE.gff3
@@ -157,7 +137,11 @@ cp {prefix}.SINE.gff3 {prefix}.SINE.fasta {out_dir}
     return task, os.path.join(out_dir, "%s.SINE.fasta" % prefix)
 
 
-def run_sine(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh):
+def create_sine_dag(prefix, genome, thread, job_type, work_dir, out_dir, map_candidates=True):
+    """
+    :param map_candidates: map the candidates of sine_finder and sinescan to genome
+                           in this DAG, else the caller maps them with other libraries
+    """
 
     genome = check_path(genome)
     work_dir = mkdir(work_dir)
@@ -174,8 +158,8 @@ def run_sine(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, re
     for k, v in work_dict.items():
         mkdir(os.path.join(work_dir, v))
 
-    dag = DAG("grand_ltr")
-    sine_finder_task, nucmer_sf_task, option, sine_finder = create_sine_finder_task(
+    dag = DAG("grand_sine", work_dir)
+    sine_finder_task, option, sine_finder = create_sine_finder_task(
         prefix=prefix,
         genome=genome,
         thread=thread,
@@ -185,9 +169,8 @@ def run_sine(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, re
     )
     options["software"].update(option)
     dag.add_task(sine_finder_task)
-    dag.add_task(nucmer_sf_task)
 
-    sinescan_task, nucmer_s_task, option, sinescan = create_sinescan_task(
+    sinescan_task, option, sinescan = create_sinescan_task(
         prefix=prefix,
         genome=genome,
         thread=thread,
@@ -197,22 +180,51 @@ def run_sine(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, re
     )
     options["software"].update(option)
     dag.add_task(sinescan_task)
-    dag.add_task(nucmer_s_task)
+    map_task = None
+
+    if map_candidates:
+        map_task, option, gffs = create_candidate_map_task(
+            prefix=prefix,
+            genome=genome,
+            libraries=sine_libraries(prefix, out_dir),
+            thread=thread,
+            job_type=job_type,
+            work_dir=os.path.join(work_dir, "candidate_map")
+        )
+        options["software"].update(option)
+        dag.add_task(map_task)
+        map_task.set_upstream(sine_finder_task, sinescan_task)
 
     merge_task, sine = create_merge_sine_task(
         prefix=prefix,
         genome=genome,
-        sine_finder=sine_finder,
-        sinescan=sinescan,
+        sine_finder=candidate_gff(prefix, "sine_finder", out_dir),
+        sinescan=candidate_gff(prefix, "sinescan", out_dir),
         job_type=job_type,
         work_dir=work_dir,
         out_dir=out_dir
     )
     dag.add_task(merge_task)
-    merge_task.set_upstream(nucmer_sf_task)
-    merge_task.set_upstream(nucmer_s_task)
 
-    do_dag(dag, concurrent, refresh)
+    if map_task:
+        merge_task.set_upstream(map_task)
+
+    return dag, options, sine
+
+
+def run_sine(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh, max_cpus=0, max_mem=0, cache_dir=""):
+
+    check_tools(TOOLS)
+    genome = prepare_genome(prefix, genome, work_dir)
+    dag, options, sine = create_sine_dag(
+        prefix=prefix,
+        genome=genome,
+        thread=thread,
+        job_type=job_type,
+        work_dir=work_dir,
+        out_dir=out_dir
+    )
+    do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
 
     return options, sine
 
@@ -227,7 +239,10 @@ def sine(args):
         work_dir=args.work_dir,
         out_dir=args.out_dir,
         concurrent=args.concurrent,
-        refresh=args.refresh
+        refresh=args.refresh,
+        max_cpus=args.max_cpus,
+        max_mem=args.max_mem,
+        cache_dir=args.cache_dir
     )
     with open(os.path.join(args.out_dir, "grand_sine.json"), "w") as fh:
          json.dump(options, fh, indent=2)
@@ -8,6 +8,9 @@ import argparse
 
 from grandte.config import *
 from grandte.common import check_path, mkdir, get_version
+from grandte.prepare import prepare_genome
+from grandte.tools import check_tools
+from grandte.gt_index import create_gt_index_task, create_gt_clean_task, gt_index_script
 from dagflow import DAG, Task, ParallelTask, do_dag
 from grandte.parser import add_tir_args
 
@@ -20,8 +23,11 @@ __author__ = ("Xingguo Zhang",)
 __email__ = "invicoun@foxmail.com"
 __all__ = []
 
+# the tools checked before a run
+TOOLS = ["tirvish", "suffixerator"]
 
-def create_tirvish_task(prefix, genome, thread, job_type, work_dir, out_dir):
+
+def create_tirvish_task(prefix, genome, index, thread, job_type, work_dir, out_dir):
 
     option = {}
     option["tirvish"] = {
@@ -33,15 +39,22 @@ def create_tirvish_task(prefix, genome, thread, job_type, work_dir, out_dir):
         work_dir=work_dir,
         type=job_type,
         option="-pe smp %s" % thread,
+        inputs=[genome],
+        outputs=[os.path.join(work_dir, "%s.tirvish.fasta" % prefix),
+                 os.path.join(out_dir, "%s.tirvish.gff3" % prefix),
+                 os.path.join(out_dir, "%s.tirvish.fasta" % prefix)],
+        versions=option,
+        estimate=3600,
         script="""
 export PATH={reasonaTE}:$PATH
-cut -d " " -f1 {genome} >{prefix}.fasta
-gt suffixerator -db {prefix}.fasta -indexname {prefix}.index -tis -suf -lcp -des -ssp -sds -dna -mirrored
-gt tirvish -index {prefix}.index > {prefix}.tirvish.gff3
+ln -sf {genome} {prefix}.fasta
+{index}
+gt tirvish -index $index > {prefix}.tirvish.gff3
 {script}/get_gff2fa.py {prefix}.tirvish.gff3 -g {prefix}.fasta -tp repeat_region >{prefix}.tirvish.fasta
 cp {prefix}.tirvish.gff3 {prefix}.tirvish.fasta {out_dir}
-rm {prefix}.index.*
+rm -f {prefix}.index.*
 """.format(reasonaTE=REASONATE_BIN,
+            index=gt_index_script(prefix, index, work_dir),
             script=SCRIPTS,
             prefix=prefix,
             genome=genome,
@@ -52,7 +65,11 @@ rm {prefix}.index.*
     return tirvish_task, option, os.path.join(work_dir, "%s.tirvish.fasta" % prefix)
 
 
-def run_tir(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh):
+def create_tir_dag(prefix, genome, thread, job_type, work_dir, out_dir, index=""):
+    """
+    :param index: the suffix index shared with ltrharvest, which is built and
+                  removed by the caller, if not set the DAG builds its own
+    """
 
     genome = check_path(genome)
     work_dir = mkdir(work_dir)
@@ -68,10 +85,23 @@ def run_tir(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, ref
     for k, v in work_dict.items():
         mkdir(os.path.join(work_dir, v))
 
-    dag = DAG("grand_ltr")
+    dag = DAG("grand_tir", work_dir)
+    index_task = None
+
+    if not index:
+        index_task, option, index = create_gt_index_task(
+            prefix=prefix,
+            genome=genome,
+            job_type=job_type,
+            work_dir=os.path.join(work_dir, "00_gt_index")
+        )
+        options["software"].update(option)
+        dag.add_task(index_task)
+
     tirvish_task, option, tirvish = create_tirvish_task(
         prefix=prefix,
         genome=genome,
+        index=index,
         thread=thread,
         job_type=job_type,
         work_dir=os.path.join(work_dir, work_dict["tirvish"]),
@@ -80,7 +110,32 @@ def run_tir(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, ref
     options["software"].update(option)
     dag.add_task(tirvish_task)
 
-    do_dag(dag, concurrent, refresh)
+    if index_task:
+        tirvish_task.set_upstream(index_task)
+        clean_task = create_gt_clean_task(
+            index=index,
+            job_type=job_type,
+            work_dir=os.path.join(work_dir, "00_gt_index")
+        )
+        dag.add_task(clean_task)
+        clean_task.set_upstream(tirvish_task)
+
+    return dag, options, tirvish
+
+
+def run_tir(prefix, genome, thread, job_type, work_dir, out_dir, concurrent, refresh, max_cpus=0, max_mem=0, cache_dir=""):
+
+    check_tools(TOOLS)
+    genome = prepare_genome(prefix, genome, work_dir)
+    dag, options, tirvish = create_tir_dag(
+        prefix=prefix,
+        genome=genome,
+        thread=thread,
+        job_type=job_type,
+        work_dir=work_dir,
+        out_dir=out_dir
+    )
+    do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
 
     return options, tirvish
 
@@ -95,7 +150,10 @@ def tir(args):
         work_dir=args.work_dir,
         out_dir=args.out_dir,
         concurrent=args.concurrent,
-        refresh=args.refresh
+        refresh=args.refresh,
+        max_cpus=args.max_cpus,
+        max_mem=args.max_mem,
+        cache_dir=args.cache_dir
     )
     with open(os.path.join(args.out_dir, "grand_tir.json"), "w") as fh:
          json.dump(options, fh, indent=2)
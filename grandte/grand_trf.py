@@ -68,7 +68,7 @@ cp {prefix}.TRF.gff3 {prefix}.TRFmasked.fasta {out_dir}
 
 
 def run_trf(prefix, genomes, genome, job_type, work_dir,
-            out_dir, concurrent, refresh):
+            out_dir, concurrent, refresh, max_cpus=0, max_mem=0, cache_dir=""):
 
     genomes = check_paths(genomes)
     genome =  check_path(genome)
@@ -79,7 +79,7 @@ def run_trf(prefix, genomes, genome, job_type, work_dir,
         "database": OrderedDict()
     }
 
-    dag = DAG("grand_trf")
+    dag = DAG("grand_trf", work_dir)
     trf_tasks, trf_join, option, trf_gff = create_trf_tasks(
         prefix=prefix,
         genomes=genomes,
@@ -93,7 +93,7 @@ def run_trf(prefix, genomes, genome, job_type, work_dir,
     dag.add_task(*trf_tasks)
     dag.add_task(trf_join)
 
-    do_dag(dag, concurrent, refresh)
+    do_dag(dag, concurrent, refresh, max_cpus=max_cpus, max_mem=max_mem, cache_dir=cache_dir)
 
     return options, trf_gff
 
@@ -108,7 +108,10 @@ def trf(args):
         work_dir=args.work_dir,
         out_dir=args.out_dir,
         concurrent=args.concurrent,
-        refresh=args.refresh
+        refresh=args.refresh,
+        max_cpus=args.max_cpus,
+        max_mem=args.max_mem,
+        cache_dir=args.cache_dir
     )
     with open(os.path.join(args.out_dir, "grand_trf.json"), "w") as fh:
          json.dump(options, fh, indent=2)
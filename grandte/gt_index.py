@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+from grandte.config import *
+from grandte.common import get_version
+from dagflow import Task
+
+
+LOG = logging.getLogger(__name__)
+__version__ = "1.0.0"
+__author__ = ("Xingguo Zhang",)
+__email__ = "invicoun@foxmail.com"
+__all__ = ["create_gt_index_task", "create_gt_clean_task", "gt_index_script"]
+
+# the options of the enhanced suffix array used by ltrharvest and tirvish
+SUFFIXERATOR_OPTION = "-tis -suf -lcp -des -ssp -sds -dna -mirrored"
+
+
+def create_gt_index_task(prefix, genome, job_type, work_dir):
+    """
+    build the mirrored suffix index of genome once for gt ltrharvest and gt tirvish
+    :param prefix:
+    :param genome:
+    :param job_type:
+    :param work_dir:
+    :return: task, option, the name of index
+    """
+    option = {}
+    option["suffixerator"] = {
+        "version": get_version(SOFTWARE_VERSION["suffixerator"]),
+        "option": SUFFIXERATOR_OPTION
+    }
+    index = os.path.join(work_dir, "%s.index" % prefix)
+    task = Task(
+        id="gt_index",
+        work_dir=work_dir,
+        type=job_type,
+        option="-pe smp 1",
+        inputs=[genome],
+        versions=option,
+        estimate=1800,
+        script="""
+export PATH={reasonaTE}:$PATH
+ln -sf {genome} {prefix}.fasta
+gt suffixerator -db {prefix}.fasta -indexname {index} {suffixerator}
+""".format(reasonaTE=REASONATE_BIN,
+            suffixerator=SUFFIXERATOR_OPTION,
+            prefix=prefix,
+            genome=genome,
+            index=index
+        )
+    )
+
+    return task, option, index
+
+
+def create_gt_clean_task(index, job_type, work_dir):
+    """
+    remove the suffix index after all tasks used it
+    :param index:
+    :param job_type:
+    :param work_dir:
+    :return: task
+    """
+    task = Task(
+        id="gt_clean",
+        work_dir=work_dir,
+        type=job_type,
+        option="-pe smp 1",
+        script="""
+rm -f {index}.*
+""".format(index=index)
+    )
+
+    return task
+
+
+def gt_index_script(prefix, index, work_dir):
+    """
+    the shell lines to use the shared index, a task run again after the
+    index was removed builds its own one
+    :param prefix:
+    :param index:
+    :param work_dir: the work dir of the task, the index is relative to it so
+                     the task has the same fingerprint in another work dir
+    :return: shell script, the index is $index
+    """
+    return """\
+index={index}
+if [ ! -f $index.prj ]; then
+  index={prefix}.index
+  gt suffixerator -db {prefix}.fasta -indexname $index {suffixerator}
+fi""".format(index=os.path.relpath(index, work_dir), prefix=prefix, suffixerator=SUFFIXERATOR_OPTION)
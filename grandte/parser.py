@@ -3,7 +3,7 @@
 
 from grandte.config import *
 
-__all__ = ["add_trf_args", "add_mite_args", "add_ltr_args", "add_sine_args", "add_tir_args", "add_helitron_args", "add_repeat_args", "add_all_args"]
+__all__ = ["add_trf_args", "add_mite_args", "add_ltr_args", "add_sine_args", "add_tir_args", "add_helitron_args", "add_repeat_args", "add_all_args", "add_profile_args"]
 
 
 def add_workflow_args(parser):
@@ -18,6 +18,12 @@ def add_workflow_args(parser):
         help="Maximum number of jobs concurrent  (default: 10).")
     workflow_group.add_argument("--refresh", metavar="INT", type=int, default=30,
         help="Refresh time of log in seconds  (default: 30).")
+    workflow_group.add_argument("--max_cpus", metavar="INT", type=int, default=0,
+        help="Maximum number of CPU cores used by local jobs, 0 for all cores of the machine (default: 0).")
+    workflow_group.add_argument("--max_mem", metavar="STR", type=str, default="0",
+        help="Maximum memory used by local jobs, eg. 64G, 0 for all memory of the machine (default: 0).")
+    workflow_group.add_argument("--cache_dir", metavar="DIR", type=str, default="",
+        help="Store of task outputs reused by other runs, outputs are hard linked into it so it should be on the file system of work_dir (default: disabled).")
     workflow_group.add_argument("--job_type", choices=["sge", "local"], default="local",
         help="Jobs run on [sge, local]  (default: local).")
     workflow_group.add_argument("--work_dir", metavar="DIR", type=str, default=".",
@@ -146,3 +152,15 @@ def add_all_args(parser):
     parser = add_workflow_args(parser)
 
     return parser
+
+
+def add_profile_args(parser):
+
+    parser.add_argument("dag", metavar="FILE", type=str,
+        help="Input the json of DAG written by a run into its work_dir, eg. work/grand_all.json.")
+    parser.add_argument("--sort", choices=["cpu", "wall", "rss", "io"], default="cpu",
+        help="Rank by cpu time, wall time, peak memory or io bytes (default: cpu).")
+    parser.add_argument("--by", choices=["task", "stage"], default="task",
+        help="Report tasks, or stages which are the namespaces of a combined DAG (default: task).")
+
+    return parser
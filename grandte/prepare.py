@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import hashlib
+import logging
+
+from grandte.config import *
+from grandte.common import check_path, mkdir
+from seqkit.FastaReader import open_fasta
+from seqkit.TwoBit import write_2bit
+
+
+LOG = logging.getLogger(__name__)
+__version__ = "1.0.0"
+__author__ = ("Xingguo Zhang",)
+__email__ = "invicoun@foxmail.com"
+__all__ = ["prepare_genome"]
+
+# IUPAC nucleotide codes
+VALID_BASES = re.compile(r"^[ACGTNRYKMSWBDHV]*$")
+LINE_WIDTH = 60
+
+
+def sanitize_id(id):
+    """
+    keep the characters accepted by all detectors in sequence ids
+    :param id:
+    :return:
+    """
+    return re.sub(r"[^\w.:|-]", "_", id)
+
+
+def source_signature(path):
+
+    stat = os.stat(path)
+
+    return {"source": path, "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def write_id_map(renamed, id_map):
+    """
+    write the ids changed by sanitize_id, the outputs of all stages use the
+    new ids
+    :param renamed: a list of (new id, original id)
+    :param id_map:
+    :return:
+    """
+    if not renamed:
+        if os.path.exists(id_map):
+            os.remove(id_map)
+        return ""
+
+    with open(id_map, "w") as fh:
+        fh.write("#id\toriginal_id\n")
+        fh.write("".join(["%s\t%s\n" % i for i in renamed]))
+
+    return id_map
+
+
+def warn_id_map(id_map):
+
+    if os.path.isfile(id_map):
+        LOG.warning("some sequence ids of the genome were renamed for the detectors, "
+                    "the outputs use the new ids, see %r for the original ids" % id_map)
+
+    return id_map
+
+
+def write_genome(genome, fasta, id_map):
+    """
+    write the canonical genome: ids without description, upper case
+    sequences of LINE_WIDTH bases a line, and its .fai, .md5 and the .2bit
+    store read by the scripts
+    :param genome:
+    :param fasta:
+    :param id_map: the ids changed are written to this file
+    :return:
+    """
+    ids = set()
+    renamed = []
+    fais = []
+    md5 = hashlib.md5()
+    offset = 0
+
+    with open(fasta, "w") as fh:
+        for record in open_fasta(genome):
+            id = sanitize_id(record.id)
+            seq = record.seq.upper()
+
+            if not seq:
+                LOG.warning("sequence %r of %r is empty, skipped" % (record.id, genome))
+                continue
+
+            if id in ids:
+                raise Exception("sequence id %r is repeated in %r" % (id, genome))
+
+            if not VALID_BASES.match(seq):
+                bases = sorted(set(re.sub(r"[ACGTNRYKMSWBDHV]", "", seq)))
+                raise Exception("sequence %r of %r has invalid bases: %s" % (record.id, genome, "".join(bases)))
+
+            ids.add(id)
+            if id != record.id:
+                renamed.append((id, record.id))
+            header = ">%s\n" % id
+            lines = "".join(["%s\n" % seq[i:i + LINE_WIDTH] for i in range(0, len(seq), LINE_WIDTH)])
+            fais.append("%s\t%s\t%s\t%s\t%s\n" % (id, len(seq), offset + len(header), LINE_WIDTH, LINE_WIDTH + 1))
+
+            for text in (header, lines):
+                fh.write(text)
+                md5.update(text.encode("utf-8"))
+                offset += len(text)
+
+    if not ids:
+        raise Exception("no sequence in genome %r" % genome)
+
+    with open("%s.fai" % fasta, "w") as fh:
+        fh.write("".join(fais))
+
+    with open("%s.md5" % fasta, "w") as fh:
+        fh.write("%s  %s\n" % (md5.hexdigest(), os.path.basename(fasta)))
+
+    write_2bit(fasta, "%s.2bit" % fasta)
+    write_id_map(renamed, id_map)
+
+    return fasta
+
+
+def prepare_genome(prefix, genome, work_dir):
+    """
+    prepare the genome used by all detectors once, the prepared genome is
+    reused while the original genome is not changed
+    :param prefix:
+    :param genome:
+    :param work_dir:
+    :return: the path of the prepared genome
+    """
+    genome = check_path(genome)
+    work_dir = mkdir(os.path.join(work_dir, "00_prepare"))
+    fasta = os.path.join(work_dir, "%s.genome.fasta" % prefix)
+    done = os.path.join(work_dir, "prepare_done")
+    id_map = os.path.join(work_dir, "%s.id_map.tsv" % prefix)
+    signature = source_signature(genome)
+
+    if os.path.isfile(done) and os.path.isfile(fasta):
+        with open(done) as fh:
+            if json.load(fh) == signature:
+                LOG.info("genome %r was prepared as %r" % (genome, fasta))
+                # genomes prepared before the store was added
+                if not os.path.isfile("%s.2bit" % fasta):
+                    write_2bit(fasta, "%s.2bit" % fasta)
+                warn_id_map(id_map)
+                return fasta
+
+    LOG.info("prepare genome %r to %r" % (genome, fasta))
+    write_genome(genome, fasta, id_map)
+    warn_id_map(id_map)
+
+    with open(done, "w") as fh:
+        json.dump(signature, fh)
+
+    return fasta
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import logging
+
+from grandte.config import *
+from grandte.common import mkdir, get_genome_size
+from dagflow import ParallelTask
+from dagflow.cache import file_checksum
+from seqkit.split import seq_split, split_windows
+
+
+LOG = logging.getLogger(__name__)
+__version__ = "1.0.0"
+__author__ = ("Xingguo Zhang",)
+__email__ = "invicoun@foxmail.com"
+__all__ = ["split_genome", "split_chunks", "create_scatter_tasks"]
+
+
+def split_genome(genome, shards, work_dir, concurrent=1):
+    """
+    split genome into at most shards fasta files of about the same length,
+    sequences are never cut so their ids are kept
+    :param genome:
+    :param shards: the number of shards
+    :param work_dir:
+    :param concurrent: the processes copying the shards of a plain fasta
+    :return: a list of fasta files
+    """
+    size = get_genome_size(genome) * 1000000
+    length = max(int(math.ceil(size / max(shards, 1))), 1)
+    # the split of another genome or number of shards is kept in another directory
+    split_dir = mkdir(os.path.join(work_dir, "shards_%s_%s" % (shards, file_checksum(genome)[:12])))
+
+    return seq_split([genome], "length", length, split_dir, concurrent=concurrent)
+
+
+def split_chunks(genome, size, work_dir, overlap=0):
+    """
+    cut genome into windows of at most size bases, preferring the N gaps,
+    and pack them into fasta files of about size bases, the windows are
+    renamed to short ids and their places in genome are written to a bed
+    file of (seqid, start, end, window id)
+    :param genome:
+    :param size: the length of a chunk in bases
+    :param work_dir:
+    :param overlap: the bases shared by two windows not cut at a gap
+    :return: a list of fasta files, the bed file
+    """
+    # the chunks of another genome are kept in another directory
+    chunk_dir = mkdir(os.path.join(work_dir, "chunks_%s_%s_%s" % (size, overlap, file_checksum(genome)[:12])))
+    chunk_list = os.path.join(chunk_dir, "chunk_list")
+    bed = os.path.join(chunk_dir, "chunks.windows.bed")
+    done = os.path.join(chunk_dir, "chunk_done")
+
+    if os.path.exists(done):
+        LOG.info("%r exists, pass this step; if you want to rerun, delete the file" % done)
+        with open(chunk_list) as fh:
+            return fh.read().split(), bed
+
+    LOG.info("split %r into chunks of %s bases" % (genome, size))
+    files, bed = split_windows(genome, size, overlap=overlap, out_dir=chunk_dir, prefix="chunks")
+
+    with open(chunk_list, "w") as fh:
+        fh.write("\n".join(files))
+
+    open(done, "w").close()
+
+    return files, bed
+
+
+def create_scatter_tasks(id, shards, script, job_type, work_dir, option="", **extra):
+    """
+    run script on each shard of a genome split by split_genome, "{shard}" in
+    the script is replaced by the fasta of the shard and "{id}" in work_dir by
+    the task id
+    :param id:
+    :param shards: the fasta files of the shards
+    :param script:
+    :param job_type:
+    :param work_dir: the work directory of the shard tasks are work_dir/{id}
+    :param option:
+    :param extra: other values to format the script, a list gives a value per shard;
+        inputs, outputs and versions are passed to ParallelTask, the shard is an input by default
+    :return: a list of tasks
+    """
+    LOG.info("run %r on %s shards" % (id, len(shards)))
+    extra.setdefault("inputs", ["{shard}"])
+
+    return ParallelTask(
+        id=id,
+        script=script,
+        work_dir=os.path.join(work_dir, "{id}"),
+        type=job_type,
+        option=option,
+        shard=shards,
+        **extra
+    )
+
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+
+from grandte.config import *
+from grandte.tools import REGISTRY
+from dagflow.cache import file_signature
+
+
+LOG = logging.getLogger(__name__)
+__version__ = "1.0.0"
+__author__ = ("Xingguo Zhang",)
+__email__ = "invicoun@foxmail.com"
+__all__ = ["stage_signature", "read_stage", "write_stage"]
+
+STAGE_DONE = "stage_done"
+
+
+def stage_signature(inputs, tools):
+    """
+    the signature of a stage: the signatures of its input files and the
+    keys of its tools, no tool is run
+    :param inputs:
+    :param tools: the names of tools in SOFTWARE_VERSION
+    :return:
+    """
+    return {
+        "inputs": OrderedDict([(i, file_signature(i)) for i in inputs]),
+        "tools": OrderedDict([(i, REGISTRY.key(SOFTWARE_VERSION[i])) for i in tools])
+    }
+
+
+def read_stage(work_dir, signature):
+    """
+    read the completion marker of a stage, it is valid while the signature
+    of the stage is the same and its outputs are not changed
+    :param work_dir:
+    :param signature:
+    :return: {"options": , "result": } or None
+    """
+    marker = os.path.join(work_dir, STAGE_DONE)
+
+    if not os.path.isfile(marker):
+        return None
+
+    try:
+        with open(marker) as fh:
+            done = json.load(fh)
+    except ValueError:
+        LOG.warning("stage marker %r is broken" % marker)
+        return None
+
+    if done.get("signature") != json.loads(json.dumps(signature)):
+        LOG.info("the inputs or tools of stage %r changed" % work_dir)
+        return None
+
+    for path, sign in done.get("outputs", {}).items():
+        if file_signature(path) != sign:
+            LOG.info("output %r of stage %r changed" % (path, work_dir))
+            return None
+
+    LOG.info("stage %r was done, skip it" % work_dir)
+
+    return done
+
+
+def write_stage(work_dir, signature, options, result, outputs):
+    """
+    write the completion marker of a stage
+    :param work_dir:
+    :param signature:
+    :param options: the options of the stage
+    :param result: the result returned by the stage
+    :param outputs: the files checked when the stage is read
+    :return:
+    """
+    marker = os.path.join(work_dir, STAGE_DONE)
+    temp = "%s.%s" % (marker, os.getpid())
+
+    with open(temp, "w") as fh:
+        json.dump({
+            "signature": signature,
+            "options": options,
+            "result": result,
+            "outputs": OrderedDict([(i, file_signature(i)) for i in outputs])
+        }, fh, indent=2)
+
+    os.rename(temp, marker)
+
+    return marker
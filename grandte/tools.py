@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import json
+import hashlib
+import logging
+from multiprocessing.pool import ThreadPool
+
+from grandte.config import *
+
+
+LOG = logging.getLogger(__name__)
+__version__ = "1.0.0"
+__author__ = ("Xingguo Zhang",)
+__email__ = "invicoun@foxmail.com"
+__all__ = ["ToolRegistry", "REGISTRY", "check_tools"]
+
+PROBE_THREADS = 16
+
+
+def tool_paths(command):
+    """
+    the files a version command runs or lists, "export PATH=dir:$PATH;tool"
+    runs dir/tool
+    :param command:
+    :return:
+    """
+    command = command.replace("\\", "/")
+    paths = re.findall(r"/[^\s;:|'\"]+", command)
+
+    for dirs, tool in re.findall(r"PATH=([^\s;]+)\s*;\s*(\S+)", command):
+        for dir in dirs.split(":"):
+            if dir.startswith("/"):
+                paths.append(os.path.join(dir, tool))
+
+    return sorted(set([os.path.normpath(i) for i in paths]))
+
+
+def split_version(version):
+
+    return tuple([int(i) for i in re.findall(r"\d+", version)])
+
+
+class ToolRegistry(object):
+    """
+    probe the versions of tools, a version is cached in a json file by its
+    command and the mtimes of the files the command uses
+    """
+
+    def __init__(self, tools=SOFTWARE_VERSION, cache=TOOL_CACHE):
+        self.tools = tools
+        self.cache = cache
+        self.versions = {}
+        self.errors = {}
+        self._cached = None
+
+    def key(self, tool):
+
+        paths = []
+
+        for path in tool_paths(tool["GETVER"]):
+            # the mtime of a directory changes with any file in it
+            if os.path.isdir(path):
+                continue
+            if os.path.exists(path):
+                paths.append([path, os.path.getmtime(path)])
+            else:
+                paths.append([path, None])
+
+        return hashlib.md5(json.dumps([tool["GETVER"], tool["REGEXP"], paths]).encode("utf-8")).hexdigest()
+
+    def read_cache(self):
+
+        if self._cached is None:
+            self._cached = {}
+
+            if self.cache and os.path.isfile(self.cache):
+                try:
+                    with open(self.cache) as fh:
+                        self._cached = json.load(fh)
+                except ValueError:
+                    LOG.warning("tool cache %r is broken, probe all tools again" % self.cache)
+
+        return self._cached
+
+    def write_cache(self):
+
+        if not self.cache:
+            return 0
+
+        cached = self.read_cache()
+        dir = os.path.dirname(self.cache)
+
+        try:
+            if dir and not os.path.isdir(dir):
+                os.makedirs(dir)
+            temp = "%s.%s" % (self.cache, os.getpid())
+            with open(temp, "w") as fh:
+                json.dump(cached, fh, indent=2)
+            os.rename(temp, self.cache)
+        except (IOError, OSError) as e:
+            LOG.warning("can not write tool cache %r: %s" % (self.cache, e))
+
+        return 0
+
+    def run_probe(self, name):
+        """
+        run the version command of a tool
+        :param name:
+        :return: name, version, error
+        """
+        tool = self.tools[name]
+        output = os.popen(tool["GETVER"]).read().strip()
+        g = re.search("(%s)" % tool["REGEXP"], output)
+
+        if g:
+            return name, g.group(1), ""
+
+        return name, "", output or "no output of %r" % tool["GETVER"]
+
+    def probe(self, names=None, threads=PROBE_THREADS):
+        """
+        probe the versions of tools at the same time, cached versions are not probed
+        :param names: the names of tools, all tools if not set
+        :param threads:
+        :return: {name: version} of the tools probed successfully
+        """
+        names = list(self.tools) if names is None else names
+        cached = self.read_cache()
+        keys = {}
+        todo = []
+
+        for name in names:
+            if name not in self.tools:
+                self.errors[name] = "unknown tool"
+                continue
+
+            if name in self.versions:
+                continue
+
+            keys[name] = self.key(self.tools[name])
+
+            if keys[name] in cached:
+                self.versions[name] = cached[keys[name]]
+            else:
+                todo.append(name)
+
+        if todo:
+            LOG.info("probe the versions of %s" % ", ".join(todo))
+            pool = ThreadPool(min(max(threads, 1), len(todo)))
+
+            try:
+                results = pool.map(self.run_probe, todo)
+            finally:
+                pool.close()
+                pool.join()
+
+            for name, version, error in results:
+                if version:
+                    self.versions[name] = version
+                    cached[keys[name]] = version
+                    self.errors.pop(name, None)
+                else:
+                    self.errors[name] = error
+
+            self.write_cache()
+
+        return dict([(i, self.versions[i]) for i in names if i in self.versions])
+
+    def check(self, names=None, threads=PROBE_THREADS):
+        """
+        probe tools and raise an exception for all tools missing or older than MINVER
+        :param names:
+        :param threads:
+        :return: {name: version}
+        """
+        names = list(self.tools) if names is None else names
+        versions = self.probe(names, threads)
+        errors = []
+
+        for name in names:
+            if name not in versions:
+                errors.append("%s: %s" % (name, self.errors.get(name, "not found")))
+                continue
+
+            minver = self.tools[name].get("MINVER", "")
+
+            if minver and split_version(versions[name]) < split_version(minver):
+                errors.append("%s: version %s is older than %s" % (name, versions[name], minver))
+
+        if errors:
+            raise Exception("tools failed the check:\n%s" % "\n".join(errors))
+
+        LOG.info("checked the versions of %s" % ", ".join(names))
+
+        return versions
+
+    def version(self, tool):
+        """
+        the version of a tool in SOFTWARE_VERSION
+        :param tool: the config of the tool
+        :return:
+        """
+        for name in self.tools:
+            if self.tools[name] is tool:
+                break
+        else:
+            name, version, error = ToolRegistry({"tool": tool}, cache="").run_probe("tool")
+
+            if not version:
+                raise Exception(error)
+            return version
+
+        self.probe([name])
+
+        if name not in self.versions:
+            raise Exception(self.errors[name])
+
+        return self.versions[name]
+
+
+REGISTRY = ToolRegistry()
+
+
+def check_tools(names=None):
+    """
+    check the tools of a run before any task is submitted
+    :param names:
+    :return:
+    """
+    return REGISTRY.check(names)
@@ -32,7 +32,7 @@ def read_coords(file):
         yield line
 
 
-def coords2gff(file, source="Mite_Hunter", type="MITE"):
+def coords2gff(file, source="Mite_Hunter", type="MITE", tag=""):
 
     r = {}
 
@@ -40,6 +40,11 @@ def coords2gff(file, source="Mite_Hunter", type="MITE"):
     for line in read_coords(file):
         if (line[0] == 0) and (line[1] != line[7]):
             continue
+        # the candidates of several libraries mapped together, id is "tag__id"
+        if tag:
+            if not line[9].startswith("%s__" % tag):
+                continue
+            line[9] = line[9][len(tag)+2:]
         idy = float(line[6])
         
         if line[9] not in r:
@@ -69,6 +74,8 @@ def add_hlep_args(parser):
         help='Software for input sequence source, default=Mite_Hunter.')
     parser.add_argument('-t', '--type', metavar='STR', type=str, default="MITE",
         help='Type of input sequence，default=MITE.')
+    parser.add_argument('--tag', metavar='STR', type=str, default="",
+        help='Only keep the sequences tagged as "tag__id" and remove the tag.')
 
     return parser
 
@@ -87,13 +94,14 @@ name:
 attention:
     coords2gff.py seq.coords >seq.gff3
     coords2gff.py seq.coords --source Mite_Hunter --type MITE >seq.gff3
+    coords2gff.py all.coords --tag mite_hunter --source Mite_Hunter --type MITE >seq.gff3
 version: %s
 contact:  %s <%s>\
         ''' % (__version__, ' '.join(__author__), __email__))
 
     args = add_hlep_args(parser).parse_args()
 
-    coords2gff(args.coords, args.source, args.type)
+    coords2gff(args.coords, args.source, args.type, args.tag)
 
 
 if __name__ == "__main__":
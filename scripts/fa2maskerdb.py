@@ -4,9 +4,14 @@
 import os
 import re
 import sys
+import gzip
 import logging
 import argparse
 
+# the scripts run from the package, seqkit is next to them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from seqkit.FastaReader import yield_fasta_chunks
+
 LOG = logging.getLogger(__name__)
 
 __version__ = "1.0.0"
@@ -19,27 +24,14 @@ def read_fasta(file):
 
     '''Read fasta file'''
     if file.endswith(".gz"):
-        fp = gzip.open(file)
+        fp = gzip.open(file, "rb")
     else:
-        fp = open(file)
-
-    seq = ""
-    for line in fp:
-        if isinstance(line, bytes):
-            line = line.decode('utf-8')
-        line = line.strip()
-
-        if not line:
-            continue
-        if line.startswith(">"):
-            if seq:
-                yield seq.split("\n", 1)
-            seq = "%s\n" % line.strip(">").split()[0]
-            continue
-        seq += line
-    if seq:
-        yield seq.split("\n", 1)
-    fp.close()
+        fp = open(file, "rb")
+
+    # the sequences are parsed in blocks of bytes, not joined line by line
+    with fp:
+        for name, seq in yield_fasta_chunks(fp):
+            yield (name.split(None, 1) or [b""])[0].decode("utf-8"), seq.decode("utf-8")
 
 
 def fa2maskerdb(files, types=""):
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import logging
+import argparse
+
+LOG = logging.getLogger(__name__)
+
+__version__ = "1.0.0"
+__author__ = ("Xingguo Zhang",)
+__email__ = "invicoun@foxmail.com"
+__all__ = []
+
+
+def get_format(file):
+
+    name = file.lower()
+
+    if name.endswith((".gff", ".gff3")):
+        return "gff"
+    if name.endswith((".fa", ".fasta", ".fna")):
+        return "fasta"
+
+    return "tsv"
+
+
+def rename_id(id, seen, index, renamed):
+    """
+    rename an id already used by earlier shards, the same id of a shard is
+    always renamed to the same new id
+    :param id:
+    :param seen: ids of the earlier shards
+    :param index: the number of the shard
+    :param renamed: the renamed ids of this shard
+    :return:
+    """
+    if id in renamed:
+        return renamed[id]
+
+    if id in seen:
+        renamed[id] = "%s_s%s" % (id, index)
+        return renamed[id]
+
+    return id
+
+
+def gather_gff(files, out):
+
+    seen = set()
+    out.write("##gff-version 3\n")
+
+    for index, file in enumerate(files, 1):
+        ids = set()
+        renamed = {}
+
+        for line in open(file):
+            line = line.rstrip("\n")
+
+            if not line or line.startswith("#"):
+                continue
+
+            line = line.split("\t")
+
+            if len(line) == 9:
+                attrs = []
+
+                for attr in line[8].split(";"):
+                    key, _, value = attr.partition("=")
+
+                    if key == "ID":
+                        value = rename_id(value, seen, index, renamed)
+                        ids.add(value)
+                    elif key == "Parent":
+                        value = ",".join([rename_id(i, seen, index, renamed) for i in value.split(",")])
+
+                    attrs.append("%s=%s" % (key, value) if _ else attr)
+
+                line[8] = ";".join(attrs)
+
+            out.write("%s\n" % "\t".join(line))
+
+        seen |= ids
+
+    return 0
+
+
+def gather_fasta(files, out):
+
+    seen = set()
+
+    for index, file in enumerate(files, 1):
+        ids = set()
+        renamed = {}
+
+        for line in open(file):
+
+            if line.startswith(">"):
+                parts = line[1:].rstrip("\n").split(None, 1)
+                parts[0] = rename_id(parts[0], seen, index, renamed)
+                ids.add(parts[0])
+                line = ">%s\n" % " ".join(parts)
+
+            out.write(line)
+
+        seen |= ids
+
+    return 0
+
+
+def gather_tsv(files, out):
+
+    header = True
+
+    for file in files:
+        for line in open(file):
+
+            # keep the comment lines of the first shard only
+            if line.startswith("#") and not header:
+                continue
+
+            out.write(line)
+
+        header = False
+
+    return 0
+
+
+def gather_shards(files, format=""):
+
+    format = format or get_format(files[0])
+
+    if format == "gff":
+        gather_gff(files, sys.stdout)
+    elif format == "fasta":
+        gather_fasta(files, sys.stdout)
+    else:
+        gather_tsv(files, sys.stdout)
+
+    return 0
+
+
+def add_args(parser):
+
+    parser.add_argument("files", nargs='+', metavar="FILE", type=str,
+        help="Input the outputs of shards in order.")
+    parser.add_argument("-f", "--format", choices=["gff", "fasta", "tsv"], default="",
+        help="Format of the files, detected by the extension if not set.")
+
+    return parser
+
+
+def main():
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="[%(levelname)s] %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='''
+name:
+    gather_shards.py  Gather the GFF, FASTA or table outputs of genome shards,
+                      ids used by an earlier shard are renamed to id_s<shard>
+
+attention:
+    gather_shards.py shard1.gff3 shard2.gff3 >all.gff3
+
+version: %s
+contact:  %s <%s>\
+        ''' % (__version__, " ".join(__author__), __email__))
+
+    args = add_args(parser).parse_args()
+
+    gather_shards(args.files, args.format)
+
+
+if __name__ == "__main__":
+    main()
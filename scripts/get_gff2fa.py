@@ -7,6 +7,12 @@ import sys
 import logging
 import argparse
 
+# the scripts run from the package, seqkit is next to them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from seqkit.TwoBit import open_genome
+from seqkit.FastaIndex import reverse_complement
+from seqkit.FastaReader import open_stream, yield_fasta_chunks
+
 
 LOG = logging.getLogger(__name__)
 
@@ -26,64 +32,6 @@ def read_gff(file):
         yield line.split("\t")
 
 
-def read_fasta(file):
-
-    '''Read fasta file'''
-    if file.endswith(".gz"):
-        fp = gzip.open(file)
-    elif file.endswith(".fasta") or file.endswith(".fa"):
-        fp = open(file)
-    else:
-        raise Exception("%r file format error" % file)
-
-    seq = []
-    for line in fp:
-        if isinstance(line, bytes):
-            line = line.decode('utf-8')
-        line = line.strip()
-
-        if not line:
-            continue
-        if line.startswith(">"):
-            line = line.strip(">")
-            if len(seq) == 2:
-                yield seq
-            seq = []
-            seq.append(line.split()[0])
-            continue
-        if len(seq) == 2:
-            seq[1] += line
-        else:
-            seq.append(line)
-
-    if len(seq) == 2:
-        yield seq
-    fp.close()
-
-
-def complement(seq):
-
-    cdict = {"A": "T",
-        "T": "A",
-        "G": "C",
-        "C": "G"
-    }
-
-    seq = list(seq.upper())
-    nseq = ""
-    for i in seq:
-        nseq += cdict[i]
-
-    return nseq
-
-
-def reverse_complement(seq):
-
-    seq = seq[::-1]
-
-    return complement(seq)
-
-
 def split_attr(attributes):
 
     r = {}
@@ -100,44 +48,109 @@ def split_attr(attributes):
     return r
 
 
-def get_gff2fa(fasta, gff, types):
-
-    data = {}
-
+def read_intervals(gff, types, out, data):
+    """
+    read the intervals of a type in a gff, an interval with start > end is
+    on the minus strand
+    :param gff:
+    :param types: the type of features, "all" for all types
+    :param out: the output stream of the intervals
+    :param data: {seqid: [[id, start, end, strand, out]]} to add the intervals
+    :return: data
+    """
     for line in read_gff(gff):
         if (types != line[2]) and (types != "all"):
             continue
-        if line[0] not in data:
-            data[line[0]] = []
 
         attr = split_attr(line[8])
-        data[line[0]].append([attr["ID"], int(line[3]), int(line[4])])
+        start, end = int(line[3]), int(line[4])
+        strand = "+"
+
+        if start >= end:
+            strand = "-"
+            start, end = end, start
+
+        data.setdefault(line[0], []).append([attr["ID"], start, end, strand, out])
+
+    return data
+
+
+def yield_sequences(genome, data):
+    """
+    yield the intervals of genome, the sequences are read one at a time
+    from the 2bit store or fasta index of genome, or streamed from the fasta
+    :param genome:
+    :param data: see read_intervals
+    :return: (interval, sequence)
+    """
+    try:
+        index = open_genome(genome)
+    except ValueError as e:
+        LOG.warning("%s, stream the genome" % e)
+        index = None
+
+    if index:
+        # only the bytes of the intervals are read
+        for seqid in index.names():
+            for interval in data.get(seqid, []):
+                yield interval, index.fetch(seqid, interval[1], interval[2], interval[3])
+        index.close()
+
+        return
+
+    with open_stream(genome) as stream:
+        for name, seq in yield_fasta_chunks(stream):
+            seqid = (name.split(None, 1) or [b""])[0].decode("utf-8")
+
+            for interval in data.get(seqid, []):
+                nseq = seq[interval[1] - 1:interval[2]]
+                if interval[3] == "-":
+                    nseq = reverse_complement(nseq)
+                yield interval, nseq.decode("utf-8")
+
+
+def extract_gff2fa(genome, extracts):
+    """
+    extract the sequences of several gff files in one pass of genome
+    :param genome:
+    :param extracts: a list of (gff, type, output), stdout if output is not set
+    :return:
+    """
+    data = {}
+    outs = {}
 
-    for seqid, seq in read_fasta(fasta):
-        if seqid not in data:
-            continue
-        for rnaid, start, end in data[seqid]:
-            direct = "+"
-            if start >= end:
-                direct = "-"
-                start, end = end, start
-            nseq = seq[start-1:end]
-            if direct == "-":
-                nseq = reverse_complement(nseq)
+    for gff, types, output in extracts:
+        if output and output not in outs:
+            outs[output] = open(output, "w")
+        read_intervals(gff, types, outs[output] if output else sys.stdout, data)
+
+    for (rnaid, start, end, strand, out), nseq in yield_sequences(genome, data):
+        # the sequences of the minus strand are in upper case as they always were
+        if strand == "-":
+            nseq = nseq.upper()
+        out.write(">%s desc=%s-%s\n%s\n" % (rnaid, start, end, nseq))
 
-            print(">%s desc=%s-%s\n%s" % (rnaid, start, end, nseq))
+    for out in outs.values():
+        out.close()
 
     return 0
 
 
+def get_gff2fa(fasta, gff, types):
+
+    return extract_gff2fa(fasta, [(gff, types, "")])
+
+
 def add_hlep_args(parser):
 
-    parser.add_argument('gff', metavar='FILE', type=str,
-        help='Input gff file')
+    parser.add_argument('gff', metavar='FILE', type=str, nargs='?', default='',
+        help='Input gff file, written to stdout')
     parser.add_argument('-g', '--genome', metavar='FILE', type=str, required=True,
         help='Input genome file.')
     parser.add_argument('-tp', '--types', choices=["CDS", "rRNA", "tRNA", "gene", "MITE", "SINE", "repeat_region", "all"], default="MITE",
         help='Input the type of extraction sequence,　default=MITE.')
+    parser.add_argument('-e', '--extract', metavar=('GFF', 'TYPE', 'OUTPUT'), nargs=3, action='append', default=[],
+        help='Extract the sequences of a type (or all) in a gff to a fasta, can be repeated to serve several gff files in one pass of the genome.')
 
     return parser
 
@@ -154,14 +167,22 @@ def main():
 name:
     get_gff2fa.py: Extract the sequence of the specified type according to the gff problem
 attention:
-    get_gff2fa.py MITE.gff3 -s genome.fasta -t MITE >MITE.fasta
+    get_gff2fa.py MITE.gff3 -g genome.fasta -tp MITE >MITE.fasta
+    get_gff2fa.py -g genome.fasta -e MITE.gff3 MITE MITE.fasta -e LTR.gff all LTR.fasta
 version: %s
 contact:  %s <%s>\
         ''' % (__version__, ' '.join(__author__), __email__))
 
     args = add_hlep_args(parser).parse_args()
 
-    get_gff2fa(args.genome, args.gff, args.types)
+    extracts = [tuple(i) for i in args.extract]
+
+    if args.gff:
+        extracts.insert(0, (args.gff, args.types, ""))
+    if not extracts:
+        parser.error("a gff or --extract is required")
+
+    extract_gff2fa(args.genome, extracts)
 
 
 if __name__ == "__main__":
@@ -7,6 +7,11 @@ import sys
 import logging
 import argparse
 
+# the scripts run from the package, seqkit is next to them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from seqkit.bgzf import BgzfWriter
+from seqkit.TwoBit import open_genome
+
 
 LOG = logging.getLogger(__name__)
 
@@ -106,17 +111,41 @@ def format_seq(seq, length=100):
     return "\n".join(r)
 
 
-def gff2masked(file, genome, mask_all=None, model="softmask"):
+def gff2masked(file, genome, mask_all=None, model="softmask", output=""):
 
     data = read_masked_gff(file)
 
-    for seqid, seq in read_fasta(genome):
+    if output.endswith(".gz"):
+        out = BgzfWriter(output)
+    elif output:
+        out = open(output, "w")
+    else:
+        out = sys.stdout
+
+    try:
+        store = open_genome(genome)
+    except ValueError as e:
+        LOG.warning("%s, read the whole genome" % e)
+        store = None
+
+    # a sequence is decoded from the shared store only when it is written
+    if store is not None:
+        records = ((seqid, store.fetch(seqid)) for seqid in store.names())
+    else:
+        records = read_fasta(genome)
+
+    for seqid, seq in records:
         seq = seq.upper()
         if seqid not in data:
-            print(">%s\n%s" % (seqid, seq))
+            out.write(">%s\n%s\n" % (seqid, seq))
             continue
         seq = mask_seq(seq, data[seqid], model)
-        print(">%s\n%s" % (seqid, format_seq(seq)))
+        out.write(">%s\n%s\n" % (seqid, format_seq(seq)))
+
+    if out is not sys.stdout:
+        out.close()
+    if store is not None:
+        store.close()
 
     return 0
 
@@ -134,6 +163,8 @@ def add_hlep_args(parser):
         help="""Choose a masking model,
              choices=[softmask, hardmaskN, hardmaskX]
              default=hardmaskN""")
+    parser.add_argument("-o", "--output", metavar="FILE", type=str, default="",
+        help="Output the masked genome, compressed by bgzf if it ends with .gz, default=stdout")
 
     return parser
 
@@ -169,7 +200,7 @@ contact:  %s <%s>\
 
     args = add_hlep_args(parser).parse_args()
 
-    gff2masked(args.gff, args.genome, args.mask_all, args.model)
+    gff2masked(args.gff, args.genome, args.mask_all, args.model, args.output)
 
 
 if __name__ == "__main__":
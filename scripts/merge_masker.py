@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import logging
+import argparse
+
+# the scripts run from the package, seqkit is next to them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from seqkit.split import read_windows, lift_window, liftback
+
+LOG = logging.getLogger(__name__)
+
+__version__ = "1.0.0"
+__author__ = ("Xingguo Zhang",)
+__email__ = "invicoun@foxmail.com"
+__all__ = []
+
+OUT_HEADER = """\
+   SW   perc perc perc  query      position in query           matching       repeat              position in  repeat
+score   div. del. ins.  sequence    begin     end    (left)    repeat         class/family         begin  end (left)   ID
+
+"""
+
+
+def merge_out(files, windows, orders, out):
+    """
+    merge the .out of RepeatMasker, the ID of a repeat in a chunk is
+    renumbered to be unique in the merged file, a repeat found in two
+    overlapped chunks is kept once
+    """
+    records = []
+    lengths = {}
+
+    for seqid, start, end, core_start, core_end in windows.values():
+        lengths[seqid] = max(lengths.get(seqid, 0), end)
+
+    for index, file in enumerate(files):
+        for line in open(file):
+            line = line.split()
+
+            # skip the header and the note of no repeat
+            if len(line) < 15 or not line[0].isdigit():
+                continue
+
+            line[4], line[5], line[6], core = lift_window(windows, line[4], int(line[5]), int(line[6]))
+
+            if not core:
+                continue
+
+            line[7] = "(%s)" % (lengths[line[4]] - line[6])
+            line[14] = (index, line[14])
+            records.append(line)
+
+    records.sort(key=lambda i: (orders[i[4]], i[5], i[6]))
+    width = max([len(i[4]) for i in records] + [9])
+    ids = {}
+    out.write(OUT_HEADER)
+
+    for line in records:
+        if line[14] not in ids:
+            ids[line[14]] = len(ids) + 1
+
+        line[14] = ids[line[14]]
+        out.write("%6s %5s %4s %4s  %-*s %9s %9s %11s %s %-14s %-19s %7s %6s %6s %6s%s\n" % (
+            line[0], line[1], line[2], line[3], width, line[4], line[5], line[6], line[7],
+            line[8], line[9], line[10], line[11], line[12], line[13], line[14],
+            " %s" % " ".join(line[15:]) if len(line) > 15 else ""))
+
+    return 0
+
+
+def merge_masker(bed, files, format=""):
+
+    if not format:
+        format = "gff" if files[0].lower().endswith((".gff", ".gff3")) else "out"
+
+    if format == "gff":
+        liftback(bed, files, sys.stdout)
+    else:
+        windows, orders = read_windows(bed)
+        merge_out(files, windows, orders, sys.stdout)
+
+    return 0
+
+
+def add_args(parser):
+
+    parser.add_argument("bed", metavar="FILE", type=str,
+        help="Input the bed of chunks (seqid, start, end, chunk id) of seqkit split_windows.")
+    parser.add_argument("files", nargs='+', metavar="FILE", type=str,
+        help="Input the .out or .out.gff of RepeatMasker of chunks.")
+    parser.add_argument("-f", "--format", choices=["out", "gff"], default="",
+        help="Format of the files, detected by the extension if not set.")
+
+    return parser
+
+
+def main():
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="[%(levelname)s] %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='''
+name:
+    merge_masker.py  Merge the RepeatMasker results of genome chunks, the
+                     chunk coordinates are lifted back to genome
+
+attention:
+    merge_masker.py chunks.bed chunk_1.fasta.out chunk_2.fasta.out >genome.out
+    merge_masker.py chunks.bed chunk_1.fasta.out.gff chunk_2.fasta.out.gff >genome.gff
+
+version: %s
+contact:  %s <%s>\
+        ''' % (__version__, " ".join(__author__), __email__))
+
+    args = add_args(parser).parse_args()
+
+    merge_masker(args.bed, args.files, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,11 @@ import argparse
 
 from collections import OrderedDict
 
+# the scripts run from the package, seqkit is next to them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from seqkit.TwoBit import open_genome
+from seqkit.FastaReader import fasta_lengths
+
 LOG = logging.getLogger(__name__)
 
 __version__ = "1.0.0"
@@ -17,33 +22,6 @@ __email__ = "invicoun@foxmail.com"
 __all__ = []
 
 
-def read_fasta(file):
-
-    '''Read fasta file'''
-    if file.endswith(".gz"):
-        fp = gzip.open(file)
-    else:
-        fp = open(file)
-
-    seq = ""
-    for line in fp:
-        if isinstance(line, bytes):
-            line = line.decode('utf-8')
-        line = line.strip()
-
-        if not line:
-            continue
-        if line.startswith(">"):
-            if seq:
-                yield seq.split("\n", 1)
-            seq = "%s\n" % line.strip(">").split()[0]
-            continue
-        seq += line
-    if seq:
-        yield seq.split("\n", 1)
-    fp.close()
-
-
 def read_tsv(file):
 
     for line in open(file):
@@ -65,9 +43,17 @@ def stat_transposon(gff, fasta, sample=""):
         ("Total", []),
     ])
 
+    # only the lengths are read, from the 2bit store or the .fai if the genome has one
+    try:
+        with open_genome(fasta) as genome:
+            lengths = [(i, genome.length(i)) for i in genome.names()]
+    except ValueError as e:
+        LOG.warning("%s, read the whole genome" % e)
+        lengths = fasta_lengths(fasta)
+
     genome_length = 0
-    for seqid, seq in read_fasta(fasta):
-        genome_length += len(seq)
+    for seqid, length in lengths:
+        genome_length += length
         if not sample:
             sample = seqid
 
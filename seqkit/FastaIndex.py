@@ -0,0 +1,217 @@
+import mmap
+import logging
+import os.path
+
+from collections import OrderedDict
+
+from .bgzf import is_bgzf, open_binary, BgzfFile
+
+LOG = logging.getLogger(__name__)
+
+try:
+    _maketrans = bytes.maketrans
+except AttributeError:
+    from string import maketrans as _maketrans
+
+# the complement of all IUPAC codes, the case is kept
+COMPLEMENT = _maketrans(b"ACGTURYKMSWBDHVNacgturykmswbdhvn",
+                        b"TGCAAYRMKSWVHDBNtgcaayrmkswvhdbn")
+
+
+def reverse_complement(seq):
+    """
+    reverse complement a sequence of str or bytes
+    :param seq:
+    :return:
+    """
+    if isinstance(seq, bytes):
+        return seq.translate(COMPLEMENT)[::-1]
+
+    return seq.encode("utf-8").translate(COMPLEMENT)[::-1].decode("utf-8")
+
+
+def build_fai(filename):
+    """
+    index a fasta file like "samtools faidx", the lines of a sequence must
+    have the same length except the last one
+    :param filename:
+    :return: OrderedDict {name: [length, offset, line bases, line width]}
+    """
+    index = OrderedDict()
+    offset = 0
+    name = None
+    short = False
+
+    LOG.info("Index fasta sequences of %r" % filename)
+
+    with open_binary(filename) as fh:
+        for line in fh:
+            if line.startswith(b">"):
+                name = (line[1:].split(None, 1) or [b""])[0].decode("utf-8")
+
+                if name in index:
+                    raise ValueError("sequence %r is repeated in %r" % (name, filename))
+
+                index[name] = [0, offset + len(line), 0, 0]
+                short = False
+            elif name is None:
+                if line.strip():
+                    raise ValueError("%r is not a fasta file" % filename)
+            else:
+                record = index[name]
+                bases = len(line.rstrip(b"\r\n"))
+
+                if bases and short:
+                    raise ValueError("the lines of sequence %r in %r have different lengths" % (name, filename))
+
+                if not record[2]:
+                    record[2] = bases
+                    record[3] = len(line)
+                elif bases != record[2] or len(line) != record[3]:
+                    if bases > record[2]:
+                        raise ValueError("the lines of sequence %r in %r have different lengths" % (name, filename))
+                    short = True
+
+                if not bases:
+                    short = True
+
+                record[0] += bases
+
+            offset += len(line)
+
+    return index
+
+
+def read_fai(fai):
+
+    index = OrderedDict()
+
+    for line in open(fai):
+        line = line.rstrip("\n").split("\t")
+
+        if len(line) < 5:
+            continue
+
+        index[line[0]] = [int(i) for i in line[1:5]]
+
+    return index
+
+
+def write_fai(index, fai):
+
+    with open(fai, "w") as fh:
+        for name, record in index.items():
+            fh.write("%s\t%s\t%s\t%s\t%s\n" % tuple([name] + record))
+
+    return fai
+
+
+class FastaIndex(object):
+    """
+    random access to the sequences of a fasta file by its .fai index, only
+    the bytes of the fetched intervals are read through mmap, or only their
+    blocks for a bgzf file
+    """
+
+    def __init__(self, filename, fai=""):
+        self.filename = os.path.abspath(filename)
+        self.fai = fai or "%s.fai" % self.filename
+        self._fh = None
+        self._mm = None
+        self._bgzf = None
+
+        # a bgzf file is read by the blocks in its .gzi index
+        if self.filename.endswith(".gz"):
+            if not is_bgzf(self.filename):
+                raise ValueError("%r is not compressed by bgzip, no random access" % filename)
+            self._bgzf = BgzfFile(self.filename)
+
+        self.index = self.load_index()
+
+        if self._bgzf is None:
+            self._fh = open(self.filename, "rb")
+            if os.path.getsize(self.filename):
+                self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def load_index(self):
+        """
+        read the .fai newer than the fasta, or build and write it
+        :return:
+        """
+        if os.path.isfile(self.fai) and os.path.getmtime(self.fai) >= os.path.getmtime(self.filename):
+            return read_fai(self.fai)
+
+        index = build_fai(self.filename)
+
+        try:
+            write_fai(index, self.fai)
+        except (IOError, OSError) as e:
+            LOG.warning("can not write the index %r: %s" % (self.fai, e))
+
+        return index
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def names(self):
+        return list(self.index.keys())
+
+    def length(self, name):
+        return self.index[name][0]
+
+    def fetch(self, seqid, start=1, end=0, strand="+", binary=False):
+        """
+        fetch an interval of a sequence
+        :param seqid:
+        :param start: 1-based
+        :param end: 1-based and included, 0 for the end of the sequence
+        :param strand: "-" to reverse complement the interval
+        :param binary: return bytes
+        :return:
+        """
+        if seqid not in self.index:
+            raise KeyError("sequence %r is not in %r" % (seqid, self.filename))
+
+        length, offset, bases, width = self.index[seqid]
+        start = max(start, 1)
+        end = min(end or length, length)
+
+        if start > end:
+            seq = b""
+        else:
+            first = offset + (start - 1) // bases * width + (start - 1) % bases
+            last = offset + (end - 1) // bases * width + (end - 1) % bases + 1
+            if self._bgzf is not None:
+                seq = self._bgzf.read_at(first, last - first)
+            else:
+                seq = self._mm[first:last]
+            seq = seq.translate(None, b"\r\n")
+
+        if strand == "-":
+            seq = reverse_complement(seq)
+
+        if binary:
+            return seq
+
+        return seq.decode("utf-8")
+
+    def close(self):
+
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fh is not None:
+            self._fh.close()
+        if self._bgzf is not None:
+            self._bgzf.close()
+
+        return 0
@@ -1,10 +1,14 @@
-
 import gzip
 import logging
 import os.path
 
+from .bgzf import is_bgzf, open_bgzf
+
 LOG = logging.getLogger(__name__)
 ALLOWED_FASTA = [".fa", ".fasta", ".fa.gz", ".fasta.gz"]
+# bytes read from a file at a time
+BUFFER_SIZE = 1 << 20
+WHITESPACE = b" \t\r\n"
 
 
 def split_header(name):
@@ -26,15 +30,25 @@ class FastaRecord(object):
     object to process a fasta record
     """
     DELIMITER = ">"
+    __slots__ = ("_name", "_seq", "_id", "_description")
 
-    def __init__(self, name, seq):
+    def __init__(self, name, seq, check=True):
+        """
+        :param name:
+        :param seq: str, or bytes read in binary mode
+        :param check: check the record, records of the parser need no check
+        """
         try:
-            assert "\n" not in name
-            assert "\n" not in seq
-            assert self.DELIMITER not in seq
+            if check:
+                newline, delimiter = (b"\n", b">") if isinstance(seq, bytes) else ("\n", self.DELIMITER)
+                assert "\n" not in name
+                assert newline not in seq
+                assert delimiter not in seq
             self._name = name
             self._seq = seq
-            self._id, self._description = split_header(name)
+            # the header is split only when the id or description is used
+            self._id = None
+            self._description = None
         except AssertionError:
             raise ValueError("Invalid FASTA record data")
 
@@ -51,6 +65,9 @@ class FastaRecord(object):
         The id of the seq, equal to the FASTA header
         up to the first whitespace.
         """
+        if self._id is None:
+            self._id, self._description = split_header(self._name)
+
         return self._id
 
     @property
@@ -59,6 +76,9 @@ class FastaRecord(object):
         The description of the seq in the FASTA file, equal to
         the contents of the FASTA header following the first whitespace
         """
+        if self._id is None:
+            self._id, self._description = split_header(self._name)
+
         return self._description
 
     @property
@@ -92,7 +112,12 @@ class FastaRecord(object):
         str conversion
         :return:
         """
-        return ">%s\n%s" % (self.name, self.seq)
+        seq = self.seq
+
+        if not isinstance(seq, str):
+            seq = seq.decode("utf-8")
+
+        return ">%s\n%s" % (self.name, seq)
 
     def __len__(self):
         """
@@ -116,47 +141,128 @@ def check_format(filename):
         raise Exception(msg)
 
 
-def yield_fasta_records(stream):
+def yield_fasta_chunks(stream, keep_seq=True, buffer_size=BUFFER_SIZE):
     """
-    yield fastq records from stream
-    :param stream: a stream object
-    :return:
+    parse fasta from a stream in blocks of bytes, the whitespaces of the
+    sequence lines of a block are removed at once
+    :param stream: a stream object, binary mode is faster
+    :param keep_seq: yield the sequence, or only its length
+    :param buffer_size:
+    :return: (name, sequence or length), name and sequence are bytes
     """
-    string = ""
+    name = None
+    parts = []
+    length = 0
+    rest = b""
+
+    while True:
+        data = stream.read(buffer_size)
+
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
 
-    for line in stream:
-        if isinstance(line, bytes):
-            line = line.decode('utf-8')
-        line = line.strip()
+        if not data:
+            break
 
-        if not line:
-            continue
+        if rest:
+            data = rest + data
+            rest = b""
 
-        if string and line.startswith(">"):
-            yield FastaRecord.from_string(string)
-            string = ""
+        start = 0
 
-        string += "%s\n" % line
+        while start < len(data):
+            i = data.find(b">", start)
+            seq = data[start:] if i == -1 else data[start:i]
+            seq = seq.translate(None, WHITESPACE)
 
-    if string:
-        yield FastaRecord.from_string(string)
+            if seq:
+                if name is None:
+                    raise ValueError("String not recognized as a valid FASTA record")
+                if keep_seq:
+                    parts.append(seq)
+                length += len(seq)
 
+            if i == -1:
+                break
 
-def open_fasta(filename):
+            j = data.find(b"\n", i)
+
+            # the header is continued in the next block
+            if j == -1:
+                rest = data[i:]
+                break
+
+            if name is not None:
+                yield name, b"".join(parts) if keep_seq else length
+
+            name = data[i + 1:j].strip()
+            parts = []
+            length = 0
+            start = j + 1
+
+    if rest:
+        if name is not None:
+            yield name, b"".join(parts) if keep_seq else length
+        name = rest[1:].strip()
+        parts = []
+        length = 0
+
+    if name is not None:
+        yield name, b"".join(parts) if keep_seq else length
+
+
+def yield_fasta_records(stream, binary=False):
     """
-    read fasta file and return fasta records
+    yield fasta records from stream
+    :param stream: a stream object
+    :param binary: keep the sequences as bytes
+    :return:
+    """
+    for name, seq in yield_fasta_chunks(stream):
+        if not binary:
+            seq = seq.decode("utf-8")
+
+        yield FastaRecord(name.decode("utf-8"), seq, check=False)
+
+
+def open_stream(filename):
+    """
+    open a fasta file in binary mode, gzip or bgzf
     :param filename:
     :return:
     """
     check_format(filename)
     filename = os.path.abspath(filename)
-    mode = 'r'
-
-    LOG.info("Parse fasta sequences from %r" % filename)
 
     if filename.endswith(".gz"):
-        stream = gzip.open(filename, mode)
-    else:
-        stream = open(filename, mode)
+        # the blocks of bgzf are decompressed by threads
+        if is_bgzf(filename):
+            return open_bgzf(filename)
+        return gzip.open(filename, "rb")
+
+    return open(filename, "rb")
+
+
+def fasta_lengths(filename):
+    """
+    read the lengths of the sequences of a fasta file, no sequence is kept
+    :param filename:
+    :return: (id, length)
+    """
+    LOG.info("Parse the lengths of fasta sequences from %r" % filename)
+
+    with open_stream(filename) as stream:
+        for name, length in yield_fasta_chunks(stream, keep_seq=False):
+            yield split_header(name.decode("utf-8"))[0], length
+
+
+def open_fasta(filename, binary=False):
+    """
+    read fasta file and return fasta records
+    :param filename:
+    :param binary: keep the sequences as bytes, a memoryview of them slices without copy
+    :return:
+    """
+    LOG.info("Parse fasta sequences from %r" % filename)
 
-    return yield_fasta_records(stream)
+    return yield_fasta_records(open_stream(filename), binary)
@@ -1,8 +1,11 @@
 
+import io
 import gzip
 import logging
 import os.path
 
+from .bgzf import is_bgzf, open_bgzf
+
 LOG = logging.getLogger(__name__)
 ALLOWED_FASTQ = [".fq", ".fastq", ".fq.gz", ".fastq.gz"]
 
@@ -11,11 +14,14 @@ class FastqRecord(object):
     """
     Object to process a fastq record
     """
+    __slots__ = ("_description", "_seq", "_desc2", "_quality", "_id")
+
     def __init__(self, description, seq, desc2, quality):
         self._description = description[1:]
         self._seq = seq
         self._desc2 = desc2
         self._quality = quality
+        self._id = None
 
     @property
     def identifier(self):
@@ -32,7 +38,11 @@ class FastqRecord(object):
         up to the first whitespace.
         :return:
         """
-        return self._description.split()[0]
+        # the header is split only when the id is used
+        if self._id is None:
+            self._id = self._description.split()[0]
+
+        return self._id
 
     @property
     def seq(self):
@@ -57,7 +67,9 @@ class FastqRecord(object):
         :param right: the number of bases to be trimmed on ringht
         :return:
         """
-        return FastqRecord(self._description, self.seq[left:-right], self._desc2, self.quality[left:-right])
+        end = len(self._seq) - right
+
+        return FastqRecord("@" + self._description, self._seq[left:end], self._desc2, self._quality[left:end])
 
     @classmethod
     def from_string(cls, string):
@@ -98,8 +110,20 @@ def yield_fastq_records(stream):
     :return:
     """
 
-    n = 0
-    string = ""
+    for lines in yield_fastq_lines(stream):
+        assert lines[0].startswith("@")
+        assert lines[2].startswith("+")
+
+        yield FastqRecord(*lines)
+
+
+def yield_fastq_lines(stream):
+    """
+    yield the 4 lines of fastq records from stream, empty lines are skipped
+    :param stream: a stream object, text or binary
+    :return:
+    """
+    lines = []
 
     for line in stream:
         line = line.strip()
@@ -107,13 +131,28 @@ def yield_fastq_records(stream):
         if not line:
             continue
 
-        n += 1
-        string += "%s\n" % line
+        lines.append(line)
 
-        if n == 4:
-            yield FastqRecord.from_string(string)
-            n = 0
-            string = ""
+        if len(lines) == 4:
+            yield lines
+            lines = []
+
+
+def open_stream(filename):
+    """
+    open a fastq file in binary mode, gzip or bgzf
+    :param filename:
+    :return:
+    """
+    check_format(filename)
+    filename = os.path.abspath(filename)
+
+    if filename.endswith(".gz"):
+        if is_bgzf(filename):
+            return open_bgzf(filename)
+        return gzip.open(filename, "rb")
+
+    return open(filename, "rb")
 
 
 def open_fastq(filename):
@@ -128,7 +167,9 @@ def open_fastq(filename):
     mode = 'r'
 
     LOG.info("Parse fastq sequences from %r" % filename)
-    if filename.endswith(".gz"):
+    if filename.endswith(".gz") and is_bgzf(filename):
+        stream = io.TextIOWrapper(open_bgzf(filename))
+    elif filename.endswith(".gz"):
         stream = gzip.open(filename, mode)
     else:
         stream = open(filename, mode)
@@ -0,0 +1,380 @@
+import mmap
+import struct
+import logging
+import os.path
+
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+from .FastaIndex import FastaIndex, reverse_complement
+from .FastaReader import open_stream, yield_fasta_chunks, fasta_lengths
+
+LOG = logging.getLogger(__name__)
+
+# the 2bit format of UCSC, readable by twoBitToFa
+SIGNATURE = 0x1A412743
+BASES = b"TCAG"
+# bases packed at a time, a multiple of 4
+PACK_SIZE = 1 << 24
+
+
+def _marks(bases):
+    return bytes(bytearray([int(chr(i) in bases) for i in range(256)]))
+
+
+# the bytes of a block are marked by 1, the runs of marks are found by bytes.find
+N_BLOCK = _marks("Nn")
+MASK_BLOCK = _marks("abcdefghijklmnopqrstuvwxyz")
+# the IUPAC codes other than N are kept in a table next to the store
+IUPAC_BLOCK = _marks([chr(i) for i in range(256) if chr(i) not in "ACGTNacgtn"])
+# every byte not in ACGT is packed as T, as UCSC does
+PACK_TABLE = bytes(bytearray([max("TCAG".find(chr(i).upper()), 0) for i in range(256)]))
+# the base of each of the 4 positions of a packed byte
+UNPACK_TABLES = [bytes(bytearray([BASES[(i >> (6 - 2 * k)) & 3] for i in range(256)])) for k in range(4)]
+
+
+def pack_bases(seq):
+    """
+    pack a sequence into 2 bits a base, the first base in the high bits; the
+    codes of 4 bases (a byte each) are merged in big integers, no base is
+    visited in python
+    :param seq: bytes
+    :return: bytes of (len(seq) + 3) // 4
+    """
+    seq = seq.translate(PACK_TABLE)
+    seq += b"\0" * (-len(seq) % 4)
+    packed = []
+    masks = {}
+
+    for i in range(0, len(seq), PACK_SIZE):
+        block = seq[i:i + PACK_SIZE]
+        size = len(block)
+
+        if size not in masks:
+            masks[size] = (int.from_bytes(b"\x00\x0f" * (size // 2), "big"),
+                           int.from_bytes(b"\x00\x00\x00\xff" * (size // 4), "big"))
+        mask2, mask4 = masks[size]
+
+        number = int.from_bytes(block, "big")
+        number = (number | (number >> 6)) & mask2
+        number = (number | (number >> 12)) & mask4
+        packed.append(number.to_bytes(size, "big")[3::4])
+
+    return b"".join(packed)
+
+
+def unpack_bases(packed):
+    """
+    unpack 2-bit bases into upper case bases
+    :param packed:
+    :return: bytearray of 4 bases a byte
+    """
+    seq = bytearray(len(packed) * 4)
+
+    for k in range(4):
+        seq[k::4] = packed.translate(UNPACK_TABLES[k])
+
+    return seq
+
+
+def find_blocks(marks, seq):
+    """
+    the runs of the bases marked in a sequence
+    :param marks: a table of 256 bytes, 1 for the bases of blocks
+    :param seq:
+    :return: an array of starts, an array of sizes
+    """
+    starts = array("I")
+    sizes = array("I")
+    seq = seq.translate(marks)
+    start = seq.find(b"\x01")
+
+    while start != -1:
+        end = seq.find(b"\x00", start)
+        end = len(seq) if end == -1 else end
+        starts.append(start)
+        sizes.append(end - start)
+        start = seq.find(b"\x01", end)
+
+    return starts, sizes
+
+
+def little_endian(data):
+    """
+    the bytes of an array of uint32 in little endian
+    :param data:
+    :return:
+    """
+    if struct.pack("=I", 1) != struct.pack("<I", 1):
+        data = array(data.typecode, data)
+        data.byteswap()
+
+    return data.tobytes()
+
+
+def write_2bit(filename, out, version=None):
+    """
+    write the sequences of a fasta file to a 2bit store with its N blocks
+    and soft-masked blocks, other IUPAC codes are written to {out}.iupac
+    :param filename: a fasta file
+    :param out:
+    :param version: 0 for 32-bit offsets, 1 for 64-bit offsets, by the size of the genome if not set
+    :return: out
+    """
+    names = [(name, length) for name, length in fasta_lengths(filename)]
+
+    if version is None:
+        # the tables are not counted, the store is written again if they make it too large
+        version = 1 if sum([i[1] for i in names]) // 4 + 64 * len(names) > 0xffffffff else 0
+
+    LOG.info("Write the 2bit store of %r to %r" % (filename, out))
+
+    iupac = []
+    offset_format = "<Q" if version else "<I"
+    index_size = 16 + sum([1 + len(i[0].encode("utf-8")) + struct.calcsize(offset_format) for i in names])
+    offsets = []
+    temp = "%s.%s" % (out, os.getpid())
+
+    with open(temp, "wb") as fh:
+        fh.write(b"\0" * index_size)
+
+        with open_stream(filename) as stream:
+            for name, seq in yield_fasta_chunks(stream):
+                name = (name.split(None, 1) or [b""])[0].decode("utf-8")
+                offsets.append((name, fh.tell()))
+                n_starts, n_sizes = find_blocks(N_BLOCK, seq)
+                mask_starts, mask_sizes = find_blocks(MASK_BLOCK, seq)
+
+                for start, size in zip(*find_blocks(IUPAC_BLOCK, seq)):
+                    iupac.append("%s\t%s\t%s\n" % (name, start, seq[start:start + size].upper().decode("utf-8")))
+
+                fh.write(struct.pack("<II", len(seq), len(n_starts)))
+                fh.write(little_endian(n_starts) + little_endian(n_sizes))
+                fh.write(struct.pack("<I", len(mask_starts)))
+                fh.write(little_endian(mask_starts) + little_endian(mask_sizes))
+                fh.write(struct.pack("<I", 0))
+                fh.write(pack_bases(seq))
+
+        if not version and offsets and offsets[-1][1] > 0xffffffff:
+            fh.close()
+            os.remove(temp)
+            return write_2bit(filename, out, version=1)
+
+        if [i[0] for i in offsets] != [i[0] for i in names]:
+            raise ValueError("the sequences of %r are changed while it is read" % filename)
+
+        fh.seek(0)
+        fh.write(struct.pack("<IIII", SIGNATURE, version, len(offsets), 0))
+
+        for name, offset in offsets:
+            name = name.encode("utf-8")
+            fh.write(struct.pack("<B", len(name)) + name + struct.pack(offset_format, offset))
+
+    os.rename(temp, out)
+
+    if iupac:
+        with open("%s.iupac" % out, "w") as fh:
+            fh.write("".join(iupac))
+    elif os.path.exists("%s.iupac" % out):
+        os.remove("%s.iupac" % out)
+
+    return out
+
+
+class TwoBitFile(object):
+    """
+    random access to the sequences of a 2bit store through a read-only mmap,
+    all processes reading the store share its pages
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self._fh = open(self.filename, "rb")
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._records = {}
+
+        signature = struct.unpack("<I", self._mm[:4])[0]
+
+        if signature == SIGNATURE:
+            self._endian = "<"
+        elif struct.unpack(">I", self._mm[:4])[0] == SIGNATURE:
+            self._endian = ">"
+        else:
+            raise ValueError("%r is not a 2bit file" % filename)
+
+        version, count = struct.unpack(self._endian + "II", self._mm[4:12])
+        offset_format = self._endian + ("Q" if version else "I")
+        offset_size = struct.calcsize(offset_format)
+        self.index = OrderedDict()
+        i = 16
+
+        for n in range(count):
+            size = ord(self._mm[i:i + 1])
+            name = self._mm[i + 1:i + 1 + size].decode("utf-8")
+            i += 1 + size
+            self.index[name] = struct.unpack(offset_format, self._mm[i:i + offset_size])[0]
+            i += offset_size
+
+        self.iupac = self.load_iupac()
+
+    def load_iupac(self):
+
+        iupac = {}
+        table = "%s.iupac" % self.filename
+
+        if not os.path.isfile(table):
+            return iupac
+
+        for line in open(table):
+            line = line.rstrip("\n").split("\t")
+
+            if len(line) < 3:
+                continue
+
+            iupac.setdefault(line[0], ([], [], []))
+            iupac[line[0]][0].append(int(line[1]))
+            iupac[line[0]][1].append(len(line[2]))
+            iupac[line[0]][2].append(line[2].encode("utf-8"))
+
+        return iupac
+
+    def read_array(self, offset, number):
+
+        data = array("I")
+        data.frombytes(self._mm[offset:offset + 4 * number])
+
+        if struct.pack("=I", 1) != struct.pack(self._endian + "I", 1):
+            data.byteswap()
+
+        return data
+
+    def record(self, name):
+        """
+        read the tables of a sequence once
+        :param name:
+        :return: length, N starts, N sizes, mask starts, mask sizes, offset of the bases
+        """
+        if name in self._records:
+            return self._records[name]
+
+        if name not in self.index:
+            raise KeyError("sequence %r is not in %r" % (name, self.filename))
+
+        i = self.index[name]
+        length, number = struct.unpack(self._endian + "II", self._mm[i:i + 8])
+        n_starts = self.read_array(i + 8, number)
+        n_sizes = self.read_array(i + 8 + 4 * number, number)
+        i += 8 + 8 * number
+        number = struct.unpack(self._endian + "I", self._mm[i:i + 4])[0]
+        mask_starts = self.read_array(i + 4, number)
+        mask_sizes = self.read_array(i + 4 + 4 * number, number)
+        i += 4 + 8 * number + 4
+
+        self._records[name] = (length, n_starts, n_sizes, mask_starts, mask_sizes, i)
+
+        return self._records[name]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def names(self):
+        return list(self.index.keys())
+
+    def length(self, name):
+        return self.record(name)[0]
+
+    def fetch(self, seqid, start=1, end=0, strand="+", binary=False):
+        """
+        fetch an interval of a sequence, only the bytes of the interval are read
+        :param seqid:
+        :param start: 1-based
+        :param end: 1-based and included, 0 for the end of the sequence
+        :param strand: "-" to reverse complement the interval
+        :param binary: return bytes
+        :return:
+        """
+        length, n_starts, n_sizes, mask_starts, mask_sizes, offset = self.record(seqid)
+        start = max(start, 1) - 1
+        end = min(end or length, length)
+
+        if start >= end:
+            seq = bytearray()
+        else:
+            first = start // 4
+            seq = unpack_bases(self._mm[offset + first:offset + (end + 3) // 4])
+            seq = seq[start - first * 4:end - first * 4]
+
+            for n, i, j in self.blocks(n_starts, n_sizes, start, end):
+                seq[i - start:j - start] = b"N" * (j - i)
+
+            if seqid in self.iupac:
+                starts, sizes, bases = self.iupac[seqid]
+                for n, i, j in self.blocks(starts, sizes, start, end):
+                    seq[i - start:j - start] = bases[n][i - starts[n]:j - starts[n]]
+
+            for n, i, j in self.blocks(mask_starts, mask_sizes, start, end):
+                seq[i - start:j - start] = seq[i - start:j - start].lower()
+
+        seq = bytes(seq)
+
+        if strand == "-":
+            seq = reverse_complement(seq)
+
+        if binary:
+            return seq
+
+        return seq.decode("utf-8")
+
+    @staticmethod
+    def blocks(starts, sizes, start, end):
+        """
+        the parts of sorted blocks in an interval
+        :return: (index of the block, start, end)
+        """
+        n = max(bisect_right(starts, start) - 1, 0)
+
+        while n < len(starts) and starts[n] < end:
+            i = max(starts[n], start)
+            j = min(starts[n] + sizes[n], end)
+
+            if i < j:
+                yield n, i, j
+            n += 1
+
+    def close(self):
+
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._fh.close()
+
+        return 0
+
+
+def open_genome(filename):
+    """
+    open a genome for random access: a 2bit store, the 2bit store written
+    next to the real path of a fasta, or the fasta by its .fai
+    :param filename:
+    :return: TwoBitFile or FastaIndex
+    """
+    if filename.endswith(".2bit"):
+        return TwoBitFile(filename)
+
+    path = os.path.realpath(filename)
+    store = "%s.2bit" % path
+
+    if os.path.isfile(store) and os.path.getmtime(store) >= os.path.getmtime(path):
+        return TwoBitFile(store)
+
+    return FastaIndex(filename)
@@ -1,4 +1,7 @@
 from .FastqReader import open_fastq
 from .FastaReader import open_fasta
-from .split import seq_split
+from .FastaIndex import FastaIndex
+from .TwoBit import TwoBitFile, open_genome
+from .batch import read_batches
+from .split import seq_split, liftback
 from .stat import seq_stat
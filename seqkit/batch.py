@@ -0,0 +1,135 @@
+import logging
+from array import array
+
+from .FastaReader import FastaRecord, open_stream as open_fasta_stream, yield_fasta_chunks
+from .FastqReader import FastqRecord, open_stream as open_fastq_stream, yield_fastq_lines
+from .common import get_seq_format
+
+LOG = logging.getLogger(__name__)
+
+# the records of a batch, a batch is cut earlier when its sequences are long
+BATCH_SIZE = 10000
+BATCH_BYTES = 1 << 26
+
+
+class RecordBatch(object):
+    """
+    records in columns: the names, the sequences joined in one buffer and
+    their offsets in it, and the qualities of fastq in the same offsets
+    """
+    __slots__ = ("names", "seqs", "offsets", "quals")
+
+    def __init__(self, names, seqs, offsets, quals=None):
+        """
+        :param names: a list of names (bytes), the headers without ">" or "@"
+        :param seqs: bytes of the sequences
+        :param offsets: an array of len(names) + 1 offsets, the sequence i is seqs[offsets[i]:offsets[i + 1]]
+        :param quals: bytes of the qualities, None for fasta
+        """
+        self.names = names
+        self.seqs = seqs
+        self.offsets = offsets
+        self.quals = quals
+
+    def __len__(self):
+        return len(self.names)
+
+    def lengths(self):
+        """
+        the lengths of the sequences
+        :return: an array
+        """
+        offsets = self.offsets
+
+        return array("q", [j - i for i, j in zip(offsets, offsets[1:])])
+
+    def id(self, i):
+        return (self.names[i].split(None, 1) or [b""])[0].decode("utf-8")
+
+    def seq(self, i):
+        return self.seqs[self.offsets[i]:self.offsets[i + 1]]
+
+    def format(self, i):
+        """
+        the record i in fasta or fastq, the sequence in one line
+        :param i:
+        :return: bytes
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+
+        if self.quals is None:
+            return b">" + self.names[i] + b"\n" + self.seqs[start:end] + b"\n"
+
+        return b"@" + self.names[i] + b"\n" + self.seqs[start:end] + b"\n+\n" + self.quals[start:end] + b"\n"
+
+    def records(self):
+        """
+        yield the records of the batch as FastaRecord or FastqRecord
+        :return:
+        """
+        for i in range(len(self)):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            name = self.names[i].decode("utf-8")
+            seq = self.seqs[start:end].decode("utf-8")
+
+            if self.quals is None:
+                yield FastaRecord(name, seq, check=False)
+            else:
+                yield FastqRecord("@" + name, seq, "+", self.quals[start:end].decode("utf-8"))
+
+
+def yield_batches(items, size, fastq=False):
+
+    names = []
+    seqs = []
+    quals = []
+    offsets = array("q", [0])
+
+    for item in items:
+        names.append(item[0])
+        seqs.append(item[1])
+        offsets.append(offsets[-1] + len(item[1]))
+
+        if fastq:
+            quals.append(item[2])
+
+        if len(names) >= size or offsets[-1] >= BATCH_BYTES:
+            yield RecordBatch(names, b"".join(seqs), offsets, b"".join(quals) if fastq else None)
+            names = []
+            seqs = []
+            quals = []
+            offsets = array("q", [0])
+
+    if names:
+        yield RecordBatch(names, b"".join(seqs), offsets, b"".join(quals) if fastq else None)
+
+
+def fastq_items(stream):
+
+    for name, seq, desc2, qual in yield_fastq_lines(stream):
+        if not name.startswith(b"@") or not desc2.startswith(b"+") or len(seq) != len(qual):
+            raise ValueError("String not recognized as a valid FASTQ record: %r" % name)
+
+        yield name[1:], seq, qual
+
+
+def read_batches(filename, size=BATCH_SIZE):
+    """
+    read a fasta or fastq file in batches of records, no object is created
+    for a record
+    :param filename:
+    :param size: the number of records of a batch
+    :return: RecordBatch
+    """
+    prefix, fmt = get_seq_format(filename)
+
+    LOG.info("Parse %s sequences in batches from %r" % (fmt, filename))
+
+    if fmt == "fasta":
+        with open_fasta_stream(filename) as stream:
+            for batch in yield_batches(yield_fasta_chunks(stream), size):
+                yield batch
+    else:
+        with open_fastq_stream(filename) as stream:
+            for batch in yield_batches(fastq_items(stream), size, fastq=True):
+                yield batch
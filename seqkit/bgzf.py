@@ -0,0 +1,380 @@
+import io
+import zlib
+import struct
+import logging
+import os.path
+
+from bisect import bisect_right
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = b"\x1f\x8b\x08\x04"
+# the data of a block, the same as bgzip of htslib
+BLOCK_SIZE = 0xff00
+EOF_BLOCK = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+# blocks decompressed or compressed together by the threads
+BATCH = 64
+THREADS = min(cpu_count(), 4)
+
+
+def is_bgzf(filename):
+    """
+    check whether a file is compressed by bgzip
+    :param filename:
+    :return:
+    """
+    with open(filename, "rb") as fh:
+        header = fh.read(18)
+
+    if len(header) < 18 or header[:4] != MAGIC:
+        return False
+
+    return header[12:14] == b"BC"
+
+
+def read_block(fh):
+    """
+    read a compressed block
+    :param fh:
+    :return: bytes of the block, b"" at the end of file
+    """
+    header = fh.read(12)
+
+    if not header:
+        return b""
+
+    if len(header) < 12 or header[:4] != MAGIC:
+        raise ValueError("%r is not a bgzf file" % fh.name)
+
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = fh.read(xlen)
+    size = 0
+    i = 0
+
+    while i < xlen:
+        sid, slen = extra[i:i + 2], struct.unpack("<H", extra[i + 2:i + 4])[0]
+        if sid == b"BC":
+            size = struct.unpack("<H", extra[i + 4:i + 6])[0] + 1
+        i += 4 + slen
+
+    if not size:
+        raise ValueError("%r has a gzip block without size" % fh.name)
+
+    return header + extra + fh.read(size - 12 - xlen)
+
+
+def decompress_block(block):
+
+    xlen = struct.unpack("<H", block[10:12])[0]
+    crc, isize = struct.unpack("<II", block[-8:])
+    data = zlib.decompress(block[12 + xlen:-8], -15)
+
+    if len(data) != isize or zlib.crc32(data) & 0xffffffff != crc:
+        raise ValueError("a bgzf block is broken")
+
+    return data
+
+
+def compress_block(data, level=6):
+
+    compress = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compress.compress(data) + compress.flush()
+    header = MAGIC + b"\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" + struct.pack("<H", len(cdata) + 25)
+
+    return header + cdata + struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+
+
+class BgzfRaw(io.RawIOBase):
+    """
+    read a bgzf file, the blocks are decompressed by threads while the
+    decompressed data is read
+    """
+
+    def __init__(self, filename, threads=THREADS):
+        self.name = filename
+        self._fh = open(filename, "rb")
+        self._pool = ThreadPool(threads) if threads > 1 else None
+        self._buffer = b""
+        self._pos = 0
+        self._next = None
+
+    def readable(self):
+        return True
+
+    def read_blocks(self):
+
+        blocks = []
+
+        for i in range(BATCH):
+            block = read_block(self._fh)
+            if not block:
+                break
+            blocks.append(block)
+
+        return blocks
+
+    def fill(self):
+        """
+        decompress the next batch of blocks, the batch after it is started at once
+        :return: False at the end of file
+        """
+        if self._pool is None:
+            self._buffer = b"".join([decompress_block(i) for i in self.read_blocks()])
+        else:
+            if self._next is None:
+                self._next = self._pool.map_async(decompress_block, self.read_blocks())
+            data = self._next.get()
+            blocks = self.read_blocks()
+            self._next = self._pool.map_async(decompress_block, blocks) if blocks else None
+            self._buffer = b"".join(data)
+
+        self._pos = 0
+
+        return len(self._buffer) > 0 or self._next is not None
+
+    def readinto(self, b):
+
+        while self._pos >= len(self._buffer):
+            if not self.fill():
+                return 0
+
+        n = min(len(b), len(self._buffer) - self._pos)
+        b[:n] = self._buffer[self._pos:self._pos + n]
+        self._pos += n
+
+        return n
+
+    def seek_block(self, offset):
+        """
+        move to a block by its offset in the compressed file
+        :param offset:
+        :return:
+        """
+        if self._next is not None:
+            self._next.wait()
+            self._next = None
+
+        self._fh.seek(offset)
+        self._buffer = b""
+        self._pos = 0
+
+        return offset
+
+    def close(self):
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._fh.close()
+
+        return io.RawIOBase.close(self)
+
+
+def open_bgzf(filename, threads=THREADS):
+    """
+    open a bgzf file as a binary stream
+    :param filename:
+    :param threads:
+    :return:
+    """
+    return io.BufferedReader(BgzfRaw(filename, threads), buffer_size=BLOCK_SIZE * 16)
+
+
+def open_binary(filename):
+    """
+    open a plain or bgzf file in binary mode
+    :param filename:
+    :return:
+    """
+    if is_bgzf(filename):
+        return open_bgzf(filename)
+
+    return open(filename, "rb")
+
+
+def build_gzi(filename):
+    """
+    index the blocks of a bgzf file like "bgzip -r", only the headers and
+    sizes of blocks are read
+    :param filename:
+    :return: a list of (compressed offset, uncompressed offset), the first block is not included
+    """
+    index = []
+    coffset = 0
+    uoffset = 0
+
+    with open(filename, "rb") as fh:
+        while True:
+            block = read_block(fh)
+
+            if not block:
+                break
+
+            size = struct.unpack("<I", block[-4:])[0]
+
+            # the empty block at the end of file is not indexed
+            if coffset and size:
+                index.append((coffset, uoffset))
+            coffset += len(block)
+            uoffset += size
+
+    return index
+
+
+def read_gzi(gzi):
+
+    with open(gzi, "rb") as fh:
+        number = struct.unpack("<Q", fh.read(8))[0]
+        data = struct.unpack("<%sQ" % (number * 2), fh.read(number * 16))
+
+    return list(zip(data[0::2], data[1::2]))
+
+
+def write_gzi(index, gzi):
+
+    with open(gzi, "wb") as fh:
+        fh.write(struct.pack("<Q", len(index)))
+        for coffset, uoffset in index:
+            fh.write(struct.pack("<QQ", coffset, uoffset))
+
+    return gzi
+
+
+class BgzfFile(object):
+    """
+    random access to the uncompressed data of a bgzf file by its .gzi index
+    """
+
+    def __init__(self, filename, gzi=""):
+        self.filename = filename
+        self.gzi = gzi or "%s.gzi" % filename
+
+        if os.path.isfile(self.gzi) and os.path.getmtime(self.gzi) >= os.path.getmtime(filename):
+            index = read_gzi(self.gzi)
+        else:
+            index = build_gzi(filename)
+            try:
+                write_gzi(index, self.gzi)
+            except (IOError, OSError) as e:
+                LOG.warning("can not write the index %r: %s" % (self.gzi, e))
+
+        index = [(0, 0)] + index
+        self._coffsets = [i[0] for i in index]
+        self._uoffsets = [i[1] for i in index]
+        self._fh = open(filename, "rb")
+
+    def read_at(self, offset, size):
+        """
+        read size bytes from offset of the uncompressed data
+        :param offset:
+        :param size:
+        :return:
+        """
+        i = bisect_right(self._uoffsets, offset) - 1
+        self._fh.seek(self._coffsets[i])
+        skip = offset - self._uoffsets[i]
+        data = []
+        length = 0
+
+        while length < skip + size:
+            block = read_block(self._fh)
+            if not block:
+                break
+            data.append(decompress_block(block))
+            length += len(data[-1])
+
+        return b"".join(data)[skip:skip + size]
+
+    def close(self):
+        self._fh.close()
+
+        return 0
+
+
+class BgzfWriter(object):
+    """
+    write a bgzf file, the blocks are compressed by threads
+    """
+
+    def __init__(self, filename, threads=THREADS, level=6, gzi=False):
+        self.filename = filename
+        self.level = level
+        self.gzi = gzi
+        self._fh = open(filename, "wb")
+        self._pool = ThreadPool(threads) if threads > 1 else None
+        self._buffer = []
+        self._length = 0
+        self._index = []
+        self._coffset = 0
+        self._uoffset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data):
+
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+
+        self._buffer.append(data)
+        self._length += len(data)
+
+        if self._length >= BLOCK_SIZE * BATCH:
+            self.flush()
+
+        return len(data)
+
+    def compress(self, data):
+        return compress_block(data, self.level)
+
+    def flush(self, final=False):
+        """
+        compress the full blocks of the buffer, and the rest too if final
+        :param final:
+        :return:
+        """
+        data = b"".join(self._buffer)
+        end = len(data) if final else len(data) // BLOCK_SIZE * BLOCK_SIZE
+        pieces = [data[i:i + BLOCK_SIZE] for i in range(0, end, BLOCK_SIZE)]
+
+        if self._pool is None:
+            blocks = [self.compress(i) for i in pieces]
+        else:
+            blocks = self._pool.map(self.compress, pieces)
+
+        for piece, block in zip(pieces, blocks):
+            if self._coffset:
+                self._index.append((self._coffset, self._uoffset))
+            self._fh.write(block)
+            self._coffset += len(block)
+            self._uoffset += len(piece)
+
+        self._buffer = [data[end:]] if end < len(data) else []
+        self._length = len(data) - end
+
+        return 0
+
+    def close(self):
+
+        if self._fh.closed:
+            return 0
+
+        self.flush(final=True)
+        self._fh.write(EOF_BLOCK)
+        self._fh.close()
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        if self.gzi:
+            write_gzi(self._index, "%s.gzi" % self.filename)
+
+        return 0
@@ -1,54 +1,81 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import re
 import sys
+import math
+import mmap
+import heapq
 import os.path
 import argparse
 import logging
+from bisect import bisect_right
+from collections import OrderedDict
 from multiprocessing import Pool
 
 
 from .common import fofn2list, mkdir, touch, get_seq_format
 from .FastaReader import open_fasta
-from .FastqReader import open_fastq
+from .FastaIndex import read_fai
+from .bgzf import BgzfWriter
+from .batch import read_batches
 from .common import __author__, __version__, __email__
 
 
 LOG = logging.getLogger(__name__)
 
+# the shortest run of N where a window may end
+GAP = re.compile(r"[Nn]{10,}")
+LINE_WIDTH = 60
+# bytes copied or scanned at a time
+COPY_SIZE = 1 << 24
 
-def split_record(records, mode, number, out_fmt, out_bed=False, out_dir="split", minlen=0):
-    """
 
-    :param records:
+def close_split(out, out_filename, parts, beds=None):
+
+    out.write(b"".join(parts))
+    out.close()
+
+    if beds is not None:
+        with open(out_filename + ".bed", "w") as fh:
+            fh.write("%s\n" % "\n".join(beds))
+
+    return out_filename
+
+
+def split_batches(batches, mode, number, out_fmt, out_bed=False, out_dir="split", minlen=0):
+    """
+    write the records of batches into files of number records or bases
+    :param batches: RecordBatch of read_batches
     :param mode:
     :param number:
-    :param out_fmt:
+    :param out_fmt: the files are compressed by bgzf if it ends with ".gz"
     :param out_bed:
     :param out_dir:
     :return:
     """
     r = []
-    n = 1
-
-    while True:
-
-        out_filename = os.path.join(out_dir, out_fmt.format(num=n))
+    out = None
+    parts = []
+    beds = []
+    count = 0
 
-        out = open(out_filename, "w")
-        beds = []
-
-        count = 0
-
-        for record in records:
-            id = record.id
-            length = len(record)
+    for batch in batches:
+        for i, length in enumerate(batch.lengths()):
             if length <= minlen:
                 continue
-            out.write(str(record) + "\n")
+
+            if out is None:
+                out_filename = os.path.join(out_dir, out_fmt.format(num=len(r) + 1))
+                out = BgzfWriter(out_filename) if out_filename.endswith(".gz") else open(out_filename, "wb")
+                parts = []
+                beds = []
+                count = 0
+
+            parts.append(batch.format(i))
 
             if out_bed:
-                beds.append("%s\t1\t%s\n" % (id, length))
+                beds.append("%s\t1\t%s\n" % (batch.id(i), length))
 
             if mode == "length":
                 count += length
@@ -56,30 +83,270 @@ def split_record(records, mode, number, out_fmt, out_bed=False, out_dir="split",
                 count += 1
 
             if count >= number:
-                break
+                r.append(close_split(out, out_filename, parts, beds if out_bed else None))
+                out = None
 
-        out.close()
+        # the records of a batch are written at once
+        if out is not None:
+            out.write(b"".join(parts))
+            parts = []
 
-        if out_bed:
-            with open(out_filename + ".bed", "w") as fh:
-                fh.write("%s\n" % "\n".join(beds))
+    if out is not None:
+        r.append(close_split(out, out_filename, parts, beds if out_bed else None))
 
-        if count == 0:
-            os.remove(out_filename)  # remove the empty file
-            if out_bed:
-                os.remove(out_filename + ".bed")
+    return r
+
+
+def plan_windows(seq, size, overlap=0):
+    """
+    cut a sequence into windows of at most size bases, a window ends at the
+    middle of the last N gap in its last quarter and the next one starts
+    there, or the next window overlaps it by overlap bases
+    :param seq:
+    :param size: the length of a window
+    :param overlap: the bases shared by two windows not cut at a gap
+    :return: a list of (start, end), 0-based and half open
+    """
+    assert 0 <= overlap < size, "the overlap must be shorter than the window"
+
+    length = len(seq)
+
+    if length <= size:
+        return [(0, length)]
+
+    gaps = [(i.start() + i.end()) // 2 for i in GAP.finditer(seq)]
+    windows = []
+    start = 0
+
+    while start + size < length:
+        end = start + size
+        i = bisect_right(gaps, end) - 1
+
+        if i >= 0 and gaps[i] > max(start, end - size // 4):
+            end = gaps[i]
+            windows.append((start, end))
+            start = end
         else:
-            r.append(out_filename)
+            windows.append((start, end))
+            start = end - overlap
 
-        if count < number:
-            break
+    windows.append((start, length))
 
-        n += 1
+    return windows
 
-    return r
 
+def pack_windows(lengths, bins):
+    """
+    pack windows into bins of about the same bases, the longest window is
+    put into the lightest bin first
+    :param lengths: the lengths of windows
+    :param bins: the number of bins
+    :return: a list of bins, a bin is a list of window indexes in order
+    """
+    heap = [(0, i) for i in range(max(min(bins, len(lengths)), 1))]
+    packed = [[] for i in heap]
+
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        count, n = heapq.heappop(heap)
+        packed[n].append(i)
+        heapq.heappush(heap, (count + lengths[i], n))
+
+    return [sorted(i) for i in packed if i]
+
+
+def write_window(out, id, seq, start, end):
+
+    out.write(">%s\n" % id)
+    out.write("".join(["%s\n" % seq[i:min(i + LINE_WIDTH, end)] for i in range(start, end, LINE_WIDTH)]))
+
+    return 0
+
+
+def split_windows(filename, size, overlap=0, bins=0, out_dir="split", prefix="", compress=False):
+    """
+    cut the sequences of a fasta file into windows and pack them into files
+    of about the same length, the windows are renamed to w1, w2... and their
+    places in the sequences are written to {prefix}.windows.bed of (seqid,
+    start, end, window id)
+    :param filename:
+    :param size: the length of a window
+    :param overlap: see plan_windows
+    :param bins: the number of files, about size bases a file if not set
+    :param out_dir:
+    :param prefix: the prefix of files, the prefix of filename if not set
+    :param compress: compress the fasta files by bgzf
+    :return: a list of fasta files, the bed file
+    """
+    prefix = prefix or get_seq_format(filename)[0]
+    bed = os.path.join(out_dir, "%s.windows.bed" % prefix)
+    windows = []
+
+    # the windows are planned first to pack them, the sequences are read again to write
+    for record in open_fasta(filename):
+        for start, end in plan_windows(record.seq, size, overlap):
+            windows.append((record.id, start, end, "w%s" % (len(windows) + 1)))
+
+    if not bins:
+        bins = int(math.ceil(sum([i[2] - i[1] for i in windows]) * 1.0 / size))
+
+    packed = pack_windows([i[2] - i[1] for i in windows], bins)
+    LOG.info("cut %r into %s windows in %s files" % (filename, len(windows), len(packed)))
+
+    files = []
+    outs = {}
+
+    for n, indexes in enumerate(packed):
+        files.append(os.path.join(out_dir, "%s.%s.fasta%s" % (prefix, n + 1, ".gz" if compress else "")))
+        out = BgzfWriter(files[-1]) if compress else open(files[-1], "w")
+        for i in indexes:
+            outs[i] = out
+
+    i = 0
+
+    for record in open_fasta(filename):
+        while i < len(windows) and windows[i][0] == record.id:
+            seqid, start, end, id = windows[i]
+            write_window(outs[i], id, record.seq, start, end)
+            i += 1
+
+    for out in set(outs.values()):
+        out.close()
+
+    with open(bed, "w") as fh:
+        fh.write("".join(["%s\t%s\t%s\t%s\n" % i for i in windows]))
+
+    return files, bed
+
+
+def read_windows(bed):
+    """
+    read the windows of split_windows, the core of a window ends at the
+    middle of its overlap with the next window, an element is kept in the
+    window whose core has its center
+    :param bed: the bed of (seqid, start, end, window id)
+    :return: {window id: (seqid, start, end, core start, core end)}, {seqid: index}
+    """
+    windows = OrderedDict()
+    orders = {}
+    last = None
+
+    for line in open(bed):
+        line = line.strip()
+
+        if not line or line.startswith("#"):
+            continue
+
+        seqid, start, end, id = line.split("\t")[:4]
+        start, end = int(start), int(end)
+        orders.setdefault(seqid, len(orders))
+        windows[id] = [seqid, start, end, start, end]
+
+        if last and last[0] == seqid and start < last[2]:
+            last[4] = windows[id][3] = (start + last[2]) // 2
+        last = windows[id]
+
+    return dict([(i, tuple(j)) for i, j in windows.items()]), orders
+
+
+def lift_window(windows, id, start, end):
+    """
+    lift an element of a window back to its sequence
+    :param windows: see read_windows
+    :param id: the window id
+    :param start: 1-based
+    :param end: 1-based and included
+    :return: seqid, start, end, whether the element is in the core of the window
+    """
+    if id not in windows:
+        raise Exception("window %r is not in the bed" % id)
+
+    seqid, offset, _, core_start, core_end = windows[id]
+    start += offset
+    end += offset
+
+    return seqid, start, end, core_start <= (start - 1 + end) // 2 < core_end
+
+
+def parse_attributes(string):
+
+    return OrderedDict([i.split("=", 1) for i in string.strip().strip(";").split(";") if "=" in i])
 
-def split_file(filename, index, mode, number, out_dir="split", minlen=0):
+
+def liftback(bed, files, out):
+    """
+    lift the gff of windows back to the sequences, an element found in two
+    overlapped windows is kept once, a child is kept with its parent, IDs
+    repeated in windows are renamed to {ID}_{window id}
+    :param bed: the bed of split_windows
+    :param files: the gff files of windows
+    :param out: the output stream
+    :return:
+    """
+    windows, orders = read_windows(bed)
+    records = []
+    used = set()
+    header = True
+
+    for file in files:
+        lines = []
+
+        for line in open(file):
+            line = line.rstrip("\r\n")
+
+            if not line:
+                continue
+
+            if line.startswith("#"):
+                if header and line.startswith("##gff-version"):
+                    out.write("%s\n" % line)
+                    header = False
+                continue
+
+            line = line.split("\t")
+            window = line[0]
+            line[0], line[3], line[4], core = lift_window(windows, window, int(line[3]), int(line[4]))
+            lines.append((window, line, parse_attributes(line[8]) if len(line) > 8 else OrderedDict(), core))
+
+        parents = dict([((i[0], i[2]["ID"]), i) for i in lines if "ID" in i[2]])
+        renames = {}
+
+        for window, line, attrs, core in lines:
+            # a child is kept with its parent in the same window
+            parent = attrs.get("Parent", "").split(",")[0]
+            depth = 0
+            while parent and (window, parent) in parents and depth < 16:
+                core = parents[(window, parent)][3]
+                parent = parents[(window, parent)][2].get("Parent", "").split(",")[0]
+                depth += 1
+
+            if not core:
+                continue
+
+            for key in ("ID", "Parent"):
+                if key not in attrs:
+                    continue
+                ids = []
+                for id in attrs[key].split(","):
+                    if (window, id) not in renames:
+                        renames[(window, id)] = id if id not in used else "%s_%s" % (id, window)
+                        used.add(renames[(window, id)])
+                    ids.append(renames[(window, id)])
+                attrs[key] = ",".join(ids)
+
+            if attrs:
+                line[8] = ";".join(["%s=%s" % i for i in attrs.items()])
+
+            records.append(line)
+
+    records.sort(key=lambda i: (orders[i[0]], i[3], -i[4]))
+
+    for line in records:
+        out.write("%s\n" % "\t".join(map(str, line)))
+
+    return len(records)
+
+
+def split_file(filename, index, mode, number, out_dir="split", minlen=0, compress=False, overlap=0, bins=0):
     """
 
     :param filename:
@@ -87,6 +354,9 @@ def split_file(filename, index, mode, number, out_dir="split", minlen=0):
     :param mode:
     :param number:
     :param out_dir:
+    :param compress: compress the fasta files by bgzf
+    :param overlap: the overlap of windows in window mode
+    :param bins: the number of files in window mode
     :return:
     """
     r = []
@@ -94,9 +364,14 @@ def split_file(filename, index, mode, number, out_dir="split", minlen=0):
     LOG.info("%s process %r" % (index, filename))
     prefix, fmt = get_seq_format(filename)
 
-    if fmt == "fasta":
-        r = split_record(open_fasta(filename), mode=mode, number=number,
-                         out_fmt="%s.{num}.fasta" % prefix, out_bed=True,
+    if mode == "window":
+        if fmt != "fasta":
+            raise Exception("only fasta files can be cut into windows: %r" % filename)
+        r, bed = split_windows(filename, size=number, overlap=overlap, bins=bins,
+                               out_dir=out_dir, prefix=prefix, compress=compress)
+    elif fmt == "fasta":
+        r = split_batches(read_batches(filename), mode=mode, number=number,
+                         out_fmt="%s.{num}.fasta%s" % (prefix, ".gz" if compress else ""), out_bed=True,
                          out_dir=out_dir, minlen=minlen)
     elif fmt == "fastq":
 
@@ -107,7 +382,7 @@ def split_file(filename, index, mode, number, out_dir="split", minlen=0):
         else:
             prefix = "%s_{num}.fastq" % prefix
 
-        r = split_record(open_fastq(filename), mode=mode, number=number,
+        r = split_batches(read_batches(filename), mode=mode, number=number,
                          out_fmt=prefix, out_bed=False, out_dir=out_dir, minlen=minlen)
     else:
         LOG.info("??? seq format")  # will raise exception in get_seq_format
@@ -115,17 +390,165 @@ def split_file(filename, index, mode, number, out_dir="split", minlen=0):
     return r
 
 
-def seq_split(filenames, mode, num, output_dir, concurrent=1, minlen=0):
+def scan_records(filename):
+    """
+    find the records of a plain fasta file by its .fai, or by a scan of the
+    ">" at the start of lines, no line of the file is parsed
+    :param filename:
+    :return: a list of (id, length, start, end), the byte offsets of a record with its header
+    """
+    size = os.path.getsize(filename)
+    fai = "%s.fai" % filename
+    records = []
+
+    if not size:
+        return records
+
+    with open(filename, "rb") as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if os.path.isfile(fai) and os.path.getmtime(fai) >= os.path.getmtime(filename):
+                # a header starts after the line break before the sequence of the .fai
+                for id, (length, offset, bases, width) in read_fai(fai).items():
+                    start = mm.rfind(b"\n", 0, max(offset - 1, 0)) + 1
+                    if mm[start:start + 1] != b">":
+                        raise ValueError("%r does not match %r" % (fai, filename))
+                    records.append([id, length, start, size])
+            else:
+                start = 0 if mm[:1] == b">" else mm.find(b"\n>") + 1
+
+                while start or mm[:1] == b">":
+                    head = mm.find(b"\n", start)
+                    head = size if head == -1 else head
+                    end = mm.find(b"\n>", head)
+                    end = size if end == -1 else end + 1
+                    length = end - head
+
+                    # the line breaks of the sequence are counted in blocks
+                    for i in range(head, end, COPY_SIZE):
+                        block = mm[i:min(i + COPY_SIZE, end)]
+                        length -= block.count(b"\n") + block.count(b"\r")
+
+                    id = mm[start + 1:head].split(None, 1)
+                    records.append([id[0].decode("utf-8") if id else "", length, start, size])
+
+                    if end >= size:
+                        break
+                    start = end
+        finally:
+            mm.close()
+
+    for i in range(len(records) - 1):
+        records[i][3] = records[i + 1][2]
+
+    return [tuple(i) for i in records]
+
+
+def copy_ranges(filename, ranges, out_filename):
     """
-    split fasta files, use multiprocess for parallel
+    copy byte ranges of a file to a new file, by os.sendfile in the kernel
+    if it is supported, a line break is added to a range not ending with it
+    :param filename:
+    :param ranges: a list of (start, end)
+    :param out_filename:
+    :return: [out_filename]
+    """
+    sendfile = getattr(os, "sendfile", None)
+
+    with open(filename, "rb") as src, open(out_filename, "wb", buffering=0) as dst:
+        for start, end in ranges:
+            offset = start
+
+            while offset < end:
+                if sendfile is not None:
+                    try:
+                        sent = sendfile(dst.fileno(), src.fileno(), offset, end - offset)
+                    except OSError:
+                        sendfile = None
+                        continue
+                else:
+                    src.seek(offset)
+                    sent = dst.write(src.read(min(COPY_SIZE, end - offset)))
+
+                if not sent:
+                    break
+                offset += sent
+
+            src.seek(end - 1)
+            if end > start and src.read(1) != b"\n":
+                dst.write(b"\n")
+
+    return [out_filename]
+
+
+def plan_copies(filename, mode, number, out_dir="split", minlen=0):
+    """
+    plan the byte ranges of the files split from a plain fasta file, the
+    records are copied without parsing, the bed of each file is written
+    :param filename:
+    :param mode:
+    :param number:
+    :param out_dir:
+    :param minlen:
+    :return: a list of (ranges, out filename)
+    """
+    prefix, fmt = get_seq_format(filename)
+    parts = []
+    part = []
+    count = 0
+
+    for record in scan_records(filename):
+        if record[1] <= minlen:
+            continue
+
+        part.append(record)
+        count += record[1] if mode == "length" else 1
+
+        if count >= number:
+            parts.append(part)
+            part = []
+            count = 0
+
+    if part:
+        parts.append(part)
+
+    r = []
+
+    for n, part in enumerate(parts):
+        out_filename = os.path.join(out_dir, "%s.%s.fasta" % (prefix, n + 1))
+        ranges = []
+
+        # the records next to each other are copied at once
+        for id, length, start, end in part:
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+
+        with open(out_filename + ".bed", "w") as fh:
+            fh.write("%s\n" % "\n".join(["%s\t1\t%s\n" % (i[0], i[1]) for i in part]))
+
+        r.append((ranges, out_filename))
+
+    return r
+
+
+def seq_split(filenames, mode, num, output_dir, concurrent=1, minlen=0, compress=False, overlap=0, bins=0):
+    """
+    split fasta files, use multiprocess for parallel, the records of a plain
+    fasta file are found by a scan and copied by several processes
     :param filenames: a list of fasta files
-    :param mode: length or number
-    :param num:
+    :param mode: length, number or window
+    :param num: the window length in window mode
     :param output_dir: output directory
     :param concurrent: see -h
+    :param compress: compress the fasta files by bgzf
+    :param overlap: the overlap of windows in window mode
+    :param bins: the number of files of a fasta file in window mode
     :return:
     """
-    assert mode in ["number", "length"]
+    assert mode in ["number", "length", "window"]
     num = int(num)
 
     output_dir = mkdir(output_dir)
@@ -147,7 +570,15 @@ def seq_split(filenames, mode, num, output_dir, concurrent=1, minlen=0):
 
     for i, file in enumerate(filenames):
         index = "%s/%s" % (i+1, file_num)
-        results.append(pool.apply_async(split_file, (file, index, mode, num, output_dir, minlen)))
+
+        # the records of a plain fasta file are copied as bytes, the files of a split are written at the same time
+        if mode != "window" and not compress and not file.endswith(".gz") and get_seq_format(file)[1] == "fasta":
+            LOG.info("%s scan %r" % (index, file))
+            for ranges, out_filename in plan_copies(os.path.abspath(file), mode, num, output_dir, minlen):
+                results.append(pool.apply_async(copy_ranges, (file, ranges, out_filename)))
+            continue
+
+        results.append(pool.apply_async(split_file, (file, index, mode, num, output_dir, minlen, compress, overlap, bins)))
 
     pool.close()
     pool.join()
@@ -168,17 +599,25 @@ def seq_split(filenames, mode, num, output_dir, concurrent=1, minlen=0):
 def split_args(parser):
 
     parser.add_argument("seq", metavar="FILES", nargs="+", help="files, '.gz' is accepted")
-    parser.add_argument("-m", "--mode", choices=["number", "length"], required=True, help="split by number or length")
-    parser.add_argument("-n", "--number", type=int, required=True, metavar="INT", help="the value of mode")
+    parser.add_argument("-m", "--mode", choices=["number", "length", "window"], required=True,
+                        help="split by number or length, or cut fasta into windows")
+    parser.add_argument("-n", "--number", type=int, required=True, metavar="INT",
+                        help="the value of mode, the window length in window mode")
     parser.add_argument("-o", "--output_dir", default="split", metavar="DIR", help="output directory")
     parser.add_argument("-c", "--concurrent", metavar='INT', type=int, default=1, help="number of concurrent process")
+    parser.add_argument("--bgzf", action="store_true", help="compress the fasta files by bgzf")
+    parser.add_argument("--overlap", type=int, default=0, metavar="INT",
+                        help="the overlap of windows not cut at N gaps, default=0")
+    parser.add_argument("--bins", type=int, default=0, metavar="INT",
+                        help="the number of files the windows are packed into, default=total length/window length")
 
     return parser
 
 
 def split(args):
 
-    seq_split(args.seq, args.mode, args.number, args.output_dir, args.concurrent)
+    seq_split(args.seq, args.mode, args.number, args.output_dir, args.concurrent, compress=args.bgzf,
+              overlap=args.overlap, bins=args.bins)
 
 
 def main():
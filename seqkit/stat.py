@@ -1,45 +1,189 @@
 #!/usr/bin/env python
 
 import sys
+import bisect
 import argparse
 import logging
+from array import array
 from multiprocessing import Pool
 
-from .FastqReader import open_fastq
-from .FastaReader import open_fasta
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .FastaReader import open_stream, yield_fasta_chunks
+from .batch import read_batches
 from .common import __author__, __version__, __email__
 from .common import get_seq_format
 
 
 LOG = logging.getLogger(__name__)
 
+# the soft-masked bases are counted too
+GC_BASES = (b"G", b"C", b"g", b"c")
+N_BASES = (b"N", b"n")
+
+
+def count_bases(seq, bases):
+
+    if not isinstance(seq, bytes):
+        seq = seq.encode("utf-8")
+
+    return sum([seq.count(i) for i in bases])
 
-def get_length(filename, index, min_len):
+
+def to_array(lengths):
     """
-    get the length of record
-    :param filename:
+    the lengths as a 64-bit integer array, numpy is used when installed
+    :param lengths: an array of length
     :return:
     """
-    r = []
+    if np is not None:
+        return np.frombuffer(lengths, dtype=np.int64)
+
+    return lengths
+
+
+def get_length(filename, index, min_len, gc=False):
+    """
+    get the length of record, the GC and N bases are counted in the same pass
+    :param filename:
+    :param index:
+    :param min_len:
+    :param gc: count the GC and N bases
+    :return: an array of lengths, GC bases, N bases
+    """
+    r = array("q")
+    gc_num = 0
+    n_num = 0
 
     LOG.info("%s process %r" % (index, filename))
 
     prefix, fmt = get_seq_format(filename)
 
-    if fmt == "fasta":
-        records = open_fasta(filename)
-    elif fmt == "fastq":
-        records = open_fastq(filename)
-    else:
-        LOG.info("%r is not a valid seq format!" % filename)
-        records = []
+    # only the lengths of fasta are needed, no sequence is kept
+    if fmt == "fasta" and not gc:
+        with open_stream(filename) as stream:
+            r.extend([length for name, length in yield_fasta_chunks(stream, keep_seq=False) if length >= min_len])
+
+        return to_array(r), gc_num, n_num
 
-    for record in records:
-        length = len(record)
-        if length >= min_len:
+    for batch in read_batches(filename):
+        lengths = batch.lengths()
+
+        # the bases of a batch are counted at once if no record is filtered
+        if not lengths or min(lengths) >= min_len:
+            r.extend(lengths)
+            if gc:
+                gc_num += count_bases(batch.seqs, GC_BASES)
+                n_num += count_bases(batch.seqs, N_BASES)
+            continue
+
+        for i, length in enumerate(lengths):
+            if length < min_len:
+                continue
             r.append(length)
+            if gc:
+                gc_num += count_bases(batch.seq(i), GC_BASES)
+                n_num += count_bases(batch.seq(i), N_BASES)
 
-    return r
+    return to_array(r), gc_num, n_num
+
+
+class LengthStat(object):
+    """
+    the lengths sorted once and their cumulative sums, all N* and >*kb
+    values are searched in them
+    """
+
+    def __init__(self, lengths):
+        """
+        :param lengths: arrays of length
+        """
+        if np is not None:
+            self.lengths = np.sort(np.concatenate(lengths))[::-1]
+            self.sums = np.cumsum(self.lengths)
+            self.total = int(self.sums[-1]) if len(self.sums) else 0
+        else:
+            self.lengths = sorted([i for r in lengths for i in r], reverse=True)
+            self.sums = []
+            self.total = 0
+            for i in self.lengths:
+                self.total += i
+                self.sums.append(self.total)
+
+        assert len(self.lengths), "no record is found"
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def longest(self):
+        return int(self.lengths[0])
+
+    def N(self, number):
+        """
+        return N{number} information of lengths
+        :param number: 0-100
+        :return: N{number}, number and sum of lengths >= it
+        """
+        cutoff = self.total * number / 100.0
+
+        if np is not None:
+            i = int(np.searchsorted(self.sums, cutoff, side="left"))
+        else:
+            i = bisect.bisect_left(self.sums, cutoff)
+
+        i = min(i, len(self.lengths) - 1)
+
+        return int(self.lengths[i]), i + 1, int(self.sums[i])
+
+    def over(self, number):
+        """
+        return the lengths over {number}
+        :param number:
+        :return: the shortest length >= number, number and sum of lengths >= number
+        """
+        if np is not None:
+            n = len(self.lengths) - int(np.searchsorted(self.lengths[::-1], number, side="left"))
+        else:
+            # the lengths are sorted in descending order
+            lo, hi = 0, len(self.lengths)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.lengths[mid] >= number:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            n = lo
+
+        if not n:
+            return 0, 0, 0
+
+        return int(self.lengths[n - 1]), n, int(self.sums[n - 1])
+
+    def write(self, filename, binary=False):
+        """
+        write out the lengths in descending order for plot
+        :param filename:
+        :param binary: write 64-bit little-endian integers, numpy.fromfile(filename, "<i8") reads them
+        :return:
+        """
+        if binary:
+            if np is not None:
+                data = self.lengths.astype("<i8")
+            else:
+                data = array("q", self.lengths)
+                if sys.byteorder == "big":
+                    data.byteswap()
+            with open(filename, "wb") as fh:
+                data.tofile(fh)
+        else:
+            lengths = self.lengths.tolist() if np is not None else self.lengths
+            with open(filename, "w") as fh:
+                fh.write("\n".join(map(str, lengths)))
+
+        return filename
 
 
 def N(number, lengths):
@@ -49,20 +193,7 @@ def N(number, lengths):
     :param lengths: a list of length
     :return:
     """
-    assert lengths
-
-    sum_length = sum(lengths)
-    accu_len = 0
-    accu_num = 0
-
-    for i in sorted(lengths, reverse=True):
-        accu_len += i
-        accu_num += 1
-
-        if accu_len >= sum_length*number/100:
-            return i, accu_num, accu_len
-
-    return i, accu_num, accu_len
+    return LengthStat([lengths]).N(number)
 
 
 def over(number, lengths):
@@ -72,18 +203,7 @@ def over(number, lengths):
     :param lengths:
     :return:
     """
-    assert lengths
-    accu_len = 0
-    accu_num = 0
-
-    for i in sorted(lengths, reverse=True):
-        if i < number:
-            return i, accu_num, accu_len
-
-        accu_len += i
-        accu_num += 1
-
-    return i, accu_num, accu_len
+    return LengthStat([lengths]).over(number)
 
 
 def fofn2list(fofn):
@@ -103,7 +223,7 @@ def fofn2list(fofn):
 
 def seq_stat(filenames, ngs=False, fofn=False, concurrent=1, min_len=0,
              ns=(10, 20, 30, 40, 50, 60, 70, 80, 90),
-             ls=(1, 5, 10, 20, 30, 40, 50, 60)):
+             ls=(1, 5, 10, 20, 30, 40, 50, 60), gc=False, binary=False):
     """
     statistics on sequence files
     :param filenames:
@@ -112,6 +232,8 @@ def seq_stat(filenames, ngs=False, fofn=False, concurrent=1, min_len=0,
     :param min_len:
     :param ns:
     :param ls:
+    :param gc: show the GC and N content
+    :param binary: write record.len as 64-bit integers
     :return:
     """
     # 1. get the lengths of each fastA/Q file
@@ -128,26 +250,31 @@ def seq_stat(filenames, ngs=False, fofn=False, concurrent=1, min_len=0,
     for i in range(len(file_list)):
         filename = file_list[i]
         index = "%s/%s" % (i+1, len(file_list))
-        results.append(pool.apply_async(get_length, (filename, index, min_len)))
+        results.append(pool.apply_async(get_length, (filename, index, min_len, gc)))
 
     pool.close()
     pool.join()
 
     lengths = []
+    gc_num = 0
+    n_num = 0
 
     for i, r in enumerate(results):
         LOG.info("%s/%s getting results of %r" % (i+1, len(results), file_list[i]))
-        lengths += r.get()
+        r, _gc, _n = r.get()
+        lengths.append(r)
+        gc_num += _gc
+        n_num += _n
 
-    # write lengths out
-    lengths = sorted(lengths, reverse=True)
+    # the lengths are sorted only once
+    stat = LengthStat(lengths)
 
     # 2. get the common statistics
-    total_length = sum(lengths)
-    reads_number = len(lengths)
+    total_length = stat.total
+    reads_number = len(stat)
     file_num = "{0:,}".format(len(file_list))
     average_length = "{0:,}".format(int(total_length / reads_number))
-    longest = "{0:,}".format(lengths[0])
+    longest = "{0:,}".format(stat.longest())
     _total_length = "{0:,}".format(total_length)
     reads_number = "{0:,}".format(reads_number)
 
@@ -161,6 +288,10 @@ average length:\t{average_length}
 longest length:\t{longest}
 """.format(**locals()))
 
+    if gc:
+        print("GC content:    \t%.2f%%" % (100.0*gc_num/max(total_length - n_num, 1)))
+        print("N content:     \t%.2f%%\n" % (100.0*n_num/total_length))
+
     # 2. get the N10-N90 statstics
     # length: the N{i} value; number: number of reads which length >= N{i}
     # if the input file is ngs short reads, skip the following steps.
@@ -170,7 +301,7 @@ longest length:\t{longest}
     print("Distribution of record length")
     print("%5s\t%15s\t%15s\t%10s" % ("Type", "Bases", "Count", "%Bases"))
     for i in ns:
-        read_length, read_number, read_length_sum = N(i, lengths)
+        read_length, read_number, read_length_sum = stat.N(i)
         print("%5s\t%15s\t%15s\t%10.2f" % ("N%s" % i,
                                            "{0:,}".format(read_length),
                                            "{0:,}".format(read_number),
@@ -178,15 +309,14 @@ longest length:\t{longest}
 
     # length: the sum of record length which length >= i; number: the number of record which length >= i
     for i in ls:
-        _, read_number, read_length_sum = over(i*1000, lengths)
+        _, read_number, read_length_sum = stat.over(i*1000)
         print("%5s\t%15s\t%15s\t%10.2f" % (">%skb" % i,
                                            "{0:,}".format(read_length_sum),
                                            "{0:,}".format(read_number),
                                            100.0*read_length_sum/total_length))
 
     # write out record length for plot
-    with open("record.len", "w") as fh:
-        fh.write("\n".join(map(str, lengths)))
+    stat.write("record.len", binary)
 
 
 def stat_args(parser):
@@ -204,13 +334,17 @@ def stat_args(parser):
                       help="the values of N* to show")
     parser.add_argument("--ls", metavar="INT", type=int, nargs="+", default=[1, 5, 10, 20, 30, 40, 50, 60],
                       help="the values of >*kb to show")
+    parser.add_argument("--gc", action="store_true", help="show the GC and N content")
+    parser.add_argument("--binary", action="store_true",
+                      help="write record.len as 64-bit little-endian integers instead of text")
 
     return parser
 
 
 def stat(args):
 
-    seq_stat(args.input, args.ngs, args.fofn, args.concurrent, args.min_len, args.ns, args.ls)
+    seq_stat(args.input, args.ngs, args.fofn, args.concurrent, args.min_len, args.ns, args.ls,
+             args.gc, args.binary)
 
 
 def main():
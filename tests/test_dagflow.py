@@ -0,0 +1,257 @@
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+from dagflow import DAG, Task, do_dag
+from dagflow.backend import BACKENDS, LocalBackend, SGEBackend, FakeBackend, RUNNING, DONE, ERROR, LOST
+from dagflow.cache import TaskCache
+from dagflow.journal import Journal, SUBMITTED
+
+# the module, the package exports the function of the same name
+do_dag_module = sys.modules["dagflow.do_dag"]
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    # the json and journal of a DAG without work_dir are written to the current directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(do_dag_module, "SAMPLE_TIME", 0.2)
+    BACKENDS["fake"] = FakeBackend()
+
+    return tmp_path
+
+
+def wait_state(backend, task, state, timeout=10):
+    end = time.time() + timeout
+
+    while time.time() < end:
+        if backend.poll([task])[task.id] == state:
+            return 1
+        time.sleep(0.05)
+
+    return 0
+
+
+def create_task(id, script, work_dir, type="fake", **kwargs):
+    task = Task(id=id, script=script, work_dir=str(work_dir), type=type, **kwargs)
+    task.init()
+
+    return task
+
+
+def test_fake_backend_runs_dag(work_dir):
+    a = create_task("a", "echo a >a.txt", work_dir / "a")
+    b = create_task("b", "cat %s >b.txt" % (work_dir / "a" / "a.txt"), work_dir / "b")
+    b.set_upstream(a)
+    b.init()
+    dag = DAG("fake_dag")
+    dag.add_task(a, b)
+
+    assert do_dag(dag, 10, 1) == 0
+    assert a.status == b.status == "success"
+    assert (work_dir / "b" / "b.txt").read_text() == "a\n"
+    assert b.start_time >= a.end_time - 1
+
+
+def test_fake_backend_error_and_lost(work_dir):
+    backend = BACKENDS["fake"]
+    task = create_task("sleep", "sleep 30", work_dir)
+    task.write_script()
+    task.run_id = backend.submit(task)
+
+    assert wait_state(backend, task, RUNNING)
+    backend.error(task.run_id)
+    assert backend.poll([task])[task.id] == ERROR
+
+    backend.jobs[task.run_id]["status"] = "r"
+    backend.down(backend.jobs[task.run_id]["node"])
+    assert backend.poll([task])[task.id] == LOST
+
+    backend.kill(task)
+    assert backend.poll([task])[task.id] == DONE
+
+
+def test_local_kill_task_ignoring_sigterm(work_dir):
+    backend = LocalBackend()
+    task = create_task("trap", "trap '' TERM\nsleep 30", work_dir, type="local")
+    task.write_script()
+    task.run_id = backend.submit(task)
+    time.sleep(0.5)
+
+    start = time.time()
+    backend.kill(task, grace=0.5)
+
+    assert time.time() - start < 5
+    assert task.run_id.returncode == -9
+
+
+def test_sge_failed_fetch_never_reports_done(work_dir):
+    backend = SGEBackend(min_interval=0)
+    task = create_task("job", "true", work_dir, type="sge")
+    task.run_id = "7"
+    backend.submitted["7"] = time.time()
+
+    def fail():
+        raise subprocess.CalledProcessError(1, "qstat")
+
+    backend.qstat = fail
+    backend.qhost = lambda: []
+    assert backend.poll([task]) == {"job": RUNNING}
+
+    backend.qstat = lambda: {"7": {"status": "r", "node": "node01"}}
+    assert backend.poll([task]) == {"job": RUNNING}
+
+    # a job missing after a failed fetch is not done
+    backend.qstat = fail
+    assert backend.poll([task]) == {"job": RUNNING}
+
+    backend.qstat = lambda: {}
+    assert backend.poll([task]) == {"job": DONE}
+
+
+def test_sge_attach_fetches_status_once(work_dir, monkeypatch):
+    backend = SGEBackend()
+    calls = []
+    backend.qstat = lambda: calls.append(1) or {"11": {"status": "r", "node": "n"}, "12": {"status": "Eqw", "node": "n"}}
+    backend.qhost = lambda: []
+    monkeypatch.setitem(BACKENDS, "sge", backend)
+
+    journal = Journal("attach.journal")
+    tasks = {}
+
+    for id, run_id in [("a", "11"), ("b", "12"), ("c", "13")]:
+        task = create_task(id, "sleep 1", work_dir / id, type="sge")
+        task.run_id = run_id
+        journal.write(task, SUBMITTED)
+        task.run_id = -1
+        tasks[id] = task
+
+    assert journal.attach(tasks) == 1
+    assert len(calls) == 1
+    assert tasks["a"].status == "running" and tasks["a"].run_id == "11"
+    assert tasks["b"].status == tasks["c"].status == "waiting"
+
+
+def test_local_attach_live_job(work_dir):
+    journal = Journal("local.journal")
+    task = create_task("live", "sleep 30", work_dir / "live", type="local")
+    task.run()
+    journal.write(task, SUBMITTED)
+
+    # the driver restarts with the same task
+    again = create_task("live", "sleep 30", work_dir / "live", type="local")
+
+    try:
+        assert journal.attach({"live": again}) == 1
+        assert again.status == "running"
+        assert again.run_id.pid == task.run_id.pid
+    finally:
+        BACKENDS["local"].kill(task, grace=0.5)
+
+
+def test_runs_in_work_dirs_keep_their_own_journal(work_dir):
+
+    for name in ["run1", "run2"]:
+        dag = DAG("same_id", str(work_dir / name))
+        dag.add_task(create_task("job", "true", work_dir / name / "job"))
+        assert do_dag(dag, 10, 1) == 0
+
+    for name in ["run1", "run2"]:
+        records = Journal(str(work_dir / name / "same_id.journal")).read()
+        assert records["job"]["event"] == "done"
+        assert os.path.isfile(str(work_dir / name / "same_id.json"))
+
+    assert not os.path.exists(str(work_dir / "same_id.journal"))
+
+
+def test_cache_restores_outputs_in_another_dir(work_dir):
+    counter = work_dir / "runs.txt"
+    script = "echo run >>%s\necho result >out.txt" % counter
+
+    for name in ["run1", "run2"]:
+        task = create_task("cached", script, work_dir / name, outputs=[str(work_dir / name / "out.txt")])
+        dag = DAG("cache_%s" % name)
+        dag.add_task(task)
+        assert do_dag(dag, 10, 1, cache_dir=str(work_dir / "cache")) == 0
+        assert (work_dir / name / "out.txt").read_text() == "result\n"
+
+    # the second run is restored from the cache without running
+    assert counter.read_text() == "run\n"
+
+
+def test_cache_hits_inputs_written_again_in_another_dir(work_dir):
+    counter = work_dir / "runs.txt"
+    script = "echo run >>%s\ncat %s >out.txt" % (counter, "{genome}")
+
+    for n, name in enumerate(["run1", "run2"]):
+        genome = work_dir / name / "genome.fasta"
+        genome.parent.mkdir()
+        genome.write_text(">chr1\nACGT\n")
+        # a fresh work dir writes the same input with another mtime
+        os.utime(str(genome), (1000000 + n * 3600, 1000000 + n * 3600))
+        task = create_task("cached", script.format(genome=genome), work_dir / name,
+                           inputs=[str(genome)], outputs=[str(work_dir / name / "out.txt")])
+        dag = DAG("input_%s" % name)
+        dag.add_task(task)
+        assert do_dag(dag, 10, 1, cache_dir=str(work_dir / "cache")) == 0
+        assert (work_dir / name / "out.txt").read_text() == ">chr1\nACGT\n"
+
+    assert counter.read_text() == "run\n"
+
+
+def test_cache_store_never_copies(work_dir, monkeypatch):
+    task = create_task("big", "echo big >big.txt", work_dir / "big", outputs=[str(work_dir / "big" / "big.txt")])
+    task.write_script()
+    subprocess.check_call(["sh", task.script_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def cross_device(source, target):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", cross_device)
+    cache = TaskCache(str(work_dir / "cache"))
+
+    assert cache.store(task) == 0
+    assert not os.path.isdir(cache.path(task.done_fingerprint()))
+
+
+def test_submit_tasks_packs_local_budget(work_dir, monkeypatch):
+    submitted = []
+
+    def run(task):
+        submitted.append(task.id)
+        task.status = "running"
+
+    monkeypatch.setattr(Task, "run", run)
+    monkeypatch.setattr(do_dag_module, "JOURNAL", None)
+    tasks = {}
+
+    for id, cpu, priority in [("large", 2, 30), ("large2", 2, 20), ("small", 1, 10)]:
+        task = create_task(id, "true", work_dir / id, type="local", option="-pe smp %s" % cpu)
+        task.priority = priority
+        tasks[id] = task
+
+    do_dag_module.submit_tasks(tasks, 10, max_cpus=3)
+
+    # large2 does not fit beside large, small backfills the free core
+    assert submitted == ["large", "small"]
+    assert tasks["large2"].status == "waiting"
+
+
+def test_profile_by_stage_groups_namespaces(work_dir):
+    from grandte.grand_profile import read_profiles
+
+    stage = DAG("stage")
+    stage.add_task(create_task("gt_run", "true", work_dir / "ltr"), create_task("merge", "true", work_dir / "ltr"))
+    stage.set_namespace("ltr")
+    dag = DAG("pipeline", str(work_dir))
+    dag.add_task(create_task("gt_index", "true", work_dir / "index"), *stage.tasks.values())
+    dag.to_json()
+
+    profiles = read_profiles(str(work_dir / "pipeline.json"), by="stage")
+
+    assert list(profiles) == ["gt_index", "ltr"]
+    assert profiles["ltr"]["tasks"] == 2
+    assert DAG.from_json(str(work_dir / "pipeline.json")).tasks["ltr_merge"].stage == "ltr"